@@ -563,7 +563,7 @@ class ReceiptAdmin(admin.ModelAdmin):
         "status",
     ]
     search_fields = ["items__code", "items__name"]
-    actions = ["re_calculate_total"]
+    actions = ["re_calculate_total", "verify_total"]
     exclude = ["end_time"]
     readonly_fields = ["start_time_str", "end_time_str"]
     list_select_related = ["clerk", "clerk__user", "counter"]
@@ -574,6 +574,17 @@ class ReceiptAdmin(admin.ModelAdmin):
             i.calculate_total()
             i.save(update_fields=["total"])
 
+    @with_description("Verify total sum of receipt")
+    def verify_total(self, request, queryset):
+        drifted = queryset.with_drifted_total()
+        if not drifted:
+            self.message_user(request, "All {} receipts have correct total.".format(queryset.count()),
+                              messages.SUCCESS)
+            return
+        for receipt in drifted:
+            self.message_user(request, "Receipt {}: stored total {} differs from calculated total {}.".format(
+                receipt.pk, receipt.total, receipt.calculated_total), messages.WARNING)
+
     def has_delete_permission(self, request, obj=None):
         return False
 
@@ -7,15 +7,16 @@ from django.http.response import (
     HttpResponseBadRequest,
     StreamingHttpResponse,
 )
-from django.shortcuts import get_object_or_404
 from django.utils.translation import gettext as _
 from django.views.decorators.http import require_http_methods
 
+from . import instrumentation
+from .event_cache import get_event_or_404
 from .models import (
     Clerk,
     Counter,
-    Event,
     EventPermission,
+    IdempotentResponse,
 )
 
 """
@@ -27,6 +28,7 @@ RET_ACCEPTED = 202  # Accepted, but not completed.
 RET_BAD_REQUEST = 400  # Bad request
 RET_UNAUTHORIZED = 401  # Unauthorized, though, not expecting Basic Auth...
 RET_FORBIDDEN = 403     # Forbidden
+RET_NOT_FOUND = 404  # Not found
 RET_CONFLICT = 409  # Conflict
 RET_AUTH_FAILED = 419  # Authentication timeout
 RET_LOCKED = 423  # Locked resource
@@ -47,7 +49,7 @@ class AjaxError(Exception):
 
 
 class AjaxFunc(object):
-    def __init__(self, func, url, method):
+    def __init__(self, func, url, method, idempotent=False):
         self.name = func.__name__               # name of the view function
         self.pkg = func.__module__
         self.func = func
@@ -55,6 +57,76 @@ class AjaxFunc(object):
         self.view_name = 'api_' + self.name     # view name for url config
         self.view = 'kirppu:' + self.view_name  # view name for templates
         self.method = method                    # http method for templates
+        self.idempotent = idempotent            # whether idempotency key is sent from templates
+
+
+IDEMPOTENCY_KEY_HEADER = "HTTP_X_IDEMPOTENCY_KEY"
+
+
+def idempotent(name):
+    """
+    Create view function decorator that stores a successful response by session and the key given
+    in X-Idempotency-Key request header. A repeated request with the same key gets the stored
+    response, without the view being called. Requests without the key are not affected.
+
+    The key is claimed before the view is called, so a repeated request arriving while the first one
+    is still running waits for it to finish, or gets a conflict if that is not possible.
+
+    The decorated view must run in the transaction that stores the response, so that either
+    both or neither of the changes are committed.
+
+    :param name: Name of the view, for checking that the key is not reused for another view.
+    :type name: str
+    :return: A decorator for a view function
+    :rtype: callable
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(request, *args, **kwargs):
+            key = request.META.get(IDEMPOTENCY_KEY_HEADER)
+            session_key = request.session.session_key
+            if not key or session_key is None:
+                return func(request, *args, **kwargs)
+            if len(key) > IdempotentResponse.KEY_LENGTH:
+                return AjaxError(RET_BAD_REQUEST, "Idempotency key is too long").render()
+
+            stored, claimed = IdempotentResponse.claim(session_key, key, name)
+            if not claimed:
+                if stored.endpoint != name:
+                    return AjaxError(RET_CONFLICT, "Idempotency key was already used for another request").render()
+                if stored.is_pending:
+                    return AjaxError(RET_CONFLICT, "Request with the same idempotency key is in progress").render()
+                return stored.as_response()
+
+            response = func(request, *args, **kwargs)
+            if 200 <= response.status_code < 300 and not response.streaming:
+                stored.complete(response)
+            else:
+                stored.release()
+            return response
+        return wrapper
+    return decorator
+
+
+def measured(name):
+    """
+    Create view function decorator that records instrumentation of the calls, see `instrumentation.measure`.
+    Should be the outermost decorator, so that transaction commit is included in the measurement.
+
+    :param name: Name of the AJAX function.
+    :type name: str
+    :return: A decorator for a view function.
+    :rtype: callable
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(request, *args, **kwargs):
+            with instrumentation.measure(name) as set_response:
+                response = func(request, *args, **kwargs)
+                set_response(response)
+            return response
+        return wrapper
+    return decorator
 
 
 def ajax_func(original, method='POST', params=None, defaults=None, staff_override=False, ignore_session=False):
@@ -99,7 +171,7 @@ def ajax_func(original, method='POST', params=None, defaults=None, staff_overrid
             #    return HttpResponseBadRequest("Invalid requester")
 
             # Prevent access if checkout is not active.
-            event = get_object_or_404(Event, slug=event_slug)
+            event = get_event_or_404(event_slug)
             if not staff_override and not event.checkout_active:
                 raise Http404()
 
@@ -144,25 +216,107 @@ def ajax_func(original, method='POST', params=None, defaults=None, staff_overrid
     return decorator
 
 
+class CheckoutContext(object):
+    """
+    Checkout objects associated with a request: Counter, Clerk (with User) and the Clerk's EventPermission.
+
+    The objects are resolved from session data at most once per request and then reused by
+    `require_user_features`, the view and `ItemStateLog` logging.
+    Use `CheckoutContext.of(request)` to get the instance for a request.
+    """
+    _REQUEST_ATTRIBUTE = "_kirppu_checkout"
+
+    def __init__(self, request):
+        self._request = request
+        self._counter = None
+        self._clerk = None
+        self._permission = None
+
+    @classmethod
+    def of(cls, request):
+        """
+        Get the context of given request, creating it if needed.
+
+        :rtype: CheckoutContext
+        """
+        context = getattr(request, cls._REQUEST_ATTRIBUTE, None)
+        if context is None:
+            context = cls(request)
+            setattr(request, cls._REQUEST_ATTRIBUTE, context)
+        return context
+
+    @property
+    def counter(self):
+        """
+        The Counter object associated with the request.
+
+        :rtype: Counter
+        :raises AjaxError: If session is invalid or counter is not found.
+        """
+        session = self._request.session
+        if "counter" not in session:
+            raise AjaxError(RET_UNAUTHORIZED, _(u"Not logged in."))
+
+        counter_id = session["counter"]
+        if self._counter is None or self._counter.pk != counter_id:
+            try:
+                self._counter = Counter.objects.get(pk=counter_id)
+            except Counter.DoesNotExist:
+                raise AjaxError(
+                    RET_UNAUTHORIZED,
+                    _(u"Counter has gone missing."),
+                )
+        return self._counter
+
+    @property
+    def clerk(self):
+        """
+        The Clerk object associated with the request. User and Event of the Clerk are fetched in the same query.
+
+        :rtype: Clerk
+        :raises AjaxError: If session is invalid or clerk is not found.
+        """
+        session = self._request.session
+        for key in ["clerk", "clerk_token", "counter"]:
+            if key not in session:
+                raise AjaxError(RET_UNAUTHORIZED, _(u"Not logged in."))
+
+        clerk_id = session["clerk"]
+        clerk_token = session["clerk_token"]
+
+        if self._clerk is None or self._clerk.pk != clerk_id:
+            try:
+                self._clerk = Clerk.objects.select_related("user", "event").get(pk=clerk_id)
+            except Clerk.DoesNotExist:
+                raise AjaxError(RET_UNAUTHORIZED, _(u"Clerk not found."))
+            self._permission = None
+
+        if self._clerk.access_key != clerk_token:
+            raise AjaxError(RET_UNAUTHORIZED, _(u"Bye."))
+
+        return self._clerk
+
+    @property
+    def permission(self):
+        """
+        EventPermission of the Clerk associated with the request.
+
+        :rtype: EventPermission
+        :raises AjaxError: If session is invalid or clerk is not found.
+        """
+        clerk = self.clerk
+        if self._permission is None:
+            self._permission = EventPermission.get(clerk.event, clerk.user)
+        return self._permission
+
+
 def get_counter(request):
     """
     Get the Counter object associated with a request.
 
     Raise AjaxError if session is invalid or counter is not found.
     """
-    if "counter" not in request.session:
-        raise AjaxError(RET_UNAUTHORIZED, _(u"Not logged in."))
-
-    counter_id = request.session["counter"]
-    try:
-        counter_object = Counter.objects.get(pk=counter_id)
-    except Counter.DoesNotExist:
-        raise AjaxError(
-            RET_UNAUTHORIZED,
-            _(u"Counter has gone missing."),
-        )
-
-    return counter_object
+    return CheckoutContext.of(request).counter
 
 
 def get_clerk(request):
@@ -171,22 +325,7 @@ def get_clerk(request):
 
     Raise AjaxError if session is invalid or clerk is not found.
     """
-    for key in ["clerk", "clerk_token", "counter"]:
-        if key not in request.session:
-            raise AjaxError(RET_UNAUTHORIZED, _(u"Not logged in."))
-
-    clerk_id = request.session["clerk"]
-    clerk_token = request.session["clerk_token"]
-
-    try:
-        clerk_object = Clerk.objects.get(pk=clerk_id)
-    except Clerk.DoesNotExist:
-        raise AjaxError(RET_UNAUTHORIZED, _(u"Clerk not found."))
-
-    if clerk_object.access_key != clerk_token:
-        raise AjaxError(RET_UNAUTHORIZED, _(u"Bye."))
-
-    return clerk_object
+    return CheckoutContext.of(request).clerk
 
 
 def require_user_features(counter=True, clerk=True, overseer=False, staff_override=False):
@@ -202,9 +341,9 @@ def require_user_features(counter=True, clerk=True, overseer=False, staff_overri
 
             if clerk or overseer:
                 # Thus call raises if clerk is not found.
-                clerk_obj = get_clerk(request)
+                get_clerk(request)
 
-                if overseer and not EventPermission.get(clerk_obj.event, clerk_obj.user).can_perform_overseer_actions:
+                if overseer and not CheckoutContext.of(request).permission.can_perform_overseer_actions:
                     raise AjaxError(RET_FORBIDDEN, _(u"Access denied."))
 
             return func(request, *args, **kwargs)
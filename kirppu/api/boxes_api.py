@@ -1,4 +1,6 @@
 # -*- coding: utf-8 -*-
+from decimal import Decimal
+
 from django.utils.translation import gettext as _
 
 from .common import (
@@ -78,7 +80,7 @@ def box_checkin(request, event, code, box_info):
     }
 
 
-@ajax_func("^box/item/reserve$", atomic=True)
+@ajax_func("^box/item/reserve$", atomic=True, idempotent=True)
 def box_item_reserve(request, event, box_number, box_item_count="1"):
     box_item_count = _parse_item_count(box_item_count)
     box = _get_box_or_404(box_number, event=event)
@@ -105,6 +107,7 @@ def box_item_reserve(request, event, box_number, box_item_count="1"):
             ReceiptItem(
                 item=item,
                 receipt=receipt,
+                event_id=receipt.event_id,
             )
             for item in items
         ]
@@ -112,8 +115,9 @@ def box_item_reserve(request, event, box_number, box_item_count="1"):
         ItemStateLog.objects.log_states(items, Item.STAGED, request=request)
         items.update(state=Item.STAGED)
 
+        entries = list(items.values("code", "price"))
         ReceiptItem.objects.bulk_create(rows)
-        receipt.calculate_total()
+        receipt.add_to_total(sum((entry["price"] for entry in entries), Decimal(0)))
         receipt.save(update_fields=("total",))
 
         result_items = [
@@ -121,7 +125,7 @@ def box_item_reserve(request, event, box_number, box_item_count="1"):
                 "code": entry["code"],
                 "price": decimal_to_transport(entry["price"]),
             }
-            for entry in items.values("code", "price")
+            for entry in entries
         ]
         ret = box.as_dict()
         del ret["item_price"]  # item_price assumes representative item has same price as ones being reserved.
@@ -137,7 +141,7 @@ def box_item_reserve(request, event, box_number, box_item_count="1"):
                         _("Only {} items of {} available for reservation.").format(len(candidates), box_item_count))
 
 
-@ajax_func('^box/item/release$', atomic=True)
+@ajax_func('^box/item/release$', atomic=True, idempotent=True)
 def box_item_release(request, event, box_number, box_item_count="1"):
     box_item_count = _parse_item_count(box_item_count)
     box = _get_box_or_404(box_number, event=event)
@@ -154,6 +158,7 @@ def box_item_release(request, event, box_number, box_item_count="1"):
 
     representative_item_id = box.representative_item_id
     items = list()
+    removed_total = Decimal(0)
 
     # Firstly remove representative item, if possible.
     box_items = sorted(box_items, key=lambda i: 0 if i.pk == representative_item_id else 1)
@@ -163,12 +168,13 @@ def box_item_release(request, event, box_number, box_item_count="1"):
         if len(items) == box_item_count:
             break
         removal_entry = remove_item_from_receipt(request, box_item, receipt, update_receipt=False)
+        removed_total += removal_entry.item.price
         items.append({
             "code": removal_entry.item.code,
             "price": decimal_to_transport(removal_entry.item.price),
         })
 
-    receipt.calculate_total()
+    receipt.add_to_total(-removed_total)
     receipt.save(update_fields=("total",))
 
     ret = box.as_dict()
@@ -1,13 +1,37 @@
 # -*- coding: utf-8 -*-
+from django.db import connection
+from django.db.models import F
 from django.http import Http404
 from django.utils.translation import gettext as _
 
 from ..ajax_util import AjaxError, RET_BAD_REQUEST, RET_CONFLICT
-from ..models import Box, Item, Receipt
+from ..models import Box, Item, Receipt, ReceiptItem
 
 __author__ = 'codez'
 
 
+def scan_item_query(for_update=False):
+    """
+    Query for Items looked up by checkout scanning endpoints.
+
+    Item type, vendor and box are joined in the same SELECT, and `vendor_event` is annotated,
+    so that the endpoints can use them without further queries. When locking for update,
+    only the Item row is locked.
+
+    :param for_update: If True, Items are retrieved for update.
+    :rtype: django.db.models.QuerySet
+    """
+    query = Item.objects \
+        .select_related("itemtype", "vendor", "box") \
+        .annotate(vendor_event=F("vendor__event_id"))
+    if for_update:
+        if connection.features.has_select_for_update_of:
+            query = query.select_for_update(of=("self",))
+        else:
+            query = query.select_for_update()
+    return query
+
+
 def get_item_or_404(code, for_update=False, event=None, **kwargs):
     """
     :param code: Item barcode to find.
@@ -19,10 +43,7 @@ def get_item_or_404(code, for_update=False, event=None, **kwargs):
     :raises Http404: If an Item matching the query does not exist.
     """
     try:
-        if for_update:
-            item = Item.get_item_by_barcode_for_update(code, **kwargs)
-        else:
-            item = Item.get_item_by_barcode(code, **kwargs)
+        item = scan_item_query(for_update).get(code=code, **kwargs)
     except Item.DoesNotExist:
         item = None
 
@@ -32,6 +53,10 @@ def get_item_or_404(code, for_update=False, event=None, **kwargs):
     if event is not None and item.vendor_event != event.id:
         raise AjaxError(RET_CONFLICT, "Item is not registered in this event!")
 
+    if item.box is not None and item.box.representative_item_id == item.pk:
+        # Box data is read through its representative item, which is already at hand.
+        item.box.representative_item = item
+
     return item
 
 
@@ -70,6 +95,21 @@ def item_state_conflict(item):
     )
 
 
+def item_receipts(item, **kwargs):
+    """
+    Query for Receipts the Item has been added to, and not removed from.
+
+    Receipt ids are read from the rows of the Item only, using the (item, action, receipt) index
+    of ReceiptItem, instead of joining rows of all Receipts.
+
+    :param item: Item, or Item id, to find the Receipts of.
+    :param kwargs: Extra query filters.
+    :rtype: django.db.models.QuerySet
+    """
+    receipt_ids = ReceiptItem.objects.filter(item=item, action=ReceiptItem.ADD).values("receipt_id")
+    return Receipt.objects.filter(pk__in=receipt_ids, **kwargs)
+
+
 def get_receipt(receipt_id, for_update=False):
     try:
         query = Receipt.objects
@@ -2,8 +2,9 @@
 from django.shortcuts import get_object_or_404
 
 from ..ajax_util import AjaxError, RET_CONFLICT, get_clerk
-from ..models import Receipt, Item, ReceiptItem, Clerk, ReceiptNote
+from ..models import Receipt, Item, ReceiptNote
 from ..checkout_api import ajax_func
+from .common import item_receipts
 
 __author__ = 'codez'
 
@@ -32,13 +33,11 @@ def receipt_suspend(request, note):
 def receipt_continue(request, code):
     clerk = request.session["clerk"]
     item = Item.get_item_by_barcode(code)
-    receipt = get_object_or_404(Receipt, status=Receipt.SUSPENDED,
-                                type=Receipt.TYPE_PURCHASE,
-                                receiptitem__item=item, receiptitem__action=ReceiptItem.ADD)
+    receipt = get_object_or_404(item_receipts(item), status=Receipt.SUSPENDED, type=Receipt.TYPE_PURCHASE)
 
     receipt.status = Receipt.PENDING
     if receipt.clerk_id != clerk:
-        receipt.clerk = Clerk.objects.get(id=clerk)
+        receipt.clerk = get_clerk(request)
     receipt.save()
 
     request.session["receipt"] = receipt.id
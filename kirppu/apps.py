@@ -1,7 +1,7 @@
 # -*- coding: utf-8 -*-
 
 from django.apps import AppConfig
-from django.db.models.signals import pre_delete, pre_save
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
 
 __all__ = [
     "KirppuApp",
@@ -12,7 +12,26 @@ class KirppuApp(AppConfig):
     name = "kirppu"
 
     def ready(self):
-        from .signals import delete_handler, save_handler
+        from .models import Event, Item, ReceiptExtraRow
+        from .signals import (
+            delete_handler,
+            event_changed_handler,
+            extra_row_post_save_handler,
+            extra_row_pre_delete_handler,
+            extra_row_pre_save_handler,
+            item_post_save_handler,
+            item_pre_delete_handler,
+            item_pre_save_handler,
+            save_handler,
+        )
         pre_delete.connect(delete_handler)
         pre_save.connect(save_handler)
+        post_save.connect(event_changed_handler, sender=Event)
+        post_delete.connect(event_changed_handler, sender=Event)
+        pre_save.connect(item_pre_save_handler, sender=Item)
+        post_save.connect(item_post_save_handler, sender=Item)
+        pre_delete.connect(item_pre_delete_handler, sender=Item)
+        pre_save.connect(extra_row_pre_save_handler, sender=ReceiptExtraRow)
+        post_save.connect(extra_row_post_save_handler, sender=ReceiptExtraRow)
+        pre_delete.connect(extra_row_pre_delete_handler, sender=ReceiptExtraRow)
         super().ready()
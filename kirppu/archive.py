@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+import gzip
+import json
+import os
+import tempfile
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+
+from . import signals
+from .models import ItemStateLog, Receipt, ReceiptExtraRow, ReceiptItem, ReceiptNote
+
+"""
+Archives of checkout history of finished Events.
+
+Item state logs, receipts and their rows and notes of an Event are exported into a gzip
+compressed JSON lines file in `settings.KIRPPU_ARCHIVE_DIR`, one row per line, and then purged
+from the database. Items, vendors, vendor balances and other registration data stay in the database.
+Statistics and accounting of an archived Event read the history from the archive.
+"""
+
+__all__ = [
+    "is_configured",
+    "archive_path",
+    "is_archived",
+    "export",
+    "verify",
+    "purge",
+    "read_rows",
+    "read_objects",
+]
+
+# Archived tables, in the order they are purged: name, model, query filter to the Event, and fields.
+# Item state log rows contain the price and item type of the item for the statistics.
+ARCHIVED = (
+    ("itemstatelog", ItemStateLog, "event",
+     ("id", "item_id", "time", "old_state", "new_state", "clerk_id", "counter_id", "item__price", "item__itemtype")),
+    ("receiptitem", ReceiptItem, "event",
+     ("id", "item_id", "receipt_id", "action", "add_time")),
+    ("receiptextrarow", ReceiptExtraRow, "receipt__event",
+     ("id", "type", "value", "receipt_id")),
+    ("receiptnote", ReceiptNote, "receipt__event",
+     ("id", "timestamp", "clerk_id", "text", "receipt_id")),
+    ("receipt", Receipt, "event",
+     ("id", "status", "total", "clerk_id", "counter_id", "start_time", "end_time", "type", "vendor_id")),
+)
+_MODELS = {name: model for name, model, _filter, _fields in ARCHIVED}
+
+
+def is_configured():
+    """
+    Has an archive directory been set. Nothing is archived, or read from archives, without one.
+
+    :rtype: bool
+    """
+    return bool(settings.KIRPPU_ARCHIVE_DIR)
+
+
+def archive_path(event):
+    return os.path.join(settings.KIRPPU_ARCHIVE_DIR, "event_{}.jsonl.gz".format(event.pk))
+
+
+def is_archived(event):
+    """
+    Has the history of the Event been moved to an archive.
+    Only Events of the default database can be archived.
+
+    :type event: Event
+    :rtype: bool
+    """
+    # Alias is None for an Event instance that has not been read from a database.
+    return is_configured() and (event.get_real_database_alias() or "default") == "default" \
+        and os.path.exists(archive_path(event))
+
+
+def _query(model, event_filter, event):
+    return model.objects.filter(**{event_filter: event})
+
+
+def export(event):
+    """
+    Write history of the Event into its archive. The archive is written into a temporary file
+    first, so an existing archive is replaced only by a complete one.
+
+    :return: Number of rows written per table name.
+    :rtype: dict
+    """
+    os.makedirs(settings.KIRPPU_ARCHIVE_DIR, exist_ok=True)
+    counts = {}
+    handle, temp_path = tempfile.mkstemp(suffix=".tmp", dir=settings.KIRPPU_ARCHIVE_DIR)
+    try:
+        with os.fdopen(handle, "wb") as raw, gzip.open(raw, "wt", encoding="utf-8") as out:
+            # Read in a single transaction to get a consistent set of rows.
+            with transaction.atomic():
+                for name, model, event_filter, fields in ARCHIVED:
+                    counts[name] = 0
+                    query = _query(model, event_filter, event).order_by("pk").values(*fields)
+                    for row in query.iterator():
+                        row["model"] = name
+                        out.write(json.dumps(row, cls=DjangoJSONEncoder))
+                        out.write("\n")
+                        counts[name] += 1
+        os.replace(temp_path, archive_path(event))
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+    return counts
+
+
+def read_rows(event, name=None):
+    """
+    Read rows from archive of the Event. Values are as written by `DjangoJSONEncoder`,
+    i.e. times and decimals are strings.
+
+    :param name: Table name of the rows to read, or None to read all rows.
+    :return: Generator of row dicts, each with its table name in `model`.
+    """
+    with gzip.open(archive_path(event), "rt", encoding="utf-8") as f:
+        for line in f:
+            row = json.loads(line)
+            if name is None or row["model"] == name:
+                yield row
+
+
+def read_objects(event, name):
+    """
+    Read rows of a table from archive of the Event as unsaved model instances.
+    Values of related models, such as item price of state log rows, are left out.
+
+    :param name: Table name of the rows to read.
+    :return: Generator of model instances.
+    """
+    model = _MODELS[name]
+    for row in read_rows(event, name):
+        yield model(**{
+            key: model._meta.get_field(key).to_python(value)
+            for key, value in row.items()
+            if key != "model" and "__" not in key
+        })
+
+
+def verify(event):
+    """
+    Check that all history rows of the Event in the database are in its archive.
+
+    :return: Number of rows missing from the archive per table name. Empty if nothing is missing.
+    :rtype: dict
+    """
+    archived = {name: set() for name, _model, _filter, _fields in ARCHIVED}
+    for row in read_rows(event):
+        archived[row["model"]].add(row["id"])
+
+    missing = {}
+    for name, model, event_filter, _fields in ARCHIVED:
+        pks = _query(model, event_filter, event).values_list("pk", flat=True).iterator()
+        count = sum(1 for pk in pks if pk not in archived[name])
+        if count:
+            missing[name] = count
+    return missing
+
+
+def purge(event, batch_size=1000):
+    """
+    Delete the archived history of the Event from the database, in transactions of at most
+    `batch_size` rows, so that the tables are not locked for the whole purge.
+    Vendor balances keep counting the deleted provision rows.
+
+    :return: Number of rows deleted per table name.
+    :rtype: dict
+    """
+    counts = {}
+    with signals.keeping_balances():
+        for name, model, event_filter, _fields in ARCHIVED:
+            counts[name] = 0
+            query = _query(model, event_filter, event)
+            while True:
+                with transaction.atomic():
+                    pks = list(query.order_by("pk").values_list("pk", flat=True)[:batch_size])
+                    if not pks:
+                        break
+                    model.objects.filter(pk__in=pks).delete()
+                counts[name] += len(pks)
+    return counts
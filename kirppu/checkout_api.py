@@ -1,13 +1,18 @@
+from decimal import Decimal
 import functools
+import hashlib
 import inspect
+import json
 import logging
 import random
+import time
 
 from django.conf import settings
 
 from django.core.exceptions import ValidationError
 from django.db import models, transaction, IntegrityError
 from django.db.models import Q, F, Count
+from django.http import Http404
 from django.http.response import (
     HttpResponse,
     JsonResponse,
@@ -15,8 +20,10 @@ from django.http.response import (
 )
 from django.shortcuts import (
     get_object_or_404,
-    render,
 )
+from django.template.loader import get_template, render_to_string
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
 from django.utils.translation import gettext as _
 from django.utils.timezone import now
 from ipware.ip import get_ip
@@ -24,8 +31,11 @@ from ipware.ip import get_ip
 from .api.common import (
     get_item_or_404 as _get_item_or_404,
     item_state_conflict as _item_state_conflict,
+    item_receipts as _item_receipts,
     get_receipt,
+    scan_item_query as _scan_item_query,
 )
+from .event_cache import get_event_or_404
 from .provision import Provision
 from .models import (
     Item,
@@ -33,12 +43,16 @@ from .models import (
     Receipt,
     Clerk,
     Counter,
+    CounterJournalEntry,
     Event,
+    EventDataVersion,
     EventPermission,
+    GraphCache,
     ReceiptItem,
     ReceiptExtraRow,
     Vendor,
     ItemStateLog,
+    ItemStateCounter,
     Box,
     TemporaryAccessPermit,
     TemporaryAccessPermitLog,
@@ -47,7 +61,7 @@ from .models import (
 from .fields import ItemPriceField
 from .forms import remove_item_from_receipt
 
-from . import ajax_util, stats
+from . import ajax_util, stats, stats_cache
 from .ajax_util import (
     AjaxError,
     AjaxFunc,
@@ -60,6 +74,7 @@ from .ajax_util import (
     RET_CONFLICT,
     RET_AUTH_FAILED,
     RET_LOCKED,
+    RET_NOT_FOUND,
 )
 
 logger = logging.getLogger(__name__)
@@ -88,7 +103,7 @@ def _register_ajax_func(func):
 
 
 def ajax_func(url, method='POST', counter=True, clerk=True, overseer=False, atomic=False,
-              staff_override=False, ignore_session=False):
+              staff_override=False, ignore_session=False, idempotent=False):
     """
     Decorate a function with some common logic.
     The names of the function being decorated are required to be present in the JSON object
@@ -110,8 +125,12 @@ def ajax_func(url, method='POST', counter=True, clerk=True, overseer=False, atom
     :param staff_override: Whether this function can be called without checkout being active.
     :type staff_override: bool
     :param ignore_session: Whether Event stored in session data should be ignored for the call.
+    :param idempotent: Should a successful response be replayed to a retried request with the same
+        X-Idempotency-Key header? Requires `atomic`. Default: False.
+    :type idempotent: bool
     :return: Decorated function.
     """
+    assert atomic or not idempotent, "Idempotent function must be atomic"
 
     def decorator(func):
         # Get argspec before any decoration.
@@ -127,13 +146,18 @@ def ajax_func(url, method='POST', counter=True, clerk=True, overseer=False, atom
             staff_override=staff_override,
             ignore_session=ignore_session,
         )(wrapped)
+        if idempotent:
+            fn = ajax_util.idempotent(func.__name__)(fn)
         if atomic:
-            fn = transaction.atomic(fn)
+            # State log entries of the call are inserted together just before commit.
+            fn = transaction.atomic(ItemStateLog.objects.buffered()(fn))
+        # Measured including state log entries, idempotency record and commit.
+        fn = ajax_util.measured(func.__name__)(fn)
 
         # Copy name etc from original function to wrapping function.
         # The wrapper must be the one referred from urlconf.
         fn = functools.wraps(wrapped)(fn)
-        _register_ajax_func(AjaxFunc(fn, url, method))
+        _register_ajax_func(AjaxFunc(fn, url, method, idempotent=idempotent))
 
         return fn
     return decorator
@@ -147,22 +171,64 @@ from .api import (
 )
 
 
+# Rendered AJAX API JavaScript by Event slug: (content, time of rendering).
+_checkout_js_cache = {}
+_ajax_api_version = None
+
+# Seconds a versioned checkout.js may be cached by browsers.
+CHECKOUT_JS_MAX_AGE = 365 * 24 * 60 * 60
+
+
+def ajax_api_version():
+    """
+    Get version of the AJAX API JavaScript, a hash of the registered functions and the template.
+    The version is added to the checkout.js URL so that browsers fetch a changed API again.
+
+    :rtype: str
+    """
+    global _ajax_api_version
+    if _ajax_api_version is None:
+        digest = hashlib.sha1(get_template("kirppu/app_ajax_api.js").template.source.encode("utf-8"))
+        for name, func in sorted(AJAX_FUNCTIONS.items()):
+            digest.update(repr((name, func.url, func.method, func.view, func.idempotent)).encode("utf-8"))
+        _ajax_api_version = digest.hexdigest()[:16]
+    return _ajax_api_version
+
+
 def checkout_js(request, event_slug):
     """
     Render the JavaScript file that defines the AJAX API functions.
+
+    The output depends only on the registered functions and the Event slug, so it is rendered
+    once per Event. When requested with the current version in `v` parameter, it may be cached
+    by the browser for long, as another version has a different URL. Otherwise the browser must
+    revalidate it with ETag or Last-Modified.
     """
-    event = get_object_or_404(Event, slug=event_slug)
-    context = {
-        'funcs': AJAX_FUNCTIONS.items(),
-        'api_name': 'Api',
-        'event': event,
-    }
-    return render(
-        request,
-        "kirppu/app_ajax_api.js",
-        context,
-        content_type="application/javascript"
-    )
+    event = get_event_or_404(event_slug)
+    version = ajax_api_version()
+
+    cached = _checkout_js_cache.get(event.slug)
+    if cached is None:
+        context = {
+            'funcs': AJAX_FUNCTIONS.items(),
+            'api_name': 'Api',
+            'event': event,
+        }
+        cached = (render_to_string("kirppu/app_ajax_api.js", context), int(time.time()))
+        _checkout_js_cache[event.slug] = cached
+    content, last_modified = cached
+
+    etag = '"{}"'.format(version)
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = HttpResponse(content, content_type="application/javascript")
+    response["ETag"] = etag
+    response["Last-Modified"] = http_date(last_modified)
+    if request.GET.get("v") == version:
+        patch_cache_control(response, public=True, max_age=CHECKOUT_JS_MAX_AGE, immutable=True)
+    else:
+        patch_cache_control(response, no_cache=True)
+    return response
 
 
 @transaction.atomic
@@ -170,19 +236,14 @@ def item_mode_change(request, code, from_, to, message_if_not_first=None):
     if isinstance(code, Item):
         item = code
     else:
-        item = _get_item_or_404(code, for_update=True)
+        item = _get_item_or_404(code)
     if not isinstance(from_, tuple):
         from_ = (from_,)
-    if item.state in from_:
-        if item.hidden:
-            # If an item is brought to the event, even though the user deleted it, it should begin showing again in
-            # users list. The same probably applies to any interaction with the item.
-            item.hidden = False
-
-        ItemStateLog.objects.log_state(item=item, new_state=to, request=request)
-        old_state = item.state
-        item.state = to
-        item.save(update_fields=("state", "hidden"))
+
+    old_state = item.state
+    # If an item is brought to the event, even though the user deleted it, it should begin showing again in
+    # users list. The same probably applies to any interaction with the item.
+    if ItemStateLog.objects.transition(item, from_, to, request=request, hidden=False):
         ret = item.as_dict()
         if message_if_not_first is not None and len(from_) > 1 and old_state != from_[0]:
             ret.update(_message=message_if_not_first)
@@ -214,7 +275,8 @@ def clerk_login(request, event, code, counter):
     clerk_data['overseer_enabled'] = oversee
     clerk_data['stats_enabled'] = oversee or permissions.can_see_statistics
 
-    active_receipts = Receipt.objects.filter(clerk=clerk, status=Receipt.PENDING, type=Receipt.TYPE_PURCHASE)
+    active_receipts = Receipt.objects.filter(clerk=clerk, status=Receipt.PENDING, type=Receipt.TYPE_PURCHASE) \
+        .with_details()
     if active_receipts:
         if len(active_receipts) > 1:
             clerk_data["receipts"] = [receipt.as_dict() for receipt in active_receipts]
@@ -279,16 +341,9 @@ def item_find(request, event, code):
     item = _get_item_or_404(code, event=event)
     value = item.as_dict()
     if "available" in request.GET:
-        if item.state == Item.STAGED:
-            suspended = item.receipt_set.filter(status=Receipt.SUSPENDED, type=Receipt.TYPE_PURCHASE).distinct()
-            if len(suspended) == 1:
-                suspended = suspended[0]
-                value.update(receipt=suspended.as_dict())
-                return JsonResponse(
-                    value,
-                    status=RET_LOCKED,
-                    content_type='application/json',
-                )
+        suspended = _suspended_receipt_response(item, value)
+        if suspended is not None:
+            return suspended
 
         message = raise_if_item_not_available(item)
         if message is not None:
@@ -342,17 +397,16 @@ def item_search(request, event, query, code, vendor, min_price, max_price, item_
 
     item_clauses = clauses + name_clauses
     box_clauses = clauses + description_clauses
-    results = []
 
-    for item in (
-        Item.objects
-        .filter(*item_clauses, box__isnull=True, vendor__event=event)
-        .select_related("itemtype", "vendor", "vendor__user")
-        .all()
-    ):
-        item_dict = item.as_dict()
-        item_dict['vendor'] = item.vendor.as_dict()
-        results.append(item_dict)
+    results = Item.as_dict_rows(Item.objects.filter(*item_clauses, box__isnull=True, vendor__event=event))
+    vendors = {
+        vendor.pk: vendor.as_dict()
+        for vendor in Vendor.objects
+        .filter(pk__in={item_dict["vendor"] for item_dict in results})
+        .select_related("user", "person")
+    }
+    for item_dict in results:
+        item_dict['vendor'] = vendors[item_dict['vendor']]
 
     box_item_details = dict()
     box_item_detail_query = (
@@ -499,7 +553,9 @@ def _box_edit(request, box, price, state):
         raise AjaxError(RET_CONFLICT, "Available box item prices are in conflicting state")
 
     if price != any_item.price:
-        available_items.update(price=price)
+        with ItemStateCounter.objects.tracking(available_items) as locked_items:
+            locked_items.update(price=price)
+        GraphCache.objects.invalidate([any_item.vendor.event_id], prices_only=True)
 
     representative = box.representative_item
     item_dict = representative.as_dict()
@@ -516,10 +572,9 @@ def _box_edit(request, box, price, state):
 def item_list(request, event, vendor):
     items = (Item.objects
              .filter(vendor__id=vendor, vendor__event=event, box__isnull=True)
-             .select_related("itemtype")
              .order_by("name")
              )
-    return [i.as_dict() for i in items]
+    return Item.as_dict_rows(items)
 
 
 @ajax_func('^vendor/returnable$', method='GET')
@@ -527,8 +582,7 @@ def vendor_returnable_items(request, vendor):
     # Items that can be returned with box representative items (without other box items).
     items = Item.objects \
         .exclude(state=Item.ADVERTISED) \
-        .filter(Q(vendor__id=vendor) & (Q(box__isnull=True) | Q(box__representative_item__pk=F("pk")))) \
-        .select_related("itemtype", "box")
+        .filter(Q(vendor__id=vendor) & (Q(box__isnull=True) | Q(box__representative_item__pk=F("pk"))))
 
     # Shrink boxes to single representative items with box information.
     boxes = Box.objects \
@@ -543,9 +597,8 @@ def vendor_returnable_items(request, vendor):
 
     # Merge the two queries to a single response.
     r = []
-    for i in items:
-        box = boxes.get(i.pk)  # type: Box
-        element = i.as_dict()
+    for element in Item.as_dict_rows(items, "pk"):
+        box = boxes.get(element.pop("pk"))  # type: Box
         if box is not None:
             element.update(
                 box={
@@ -657,7 +710,7 @@ def box_list(request, vendor):
 
 @ajax_func('^item/checkin$', atomic=True)
 def item_checkin(request, event, code):
-    item = _get_item_or_404(code, for_update=True, event=event)
+    item = _get_item_or_404(code, event=event)
     if not item.vendor.terms_accepted:
         raise AjaxError(500, _(u"Vendor has not accepted terms!"))
 
@@ -681,7 +734,10 @@ def item_checkin(request, event, code):
         # Assign box number and return box information to client.
         # Expecting a retry to box_checkin.
         box = item.box
-        box.assign_box_number()
+        if box.box_number is None:
+            # Lock the box so that concurrent check-ins of the same box agree on its number.
+            box.box_number = Box.objects.select_for_update().values_list("box_number", flat=True).get(pk=box.pk)
+            box.assign_box_number()
 
         response = item.as_dict()
         response["box"] = box.as_dict()
@@ -697,7 +753,7 @@ def item_checkin(request, event, code):
 
 @ajax_func('^item/checkout$', atomic=True)
 def item_checkout(request, event, code, vendor=None):
-    item = _get_item_or_404(code, for_update=True, event=event)
+    item = _get_item_or_404(code, event=event)
     if vendor == "":
         vendor = None
     if vendor is not None:
@@ -752,12 +808,9 @@ def item_compensate_start(request, event, vendor):
     if not vendor_list:
         raise AjaxError(RET_BAD_REQUEST)
 
-    clerk = Clerk.objects.get(pk=request.session["clerk"])
-    counter = Counter.objects.get(pk=request.session["counter"])
-
     receipt = Receipt(
-        clerk=clerk,
-        counter=counter,
+        clerk=get_clerk(request),
+        counter=get_counter(request),
         type=Receipt.TYPE_COMPENSATION,
         vendor=vendor_list[0]
     )
@@ -768,24 +821,24 @@ def item_compensate_start(request, event, vendor):
     return receipt.as_dict()
 
 
-@ajax_func('^item/compensate$', atomic=True)
+@ajax_func('^item/compensate$', atomic=True, idempotent=True)
 def item_compensate(request, event, code):
     if "compensation" not in request.session:
         raise AjaxError(RET_CONFLICT, _(u"No compensation started!"))
     receipt_pk, vendor_id = request.session["compensation"]
     receipt = Receipt.objects.select_for_update().get(pk=receipt_pk, type=Receipt.TYPE_COMPENSATION)
 
-    item = _get_item_or_404(code, vendor=vendor_id, for_update=True, event=event)
+    item = _get_item_or_404(code, vendor=vendor_id, event=event)
     item_dict = item_mode_change(request, item, Item.SOLD, Item.COMPENSATED)
 
     ReceiptItem.objects.create(item=item, receipt=receipt)
-    receipt.calculate_total()
+    receipt.add_to_total(item.price)
     receipt.save(update_fields=("total",))
 
     return item_dict
 
 
-@ajax_func('^item/compensate/end', atomic=True)
+@ajax_func('^item/compensate/end', atomic=True, idempotent=True)
 def item_compensate_end(request, event):
     if "compensation" not in request.session:
         raise AjaxError(RET_CONFLICT, _(u"No compensation started!"))
@@ -800,6 +853,7 @@ def item_compensate_end(request, event):
             value=provision.provision,
             receipt=receipt,
         )
+        receipt.add_to_total(provision.provision)
 
         if not provision.provision_fix.is_zero():
             ReceiptExtraRow.objects.create(
@@ -807,10 +861,10 @@ def item_compensate_end(request, event):
                 value=provision.provision_fix,
                 receipt=receipt,
             )
+            receipt.add_to_total(provision.provision_fix)
 
     receipt.status = Receipt.FINISHED
     receipt.end_time = now()
-    receipt.calculate_total()
     receipt.save(update_fields=("status", "end_time", "total"))
 
     del request.session["compensation"]
@@ -915,8 +969,19 @@ def vendor_token_create(request, vendor_id):
         raise AjaxError(RET_CONFLICT, _("Gave up code generation."))
 
 
-@ajax_func('^receipt/start$', atomic=True)
+@ajax_func('^receipt/start$', atomic=True, idempotent=True)
 def receipt_start(request):
+    receipt = _create_receipt(request)
+    return receipt.as_dict()
+
+
+def _create_receipt(request):
+    """
+    Create a new purchase Receipt for the clerk and make it the active receipt of the session.
+
+    :raises AjaxError: If there already is an active receipt.
+    :rtype: Receipt
+    """
     if "receipt" in request.session:
         raise AjaxError(RET_CONFLICT, "There is already an active receipt on this counter!")
 
@@ -932,12 +997,67 @@ def receipt_start(request):
     receipt.save()
 
     request.session["receipt"] = receipt.pk
-    return receipt.as_dict()
+    return receipt
 
 
-@ajax_func('^item/reserve$', atomic=True)
-def item_reserve(request, event, code):
+def _suspended_receipt_response(item, value):
+    """
+    Get the "Locked" response for a staged item that is in a suspended receipt.
+
+    :param item: Item being looked up.
+    :type item: Item
+    :param value: Item dict to which the suspended receipt is added.
+    :type value: dict
+    :return: Response with the suspended receipt, or None if the item is not in a suspended receipt.
+    :rtype: JsonResponse|None
+    """
+    if item.state != Item.STAGED:
+        return None
+    suspended = _item_receipts(item, status=Receipt.SUSPENDED, type=Receipt.TYPE_PURCHASE)[:2]
+    if len(suspended) != 1:
+        return None
+    value.update(receipt=suspended[0].as_dict())
+    return JsonResponse(
+        value,
+        status=RET_LOCKED,
+        content_type='application/json',
+    )
+
+
+@ajax_func('^receipt/start_with_item$', atomic=True, idempotent=True)
+def receipt_start_with_item(request, event, code):
+    """
+    Start a new receipt and reserve its first item in one go.
+    Combination of `item_find` (with `available`), `receipt_start` and `item_reserve`.
+    If the item cannot be reserved, no receipt is started.
+    """
+    # Locked, so that the item is still available when it is reserved.
     item = _get_item_or_404(code, for_update=True, event=event)
+    if item.box_id is not None:
+        raise AjaxError(RET_CONFLICT, "A box cannot be reserved")
+
+    suspended = _suspended_receipt_response(item, item.as_dict())
+    if suspended is not None:
+        return suspended
+    raise_if_item_not_available(item)
+
+    with transaction.atomic(), ItemStateLog.objects.buffered():
+        receipt = _create_receipt(request)
+        try:
+            row = _reserve_item(request, item, receipt)
+        except AjaxError:
+            # The receipt is rolled back with the savepoint.
+            del request.session["receipt"]
+            raise
+    return {
+        "receipt": receipt.as_dict(),
+        "item": row,
+    }
+
+
+@ajax_func('^item/reserve$', atomic=True, idempotent=True)
+def item_reserve(request, event, code):
+    item = _get_item_or_404(code, event=event)
     if item.box_id is not None:
         raise AjaxError(RET_CONFLICT, "A box cannot be reserved")
     receipt_id = request.session.get("receipt")
@@ -945,15 +1065,23 @@ def item_reserve(request, event, code):
         raise AjaxError(RET_BAD_REQUEST, "No active receipt found")
     receipt = get_receipt(receipt_id, for_update=True)
 
-    message = raise_if_item_not_available(item)
-    if item.state in (Item.ADVERTISED, Item.BROUGHT, Item.MISSING):
-        ItemStateLog.objects.log_state(item, Item.STAGED, request=request)
-        item.state = Item.STAGED
-        item.save(update_fields=("state",))
+    return _reserve_item(request, item, receipt)
+
+
+def _reserve_item(request, item, receipt):
+    """
+    Stage an item into the locked receipt.
 
+    :return: Item dict with receipt total and possible warning message.
+    :rtype: dict
+    :raises AjaxError: If the item is not available.
+    """
+    message = raise_if_item_not_available(item)
+    if ItemStateLog.objects.transition(item, (Item.ADVERTISED, Item.BROUGHT, Item.MISSING), Item.STAGED,
+                                       request=request):
         ReceiptItem.objects.create(item=item, receipt=receipt)
         # receipt.items.create(item=item)
-        receipt.calculate_total()
+        receipt.add_to_total(item.price)
         receipt.save(update_fields=("total",))
 
         ret = item.as_dict()
@@ -962,13 +1090,131 @@ def item_reserve(request, event, code):
             ret.update(_message=message)
         return ret
     else:
-        # Not in expected state.
+        # Not in expected state, possibly changed by another counter after it was read.
+        raise_if_item_not_available(item)
         raise AjaxError(RET_CONFLICT)
 
 
-@ajax_func('^item/release$', atomic=True)
+def _check_reservable(event, code, item, reserved_ids):
+    """
+    Check that an item of `item_reserve_many` can be staged.
+
+    :param item: Locked item matching the code, or None if none was found.
+    :type item: Item|None
+    :param reserved_ids: Ids of the items already staged by the same call.
+    :return: Possible warning message of the item.
+    :rtype: str|None
+    :raises AjaxError: If the item cannot be reserved.
+    """
+    if item is None:
+        raise AjaxError(RET_NOT_FOUND, _(u"No item found matching '{0}'").format(code))
+    if item.vendor_event != event.id:
+        raise AjaxError(RET_CONFLICT, "Item is not registered in this event!")
+    if item.box_id is not None:
+        raise AjaxError(RET_CONFLICT, "A box cannot be reserved")
+    if item.pk in reserved_ids:
+        raise AjaxError(RET_LOCKED, "Item is already staged to be sold.")
+    message = raise_if_item_not_available(item)
+    if item.state not in (Item.ADVERTISED, Item.BROUGHT, Item.MISSING):
+        raise AjaxError(RET_CONFLICT, "Unexpected item state.")
+    return message
+
+
+def _stage_items(request, receipt, reserved):
+    """
+    Stage checked items of `item_reserve_many` into the locked receipt.
+
+    :param reserved: Tuples of (item, warning message, result dict) of the items. Item dict is added to the results.
+    """
+    reserved_items = [item for item, _message, _result in reserved]
+    ItemStateLog.objects.log_states(reserved_items, Item.STAGED, request=request)
+    Item.objects.filter(pk__in=[item.pk for item in reserved_items]).update(state=Item.STAGED)
+
+    for item, message, result in reserved:
+        item.state = Item.STAGED
+        row = item.as_dict()
+        if message is not None:
+            row.update(_message=message)
+        result.update(item=row)
+
+    ReceiptItem.objects.bulk_create([
+        ReceiptItem(item=item, receipt=receipt, event_id=receipt.event_id)
+        for item in reserved_items
+    ])
+    receipt.add_to_total(sum((item.price for item in reserved_items), Decimal(0)))
+    receipt.save(update_fields=("total",))
+
+
+@ajax_func('^item/reserve_many$', atomic=True, idempotent=True)
+def item_reserve_many(request, event, codes):
+    """
+    Reserve several items to the active receipt at once.
+
+    Items that cannot be reserved do not prevent reserving the others.
+
+    :param codes: List of item codes, encoded in Json string.
+    :type codes: str
+    :return: Receipt total, and result for each code in the order given.
+        Successful results contain the item, failed ones the status and error message.
+    :rtype: dict
+    """
+    from json import loads
+
+    try:
+        codes = loads(codes)
+    except ValueError:
+        codes = None
+    if not isinstance(codes, list) or not all(isinstance(code, str) for code in codes):
+        raise AjaxError(RET_BAD_REQUEST, "codes must be a list of strings")
+
+    receipt_id = request.session.get("receipt")
+    if receipt_id is None:
+        raise AjaxError(RET_BAD_REQUEST, "No active receipt found")
+    receipt = get_receipt(receipt_id, for_update=True)
+
+    # Lock in a stable order to avoid deadlocks with concurrent reservations.
+    items = _scan_item_query(for_update=True).filter(code__in=set(codes)).order_by("pk")
+    items_by_code = {item.code: item for item in items}
+
+    results = []
+    reserved = []
+    reserved_ids = set()
+    for code in codes:
+        item = items_by_code.get(code)
+        try:
+            message = _check_reservable(event, code, item, reserved_ids)
+        except AjaxError as e:
+            results.append({
+                "code": code,
+                "status": e.status,
+                "error": e.message,
+            })
+            continue
+
+        result = {
+            "code": code,
+            "status": 200,
+        }
+        results.append(result)
+        reserved.append((item, message, result))
+        reserved_ids.add(item.pk)
+
+    if reserved:
+        _stage_items(request, receipt, reserved)
+
+    return {
+        "total": receipt.total_cents,
+        "items": results,
+    }
+
+
+@ajax_func('^item/release$', atomic=True, idempotent=True)
 def item_release(request, code):
-    item = _get_item_or_404(code, for_update=True)
+    return _release_item(request, code)
+
+
+def _release_item(request, code):
+    item = _get_item_or_404(code)
     receipt_id = request.session.get("receipt")
     if receipt_id is None:
         raise AjaxError(RET_BAD_REQUEST, "No active receipt found")
@@ -1002,8 +1248,12 @@ def _get_active_receipt(request, id, allowed_states=(Receipt.PENDING,)):
     return receipt, receipt_id
 
 
-@ajax_func('^receipt/finish$', atomic=True)
+@ajax_func('^receipt/finish$', atomic=True, idempotent=True)
 def receipt_finish(request, id):
+    return _finish_receipt(request, id)
+
+
+def _finish_receipt(request, id):
     receipt, receipt_id = _get_active_receipt(request, id)
 
     receipt.end_time = now()
@@ -1018,41 +1268,183 @@ def receipt_finish(request, id):
     return receipt.as_dict()
 
 
-@ajax_func('^receipt/abort$', atomic=True)
+@ajax_func('^receipt/abort$', atomic=True, idempotent=True)
 def receipt_abort(request, id):
+    return _abort_receipt(request, id)
+
+
+def _abort_receipt(request, id):
     receipt, receipt_id = _get_active_receipt(request, id, (Receipt.PENDING, Receipt.SUSPENDED))
 
     # For all ADDed items, add REMOVE-entries and return the real Item's back to available.
     added_items = ReceiptItem.objects.select_for_update().filter(receipt_id=receipt_id, action=ReceiptItem.ADD)
-    for receipt_item in added_items.only("item"):
-        item = receipt_item.item
-
-        ReceiptItem(item=item, receipt=receipt, action=ReceiptItem.REMOVE).save()
-
-        if item.state != Item.BROUGHT:
-            ItemStateLog.objects.log_state(item=item, new_state=Item.BROUGHT, request=request)
-            item.state = Item.BROUGHT
-            item.save()
-
-    # Update ADDed items to be REMOVED_LATER. This must be done after the real Items have
-    # been updated, and the REMOVE-entries added, as this will change the result set of
+    items = list(
+        Item.objects.select_for_update()
+        .filter(receiptitem__receipt_id=receipt_id, receiptitem__action=ReceiptItem.ADD)
+        .only("pk", "state", "price")
+        .order_by("receiptitem__pk")
+    )
+    removed_total = sum((item.price for item in items), Decimal(0))
+
+    ReceiptItem.objects.bulk_create([
+        ReceiptItem(item=item, receipt=receipt, action=ReceiptItem.REMOVE, event_id=receipt.event_id)
+        for item in items
+    ])
+
+    returned_items = [item for item in items if item.state != Item.BROUGHT]
+    if returned_items:
+        ItemStateLog.objects.log_states(item_set=returned_items, new_state=Item.BROUGHT, request=request)
+        Item.objects \
+            .filter(pk__in=[item.pk for item in returned_items]) \
+            .exclude(state=Item.BROUGHT) \
+            .update(state=Item.BROUGHT)
+
+    # Update ADDed items to be REMOVED_LATER. This must be done after the REMOVE-entries
+    # have been created from the added items, as this will change the result set of
     # the original added_items -query (to always return zero entries).
     added_items.update(action=ReceiptItem.REMOVED_LATER)
 
-    # End the receipt. (Must be done after previous updates, so calculate_total calculates
-    # correct sum.)
+    # End the receipt.
     receipt.end_time = now()
     receipt.status = Receipt.ABORTED
-    receipt.calculate_total()
+    receipt.add_to_total(-removed_total)
     receipt.save(update_fields=("end_time", "status", "total"))
 
     del request.session["receipt"]
     return receipt.as_dict()
 
 
-def _get_receipt_data_with_items(**kwargs):
+def _journal_reserve(request, event, entry):
+    code = entry.get("code")
+    if not isinstance(code, str):
+        raise AjaxError(RET_BAD_REQUEST, "code is required")
+    item = _get_item_or_404(code, event=event)
+    if item.box_id is not None:
+        raise AjaxError(RET_CONFLICT, "A box cannot be reserved")
+
+    receipt_id = request.session.get("receipt")
+    if receipt_id is None:
+        # First item of the receipt. Check the item before starting the receipt.
+        raise_if_item_not_available(item)
+        receipt = _create_receipt(request)
+    else:
+        receipt = get_receipt(receipt_id, for_update=True)
+    return _reserve_item(request, item, receipt)
+
+
+def _journal_release(request, event, entry):
+    code = entry.get("code")
+    if not isinstance(code, str):
+        raise AjaxError(RET_BAD_REQUEST, "code is required")
+    return _release_item(request, code)
+
+
+def _journal_receipt_id(request, entry):
+    receipt_id = entry.get("receipt", request.session.get("receipt"))
+    if receipt_id is None:
+        raise AjaxError(RET_BAD_REQUEST, "No active receipt found")
+    return receipt_id
+
+
+JOURNAL_OPERATIONS = {
+    CounterJournalEntry.OP_RESERVE: _journal_reserve,
+    CounterJournalEntry.OP_RELEASE: _journal_release,
+    CounterJournalEntry.OP_FINISH:
+        lambda request, event, entry: _finish_receipt(request, _journal_receipt_id(request, entry)),
+    CounterJournalEntry.OP_ABORT:
+        lambda request, event, entry: _abort_receipt(request, _journal_receipt_id(request, entry)),
+}
+
+
+def _apply_journal_entry(request, event, counter, entry):
+    """
+    Apply single journal entry in a savepoint and record its result.
+
+    :return: Recorded journal entry, and whether it was recorded by an earlier sync.
+    :rtype: (CounterJournalEntry, bool)
+    """
+    key = entry["key"]
+    existing = CounterJournalEntry.objects.filter(counter=counter, key=key).first()
+    if existing is not None:
+        return existing, True
+
+    session_receipt = request.session.get("receipt")
+    journal_entry = CounterJournalEntry(counter=counter, key=key, op=entry["op"], status=200)
+    try:
+        with transaction.atomic(), ItemStateLog.objects.buffered():
+            result = JOURNAL_OPERATIONS[entry["op"]](request, event, entry)
+            journal_entry.result = json.dumps(result)
+            journal_entry.save()
+        return journal_entry, False
+    except IntegrityError:
+        # Recorded meanwhile by a concurrent sync, or the operation itself failed.
+        existing = CounterJournalEntry.objects.filter(counter=counter, key=key).first()
+        if existing is None:
+            raise
+        return existing, True
+    except (AjaxError, Http404) as e:
+        if isinstance(e, Http404):
+            journal_entry.status = 404
+            journal_entry.result = json.dumps(str(e))
+        else:
+            journal_entry.status = e.status
+            journal_entry.result = json.dumps(e.message)
+        # Failed operation may have changed the active receipt before being rolled back.
+        if session_receipt is None:
+            request.session.pop("receipt", None)
+        else:
+            request.session["receipt"] = session_receipt
+        journal_entry.save()
+        return journal_entry, False
+
+
+@ajax_func('^counter/sync$', atomic=True)
+def counter_sync(request, event, journal):
+    """
+    Apply journal of counter operations recorded by the client.
+
+    Each entry has a client generated `key`, unique for the counter, and `op`, which is one of
+    `reserve` and `release` (with item `code`), or `finish` and `abort` (with optional `receipt`
+    id, defaulting to the active receipt). A reserve without active receipt starts a new receipt.
+    Entries are applied in order, each in its own savepoint, so that a failed entry does not
+    prevent applying the others. Results are recorded, and entries synced again are not re-applied,
+    but their recorded results are returned.
+
+    :param journal: List of journal entries, encoded in Json string.
+    :type journal: str
+    :return: Result of each entry, and the active receipt with its rows after the sync.
+    :rtype: dict
+    """
+    try:
+        journal = json.loads(journal)
+    except ValueError:
+        journal = None
+    if not isinstance(journal, list) or not all(
+            isinstance(entry, dict) and
+            isinstance(entry.get("key"), str) and 0 < len(entry["key"]) <= CounterJournalEntry.KEY_LENGTH and
+            entry.get("op") in JOURNAL_OPERATIONS
+            for entry in journal):
+        raise AjaxError(RET_BAD_REQUEST, "journal must be a list of entries with key and op")
+
+    counter = get_counter(request)
+    CounterJournalEntry.prune()
+    results = []
+    for entry in journal:
+        journal_entry, replayed = _apply_journal_entry(request, event, counter, entry)
+        result = journal_entry.as_dict()
+        result.update(replayed=replayed)
+        results.append(result)
+
+    receipt_id = request.session.get("receipt")
+    return {
+        "results": results,
+        "receipt": _get_receipt_data_with_items(pk=receipt_id) if receipt_id is not None else None,
+    }
+
+
+def _get_receipt_data_with_items(query=Receipt.objects, **kwargs):
     kwargs.setdefault("type", Receipt.TYPE_PURCHASE)
-    receipt = get_object_or_404(Receipt, **kwargs)
+    receipt = get_object_or_404(query, **kwargs)
 
     data = receipt.as_dict()
     data["items"] = receipt.row_list()
@@ -1070,10 +1462,11 @@ def receipt_get(request):
         if request.GET.get("type") == "compensation":
             query["type"] = Receipt.TYPE_COMPENSATION
     elif "item" in request.GET:
-        item_code = request.GET.get("item")
+        item_id = Item.objects.filter(code=request.GET.get("item")).values_list("pk", flat=True).first()
+        if item_id is None:
+            raise Http404()
         query = {
-            "receiptitem__item__code": item_code,
-            "receiptitem__action": ReceiptItem.ADD,
+            "query": _item_receipts(item_id),
             "status": Receipt.FINISHED,
         }
     else:
@@ -1096,7 +1489,9 @@ def receipt_activate(request):
 
 @ajax_func('^receipt/pending', overseer=True, method='GET')
 def receipt_pending(request):
-    receipts = Receipt.objects.filter(status__in=(Receipt.PENDING, Receipt.SUSPENDED), type=Receipt.TYPE_PURCHASE)
+    receipts = Receipt.objects \
+        .filter(status__in=(Receipt.PENDING, Receipt.SUSPENDED), type=Receipt.TYPE_PURCHASE) \
+        .with_details()
     return [receipt.as_dict() for receipt in receipts]
 
 
@@ -1105,7 +1500,7 @@ def receipt_compensated(request, vendor):
     receipts = Receipt.objects.filter(
         type=Receipt.TYPE_COMPENSATION,
         vendor_id=int(vendor)
-    ).distinct().order_by("start_time")
+    ).distinct().order_by("start_time").with_details()
 
     return [receipt.as_dict() for receipt in receipts]
 
@@ -1135,16 +1530,18 @@ def get_barcodes(request, codes=None):
     return outs
 
 
-@ajax_func('^item/abandon$')
+@ajax_func('^item/abandon$', atomic=True)
 def items_abandon(request, vendor):
     """
     Set all of the vendor's 'brought to event' and 'missing' items to abandoned
     The view is expected to refresh itself
     """
-    Item.objects.filter(
+    items = Item.objects.filter(
         vendor__id=vendor,
         state__in=(Item.BROUGHT, Item.MISSING),
-    ).update(abandoned=True)
+    )
+    with ItemStateCounter.objects.tracking(items) as locked_items:
+        locked_items.update(abandoned=True)
     return
 
 
@@ -1163,28 +1560,42 @@ def item_mark_lost(request, event, code):
     return item.as_dict()
 
 
+def _stats_csv(request, event: Event, name, graph, *key):
+    """
+    Respond with a graph CSV, cached by the data version of the Event.
+
+    :param graph: Function returning the GraphLog used to create the output.
+    """
+    version = EventDataVersion.objects.of(event)
+
+    def render():
+        if version is None:
+            return StreamingHttpResponse(stats.iterate_logs(graph()), content_type='text/csv')
+        data = stats_cache.cached_result(name, event, version, lambda: "".join(stats.iterate_logs(graph())), *key)
+        return StreamingHttpResponse([data], content_type='text/csv')
+    return stats_cache.conditional_response(request, version, render)
+
+
 @ajax_func('^stats/sales_data$', method='GET', staff_override=True)
 def stats_sales_data(request, event: Event, prices="false"):
     source_event = event.get_real_event()
-    formatter = stats.SalesData(event=source_event, as_prices=prices == "true")
-    log_generator = stats.iterate_logs(formatter)
-    return StreamingHttpResponse(log_generator, content_type='text/csv')
+    return _stats_csv(request, event, "sales_data",
+                      lambda: stats.SalesData(event=source_event, as_prices=prices == "true"), prices)
 
 
 @ajax_func('^stats/registration_data$', method='GET', staff_override=True)
 def stats_registration_data(request, event: Event, prices="false"):
     source_event = event.get_real_event()
-    formatter = stats.RegistrationData(event=source_event, as_prices=prices == "true")
-    log_generator = stats.iterate_logs(formatter)
-    return StreamingHttpResponse(log_generator, content_type='text/csv')
+    return _stats_csv(request, event, "registration_data",
+                      lambda: stats.RegistrationData(event=source_event, as_prices=prices == "true"), prices)
 
 
 @ajax_func('^stats/group_sales$', method='GET', staff_override=True)
 def stats_group_sales_data(request, event: Event, type_id, prices="false"):
     source_event = event.get_real_event()
     database = event.get_real_database_alias()
-    item_type = ItemType.objects.using(database).get(event=source_event, id=int(type_id))
-    formatter = stats.SalesData(event=source_event, as_prices=prices == "true",
-                                extra_filter=dict(item__itemtype=item_type))
-    log_generator = stats.iterate_logs(formatter)
-    return StreamingHttpResponse(log_generator, content_type='text/csv')
+
+    def graph():
+        item_type = ItemType.objects.using(database).get(event=source_event, id=int(type_id))
+        return stats.SalesData(event=source_event, as_prices=prices == "true", item_type=item_type)
+    return _stats_csv(request, event, "group_sales", graph, int(type_id), prices)
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+import time
+
+from django.conf import settings
+from django.shortcuts import get_object_or_404
+
+from .models import Event
+
+"""
+Process-local cache for Events looked up by slug.
+
+Events are read on every checkout API call, but change very rarely. Cached instances
+are shared between requests, so they must be treated as read-only. The cache is cleared
+by Event save and delete signals (see `apps.py`), and entries expire after
+`settings.KIRPPU_EVENT_CACHE_TTL` seconds to bound staleness between processes.
+"""
+
+__all__ = [
+    "get_event_or_404",
+    "invalidate",
+]
+
+# slug -> (expiry time, Event)
+_events = {}
+
+
+def get_event_or_404(slug):
+    """
+    Get Event by its slug, preferably from the cache.
+
+    The Event instance is kept as is in the cache, so a `RemoteEvent` resolved by
+    `Event.get_real_event()` is retained between requests too.
+
+    :param slug: Slug of the Event.
+    :type slug: str
+    :rtype: Event
+    :raises Http404: If the Event does not exist.
+    """
+    ttl = settings.KIRPPU_EVENT_CACHE_TTL
+    now = time.monotonic()
+
+    entry = _events.get(slug)
+    if entry is not None and entry[0] > now:
+        return entry[1]
+
+    event = get_object_or_404(Event, slug=slug)
+    if ttl > 0:
+        _events[slug] = (now + ttl, event)
+    return event
+
+
+def invalidate(event=None):
+    """
+    Remove Event from the cache.
+
+    :param event: Event to remove. If None, the whole cache is cleared.
+    :type event: Event|None
+    """
+    if event is None:
+        _events.clear()
+        return
+
+    # Slug may have been changed in the save, so match by primary key too.
+    for slug, (_expiry, cached) in list(_events.items()):
+        if slug == event.slug or cached.pk == event.pk:
+            _events.pop(slug, None)
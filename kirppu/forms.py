@@ -305,6 +305,7 @@ class ItemRemoveForm(forms.Form):
 
 
 @transaction.atomic
+@ItemStateLog.objects.buffered()
 def remove_item_from_receipt(request, item_or_code, receipt_id, update_receipt=True):
     if isinstance(item_or_code, Item):
         item = item_or_code
@@ -338,13 +339,11 @@ def remove_item_from_receipt(request, item_or_code, receipt_id, update_receipt=T
     removal_entry.save()
 
     if update_receipt:
-        receipt.calculate_total()
+        receipt.add_to_total(-item.price)
         receipt.save(update_fields=("total",))
 
-    if item.state != Item.BROUGHT:
-        ItemStateLog.objects.log_state(item=item, new_state=Item.BROUGHT, request=request)
-        item.state = Item.BROUGHT
-        item.save(update_fields=("state",))
+    if not ItemStateLog.objects.transition(item, (Item.SOLD, Item.STAGED), Item.BROUGHT, request=request):
+        raise ValueError("Item is not sold or staged, but {}".format(item.state))
     return removal_entry
 
 
@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+import contextlib
+import os
+import socket
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+
+"""
+Per-endpoint instrumentation of checkout API calls.
+
+Wall time, database query count, database time and response size of each call are recorded
+into in-process histograms by the name of the AJAX function. Histograms of each process are
+published to the Django cache at most every `settings.KIRPPU_INSTRUMENTATION_PUBLISH_INTERVAL`
+seconds, so that a shared cache backend makes the data of all processes readable in one place.
+
+Each process publishes into a slot of its own, claimed atomically with `cache.add`. The slot expires
+`settings.KIRPPU_INSTRUMENTATION_TTL` seconds after the last publish of the process, so processes
+that have exited, or have not served checkout calls since, are dropped and their slots reused.
+"""
+
+__all__ = [
+    "Histogram",
+    "measure",
+    "snapshot",
+    "collect",
+    "reset",
+]
+
+
+class Histogram(object):
+    """
+    Histogram of non-negative integers in log-linear buckets, in the manner of HdrHistogram.
+
+    Values below `2 ** SUB_BUCKET_BITS` are counted exactly. Larger values are counted in
+    buckets whose width is at most 1/2 ** (SUB_BUCKET_BITS - 1) of the value, so that percentiles
+    have a bounded relative error while the number of buckets grows only logarithmically.
+    """
+    SUB_BUCKET_BITS = 5
+    _HALF = 1 << (SUB_BUCKET_BITS - 1)
+    _LINEAR_LIMIT = 1 << SUB_BUCKET_BITS
+
+    def __init__(self, counts=None, count=0, total=0, max_value=0):
+        self.counts = counts if counts is not None else {}
+        self.count = count
+        self.total = total
+        self.max = max_value
+
+    @classmethod
+    def _index(cls, value):
+        if value < cls._LINEAR_LIMIT:
+            return value
+        shift = value.bit_length() - cls.SUB_BUCKET_BITS
+        return shift * cls._HALF + (value >> shift)
+
+    @classmethod
+    def _highest_value(cls, index):
+        """Largest value counted in the bucket."""
+        if index < cls._LINEAR_LIMIT:
+            return index
+        shift, top = divmod(index - cls._HALF, cls._HALF)
+        return ((top + cls._HALF + 1) << shift) - 1
+
+    def record(self, value):
+        value = max(0, int(value))
+        index = self._index(value)
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def percentile(self, percent):
+        """
+        :param percent: Percentile to get, 0..100.
+        :return: Upper bound of the value at the percentile, or None if nothing is recorded.
+        """
+        if self.count == 0:
+            return None
+        limit = max(1, self.count * percent / 100)
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= limit:
+                return min(self._highest_value(index), self.max)
+        return self.max
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else None,
+            "p50": self.percentile(50),
+            "p90": self.percentile(90),
+            "p99": self.percentile(99),
+            "max": self.max if self.count else None,
+        }
+
+    def as_state(self):
+        return [dict(self.counts), self.count, self.total, self.max]
+
+    @classmethod
+    def from_state(cls, state):
+        counts, count, total, max_value = state
+        return cls({int(k): v for k, v in counts.items()}, count, total, max_value)
+
+
+# Recorded metrics, and units of the recorded values.
+METRICS = (
+    ("time_us", "µs"),
+    ("queries", ""),
+    ("db_time_us", "µs"),
+    ("response_bytes", "B"),
+)
+
+CACHE_PREFIX = "kirppu:instrumentation:"
+# Number of processes whose histograms can be published at the same time.
+MAX_PROCESSES = 256
+_PROCESS_ID = "{}:{}".format(socket.gethostname(), os.getpid())
+
+_lock = threading.Lock()
+# Function name -> metric name -> Histogram.
+_histograms = {}
+_last_publish = 0.0
+
+_publish_lock = threading.Lock()
+# Slot claimed by this process, if any.
+_slot = None
+
+
+class _QueryRecorder(object):
+    def __init__(self):
+        self.queries = 0
+        self.time = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.time += time.perf_counter() - start
+            self.queries += 1
+
+
+@contextlib.contextmanager
+def measure(name):
+    """
+    Measure a call of AJAX function `name`. The context value is a callable, that must be
+    given the response to record its size.
+    """
+    if not settings.KIRPPU_INSTRUMENTATION:
+        yield lambda response: None
+        return
+
+    recorder = _QueryRecorder()
+    response_size = [0]
+
+    def set_response(response):
+        if response is not None and not response.streaming:
+            response_size[0] = len(response.content)
+
+    start = time.perf_counter()
+    try:
+        with contextlib.ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(recorder))
+            yield set_response
+    finally:
+        elapsed = time.perf_counter() - start
+        _record(name, (
+            elapsed * 1000000,
+            recorder.queries,
+            recorder.time * 1000000,
+            response_size[0],
+        ))
+
+
+def _record(name, values):
+    global _last_publish
+    with _lock:
+        metrics = _histograms.get(name)
+        if metrics is None:
+            metrics = _histograms[name] = {metric: Histogram() for metric, _unit in METRICS}
+        for (metric, _unit), value in zip(METRICS, values):
+            metrics[metric].record(value)
+
+        now = time.monotonic()
+        publish = now - _last_publish >= settings.KIRPPU_INSTRUMENTATION_PUBLISH_INTERVAL
+        if publish:
+            _last_publish = now
+    if publish:
+        _publish()
+
+
+def _snapshot_state():
+    with _lock:
+        return {
+            name: {metric: histogram.as_state() for metric, histogram in metrics.items()}
+            for name, metrics in _histograms.items()
+        }
+
+
+def _slot_key(slot):
+    return "{}slot:{}".format(CACHE_PREFIX, slot)
+
+
+def _slot_keys():
+    return [_slot_key(slot) for slot in range(MAX_PROCESSES)]
+
+
+def _publish():
+    global _slot
+    value = {"process": _PROCESS_ID, "histograms": _snapshot_state()}
+    timeout = settings.KIRPPU_INSTRUMENTATION_TTL
+    with _publish_lock:
+        if _slot is not None:
+            key = _slot_key(_slot)
+            current = cache.get(key)
+            if current is not None and current["process"] == _PROCESS_ID:
+                cache.set(key, value, timeout=timeout)
+                return
+            # Expired, and possibly claimed by another process meanwhile.
+            _slot = None
+        for slot in range(MAX_PROCESSES):
+            if cache.add(_slot_key(slot), value, timeout=timeout):
+                _slot = slot
+                return
+
+
+def _merge_states(states):
+    merged = {}
+    for state in states:
+        for name, metrics in state.items():
+            target = merged.setdefault(name, {metric: Histogram() for metric, _unit in METRICS})
+            for metric, histogram_state in metrics.items():
+                target[metric].merge(Histogram.from_state(histogram_state))
+    return merged
+
+
+def _summarize(histograms):
+    return {
+        name: {metric: metrics[metric].summary() for metric, _unit in METRICS}
+        for name, metrics in sorted(histograms.items())
+    }
+
+
+def snapshot():
+    """
+    Get percentiles of the histograms of this process.
+
+    :return: Function name -> metric name -> summary dict.
+    :rtype: dict
+    """
+    return _summarize(_merge_states([_snapshot_state()]))
+
+
+def collect():
+    """
+    Get percentiles of the histograms published by all processes, including this process.
+
+    :return: Function name -> metric name -> summary dict.
+    :rtype: dict
+    """
+    _publish()
+    states = cache.get_many(_slot_keys())
+    return _summarize(_merge_states(value["histograms"] for value in states.values()))
+
+
+def reset():
+    """Clear the histograms of this process and published by all processes."""
+    with _lock:
+        _histograms.clear()
+    cache.delete_many(_slot_keys())
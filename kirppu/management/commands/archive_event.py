@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = 'Move item state logs and receipts of a finished event from the database to an archive file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('event', type=str, help="Event slug")
+        parser.add_argument('--batch-size', type=int, default=1000, help="Rows to delete in one transaction")
+        parser.add_argument('--force', action="store_true", help="Archive the event even if it is not finished")
+
+    def handle(self, *args, **options):
+        from kirppu import archive
+        from kirppu.models import Event
+
+        if not archive.is_configured():
+            raise CommandError("KIRPPU_ARCHIVE_DIR must be set to a persistent directory for archives")
+        try:
+            event = Event.objects.get(slug=options["event"])
+        except Event.DoesNotExist:
+            raise CommandError("Event {} not found".format(options["event"]))
+        if event.get_real_database_alias() != "default":
+            raise CommandError("Event from another database cannot be archived")
+        if not options["force"] and (event.checkout_active or event.end_date >= datetime.date.today()):
+            raise CommandError("Event has not finished yet")
+
+        path = archive.archive_path(event)
+        if archive.is_archived(event):
+            self.stdout.write("Using existing archive {}".format(path))
+        else:
+            counts = archive.export(event)
+            self.stdout.write("Archived to {}: {}".format(path, self._format(counts)))
+
+        # Nothing may be purged unless it is in the archive.
+        missing = archive.verify(event)
+        if missing:
+            raise CommandError("Rows changed after archiving are missing from {}: {}".format(
+                path, self._format(missing)))
+
+        counts = archive.purge(event, batch_size=options["batch_size"])
+        self.stdout.write("Deleted: {}".format(self._format(counts)))
+
+    @staticmethod
+    def _format(counts):
+        return ", ".join("{} {}".format(count, name) for name, count in counts.items())
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+import timeit
+
+from django.core.management.base import BaseCommand, CommandError
+
+from kirppu.utils import model_dict_fn
+
+
+class Command(BaseCommand):
+    help = 'Compare speed of Item serializers using the items of an event'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=5, help="Number of rounds to run each variant")
+        parser.add_argument('event', type=str, help="Event slug whose items are used")
+
+    def handle(self, *args, **options):
+        from kirppu.models import Item
+
+        query = Item.objects.filter(vendor__event__slug=options["event"])
+        items = list(query.select_related("itemtype"))
+        if not items:
+            raise CommandError("Event has no items")
+
+        # Reads every field dynamically, as model_dict_fn did before compiling the fields.
+        reference = model_dict_fn(__extend=Item.as_dict, __access_fn=lambda self, value: getattr(self, value))
+
+        variants = (
+            ("dynamic as_dict", lambda: [reference(i) for i in items]),
+            ("compiled as_dict", lambda: [i.as_dict() for i in items]),
+            ("query + dynamic as_dict", lambda: [reference(i) for i in query.select_related("itemtype")]),
+            ("query + compiled as_dict", lambda: [i.as_dict() for i in query.select_related("itemtype")]),
+            ("query + as_dict_rows", lambda: Item.as_dict_rows(query)),
+        )
+
+        self.stdout.write("{} items, best of {} rounds".format(len(items), options["repeat"]))
+        for name, fn in variants:
+            best = min(timeit.repeat(fn, number=1, repeat=options["repeat"]))
+            self.stdout.write("{:<26} {:9.3f} ms  {:7.2f} us/item".format(
+                name, best * 1000, best * 1000000 / len(items)))
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+from django.core.management.base import BaseCommand
+
+from kirppu import instrumentation
+
+
+class Command(BaseCommand):
+    help = 'Print checkout API call percentiles published to the cache by the server processes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action="store_true", help="Clear the published data after printing")
+
+    def handle(self, *args, **options):
+        data = instrumentation.collect()
+        if not data:
+            self.stdout.write("No data. Instrumentation data can be read only with a cache shared between processes.")
+
+        columns = ("count", "mean", "p50", "p90", "p99", "max")
+        for name, metrics in data.items():
+            self.stdout.write(name)
+            self.stdout.write("  {:<16}".format("") + "".join("{:>11}".format(c) for c in columns))
+            for metric, unit in instrumentation.METRICS:
+                summary = metrics[metric]
+                label = "{} ({})".format(metric, unit) if unit else metric
+                self.stdout.write("  {:<16}".format(label) + "".join(
+                    "{:>11}".format("-" if summary[c] is None else int(round(summary[c])))
+                    for c in columns
+                ))
+
+        if options["reset"]:
+            instrumentation.reset()
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = 'Re-count item state counters used by statistics from the items'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--event', type=str, help="Event slug to limit the re-count to")
+        parser.add_argument('--check', action="store_true", help="Only report differing counters")
+
+    def handle(self, *args, **options):
+        from kirppu.models import Event, Item, ItemStateCounter
+
+        events = Event.objects.filter(source_db__isnull=True) | Event.objects.filter(source_db="")
+        if options["event"]:
+            events = events.filter(slug=options["event"])
+
+        differing = 0
+        for event in events.order_by("pk"):
+            if not options["check"]:
+                count = ItemStateCounter.objects.rebuild(event)
+                self.stdout.write("{}: {} counters".format(event.slug, count))
+                continue
+
+            stored = {
+                (event.pk, c.itemtype_id, c.vendor_id, c.state, c.abandoned): (c.count, c.price_sum)
+                for c in ItemStateCounter.objects.filter(event=event).exclude(count=0)
+            }
+            counted = ItemStateCounter.objects.counted(Item.objects.filter(vendor__event=event))
+            for key in sorted(set(stored) | set(counted), key=str):
+                if stored.get(key) != counted.get(key):
+                    differing += 1
+                    self.stdout.write("{}: item type {}, vendor {}, {} (abandoned: {}): stored {}, counted {}".format(
+                        event.slug, key[1], key[2], key[3], key[4], stored.get(key), counted.get(key)))
+
+        if differing:
+            raise CommandError("{} counters differ".format(differing))
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = 'Re-calculate vendor balances from items and provision rows of compensation receipts'
+
+    FIELDS = ("sold_count", "sold_sum", "compensated_count", "compensated_sum", "provision_sum")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--event', type=str, help="Event slug to limit the re-calculation to")
+        parser.add_argument('--check', action="store_true", help="Only report differing balances")
+
+    def handle(self, *args, **options):
+        from kirppu.models import Event, Vendor, VendorBalance
+
+        events = Event.objects.filter(source_db__isnull=True) | Event.objects.filter(source_db="")
+        if options["event"]:
+            events = events.filter(slug=options["event"])
+
+        differing = 0
+        for event in events.order_by("pk"):
+            if not options["check"]:
+                count = VendorBalance.objects.rebuild(event)
+                self.stdout.write("{}: {} balances".format(event.slug, count))
+                continue
+
+            stored = {
+                balance.vendor_id: self._values(balance.__dict__)
+                for balance in VendorBalance.objects.filter(vendor__event=event)
+            }
+            counted = {
+                vendor_id: self._values(fields)
+                for vendor_id, fields in VendorBalance.objects.counted(Vendor.objects.filter(event=event)).items()
+            }
+            empty = self._values({})
+            for vendor_id in sorted(set(stored) | set(counted)):
+                if stored.get(vendor_id, empty) != counted.get(vendor_id, empty):
+                    differing += 1
+                    self.stdout.write("{}: vendor {}: stored {}, counted {}".format(
+                        event.slug, vendor_id, stored.get(vendor_id, empty), counted.get(vendor_id, empty)))
+
+        if differing:
+            raise CommandError("{} balances differ".format(differing))
+
+    def _values(self, fields):
+        return tuple(fields.get(name) or 0 for name in self.FIELDS)
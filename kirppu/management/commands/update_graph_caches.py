@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'Add new item state log entries to the cached statistics graphs. Meant to be run periodically.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--event', type=str, help="Event slug to limit the update to")
+
+    def handle(self, *args, **options):
+        from kirppu import archive, stats
+        from kirppu.models import Event
+
+        events = Event.objects.filter(source_db__isnull=True) | Event.objects.filter(source_db="")
+        if options["event"]:
+            events = events.filter(slug=options["event"])
+
+        for event in events.order_by("pk"):
+            if archive.is_archived(event):
+                continue
+            updated = sum(stats.update_cache(graph) for graph in stats.cached_graphs(event))
+            if updated:
+                self.stdout.write("{}: {} graphs updated".format(event.slug, updated))
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+
+class Command(BaseCommand):
+    help = 'Check that stored receipt totals match the totals calculated from receipt rows'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--event', type=str, help="Event slug to limit the check to")
+        parser.add_argument('--fix', action="store_true", help="Store the calculated total for differing receipts")
+
+    def handle(self, *args, **options):
+        from kirppu.models import Receipt
+
+        query = Receipt.objects.all()
+        if options["event"]:
+            query = query.filter(event__slug=options["event"])
+
+        # Checking is done without locks, so that it does not block checkout.
+        drifted = query.with_drifted_total()
+        for receipt in drifted:
+            self.stdout.write("Receipt {}: stored {}, calculated {}".format(
+                receipt.pk, receipt.total, receipt.calculated_total))
+            if options["fix"]:
+                self._fix(receipt.pk)
+
+        if drifted and not options["fix"]:
+            raise CommandError("{} receipts have differing total".format(len(drifted)))
+        self.stdout.write("{} receipts checked, {} differing{}".format(
+            query.count(), len(drifted), ", fixed" if drifted else ""))
+
+    @staticmethod
+    def _fix(receipt_pk):
+        from kirppu.models import Receipt
+
+        with transaction.atomic():
+            # The receipt may have been changed after it was checked, but the total calculated
+            # while holding the lock is correct in any case.
+            receipt = Receipt.objects.select_for_update().get(pk=receipt_pk)
+            receipt.calculate_total()
+            receipt.save(update_fields=("total",))
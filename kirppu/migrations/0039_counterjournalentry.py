@@ -0,0 +1,29 @@
+# Generated by Django 3.0.14 on 2026-10-16 20:19
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kirppu', '0038_event_source_db'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CounterJournalEntry',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(help_text='Client generated operation identifier', max_length=64)),
+                ('op', models.CharField(choices=[('reserve', 'Reserve item'), ('release', 'Release item'), ('finish', 'Finish receipt'), ('abort', 'Abort receipt')], max_length=8)),
+                ('time', models.DateTimeField(auto_now_add=True)),
+                ('status', models.IntegerField()),
+                ('result', models.TextField()),
+                ('counter', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='kirppu.Counter')),
+            ],
+            options={
+                'unique_together': {('counter', 'key')},
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 3.0.14 on 2026-10-16 20:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kirppu', '0039_counterjournalentry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IdempotentResponse',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('session_key', models.CharField(max_length=40)),
+                ('key', models.CharField(max_length=64)),
+                ('endpoint', models.CharField(max_length=64)),
+                ('time', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('status', models.IntegerField()),
+                ('content_type', models.CharField(max_length=128)),
+                ('content', models.BinaryField()),
+            ],
+            options={
+                'unique_together': {('session_key', 'key')},
+            },
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 3.0.14 on 2026-10-16 20:39
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+# noinspection PyPep8Naming
+def count_items(apps, schema_editor):
+    Item = apps.get_model("kirppu", "Item")
+    ItemStateCounter = apps.get_model("kirppu", "ItemStateCounter")
+    db_alias = schema_editor.connection.alias
+
+    rows = Item.objects.using(db_alias) \
+        .order_by() \
+        .values("vendor__event_id", "itemtype_id", "vendor_id", "state", "abandoned") \
+        .annotate(count=models.Count("pk"), price_sum=models.Sum("price"))
+    ItemStateCounter.objects.using(db_alias).bulk_create([
+        ItemStateCounter(
+            event_id=row["vendor__event_id"],
+            itemtype_id=row["itemtype_id"],
+            vendor_id=row["vendor_id"],
+            state=row["state"],
+            abandoned=row["abandoned"],
+            count=row["count"],
+            price_sum=row["price_sum"],
+        )
+        for row in rows.iterator()
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kirppu', '0040_idempotentresponse'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ItemStateCounter',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('state', models.CharField(choices=[('AD', 'Advertised'), ('BR', 'Brought to event'), ('ST', 'Staged for selling'), ('SO', 'Sold'), ('MI', 'Missing'), ('RE', 'Returned to vendor'), ('CO', 'Compensated to vendor')], max_length=8)),
+                ('abandoned', models.BooleanField()),
+                ('count', models.IntegerField(default=0)),
+                ('price_sum', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('event', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='kirppu.Event')),
+                ('itemtype', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='kirppu.ItemType')),
+                ('vendor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='kirppu.Vendor')),
+            ],
+            options={
+                'unique_together': {('event', 'itemtype', 'vendor', 'state', 'abandoned')},
+            },
+        ),
+        migrations.RunPython(count_items, migrations.RunPython.noop),
+    ]
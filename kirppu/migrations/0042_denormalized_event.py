@@ -0,0 +1,63 @@
+# Generated by Django 3.0.14 on 2026-10-16 20:47
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+# noinspection PyPep8Naming
+def fill_event(apps, schema_editor):
+    Counter = apps.get_model("kirppu", "Counter")
+    Item = apps.get_model("kirppu", "Item")
+    ItemStateLog = apps.get_model("kirppu", "ItemStateLog")
+    Receipt = apps.get_model("kirppu", "Receipt")
+    ReceiptItem = apps.get_model("kirppu", "ReceiptItem")
+    db_alias = schema_editor.connection.alias
+
+    def value_of(model, value, ref):
+        return models.Subquery(model.objects.using(db_alias).filter(pk=models.OuterRef(ref)).values(value)[:1])
+
+    ItemStateLog.objects.using(db_alias).update(event_id=value_of(Item, "vendor__event_id", "item_id"))
+    Receipt.objects.using(db_alias).update(event_id=value_of(Counter, "event_id", "counter_id"))
+    ReceiptItem.objects.using(db_alias).update(event_id=value_of(Receipt, "event_id", "receipt_id"))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kirppu', '0041_itemstatecounter'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='itemstatelog',
+            name='event',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='kirppu.Event'),
+        ),
+        migrations.AddField(
+            model_name='receipt',
+            name='event',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='kirppu.Event'),
+        ),
+        migrations.AddField(
+            model_name='receiptitem',
+            name='event',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='kirppu.Event'),
+        ),
+        migrations.RunPython(fill_event, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='itemstatelog',
+            index=models.Index(fields=['event', 'time'], name='kirppu_item_event_i_e7c773_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='itemstatelog',
+            index=models.Index(fields=['event', 'new_state'], name='kirppu_item_event_i_af32a6_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='receipt',
+            index=models.Index(fields=['event', 'status', 'type'], name='kirppu_rece_event_i_8a14b6_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='receiptitem',
+            index=models.Index(fields=['event', 'action'], name='kirppu_rece_event_i_0a40ee_idx'),
+        ),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 3.0.14 on 2026-10-16 20:49
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+# noinspection PyPep8Naming
+def count_balances(apps, schema_editor):
+    Item = apps.get_model("kirppu", "Item")
+    ReceiptExtraRow = apps.get_model("kirppu", "ReceiptExtraRow")
+    VendorBalance = apps.get_model("kirppu", "VendorBalance")
+    db_alias = schema_editor.connection.alias
+
+    balances = {}
+    items = Item.objects.using(db_alias) \
+        .filter(state__in=("SO", "CO")) \
+        .order_by() \
+        .values("vendor_id", "state") \
+        .annotate(count=models.Count("pk"), price_sum=models.Sum("price"))
+    for row in items.iterator():
+        prefix = "sold" if row["state"] == "SO" else "compensated"
+        balance = balances.setdefault(row["vendor_id"], {})
+        balance[prefix + "_count"] = row["count"]
+        balance[prefix + "_sum"] = row["price_sum"]
+
+    provisions = ReceiptExtraRow.objects.using(db_alias) \
+        .filter(type__in=("PRO", "PRO_FIX"), receipt__type="COMPENSATION") \
+        .order_by() \
+        .values("receipt__vendor_id") \
+        .annotate(value=models.Sum("value"))
+    for row in provisions.iterator():
+        balances.setdefault(row["receipt__vendor_id"], {})["provision_sum"] = row["value"]
+
+    VendorBalance.objects.using(db_alias).bulk_create([
+        VendorBalance(vendor_id=vendor_id, **fields)
+        for vendor_id, fields in balances.items()
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kirppu', '0042_denormalized_event'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VendorBalance',
+            fields=[
+                ('vendor', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to='kirppu.Vendor')),
+                ('sold_count', models.IntegerField(default=0)),
+                ('sold_sum', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('compensated_count', models.IntegerField(default=0)),
+                ('compensated_sum', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('provision_sum', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+            ],
+        ),
+        migrations.RunPython(count_balances, migrations.RunPython.noop),
+    ]
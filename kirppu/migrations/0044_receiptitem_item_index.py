@@ -0,0 +1,17 @@
+# Generated by Django 3.0.14 on 2026-10-16 20:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kirppu', '0043_vendorbalance'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='receiptitem',
+            index=models.Index(fields=['item', 'action', 'receipt'], name='kirppu_rece_item_id_b14594_idx'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 3.0.14 on 2026-10-16 20:54
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kirppu', '0044_receiptitem_item_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GraphCache',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=16)),
+                ('as_prices', models.BooleanField()),
+                ('last_log_id', models.IntegerField(default=0)),
+                ('bucket_time', models.DateTimeField(null=True)),
+                ('balance', models.TextField(default='{}')),
+                ('lines', models.TextField(default='')),
+                ('event', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='kirppu.Event')),
+                ('itemtype', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='kirppu.ItemType')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='graphcache',
+            constraint=models.UniqueConstraint(fields=('event', 'kind', 'as_prices', 'itemtype'), name='graph_cache_key'),
+        ),
+        migrations.AddConstraint(
+            model_name='graphcache',
+            constraint=models.UniqueConstraint(condition=models.Q(itemtype__isnull=True), fields=('event', 'kind', 'as_prices'), name='graph_cache_event_key'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+from django.db import migrations
+
+
+# noinspection PyPep8Naming
+def clear_graph_caches(apps, schema_editor):
+    # Cached buckets were not aligned to minutes.
+    GraphCache = apps.get_model("kirppu", "GraphCache")
+    GraphCache.objects.using(schema_editor.connection.alias).all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kirppu', '0045_graphcache'),
+    ]
+
+    operations = [
+        migrations.RunPython(clear_graph_caches, migrations.RunPython.noop),
+    ]
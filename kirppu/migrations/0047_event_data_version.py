@@ -0,0 +1,21 @@
+# Generated by Django 3.0.14 on 2026-10-16 21:08
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kirppu', '0046_clear_graphcache'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EventDataVersion',
+            fields=[
+                ('event', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to='kirppu.Event')),
+                ('version', models.BigIntegerField(default=0)),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.0.14 on 2026-10-16 22:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kirppu', '0047_event_data_version'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='counterjournalentry',
+            name='time',
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 3.0.14 on 2026-10-16 23:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kirppu', '0048_counterjournalentry_time_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='graphcache',
+            name='pending_log_id',
+            field=models.IntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='graphcache',
+            name='pending_transactions',
+            field=models.BigIntegerField(null=True),
+        ),
+    ]
@@ -1,20 +1,25 @@
+import contextlib
 from decimal import Decimal
+import json
 import random
+import threading
 import typing
 import warnings
 
 from django.core.exceptions import ValidationError, ImproperlyConfigured
 from django.core.validators import MinLengthValidator, MinValueValidator, RegexValidator
-from django.db import models, transaction
-from django.db.models import F, Sum
+from django.db import connections, models, transaction, IntegrityError
+from django.db.models import F, OuterRef, Prefetch, Subquery, Sum
+from django.db.models.functions import Coalesce
 import django.http
 from django.urls import reverse
 from django.utils import timezone
+from django.utils.encoding import force_str
 from django.utils.translation import gettext_lazy as _
 from django.utils.module_loading import import_string
 from django.conf import settings
 
-from .utils import model_dict_fn, format_datetime, short_description, datetime_iso_human
+from .utils import model_dict_fn, model_values_fn, format_datetime, short_description, datetime_iso_human
 
 from .util import (
     number_to_hex,
@@ -746,6 +751,7 @@ class Box(models.Model):
 
     def set_hidden(self, value):
         Item.objects.filter(box=self).update(hidden=value)
+        EventDataVersion.objects.bump([self.representative_item.vendor.event_id])
 
     def is_printed(self):
         """
@@ -760,6 +766,7 @@ class Box(models.Model):
 
     def set_printed(self, value):
         Item.objects.filter(box=self).update(printed=value)
+        EventDataVersion.objects.bump([self.representative_item.vendor.event_id])
 
     def _get_representative_item(self):
         return self.representative_item
@@ -959,6 +966,21 @@ class Item(models.Model):
         adult=lambda self: self.adult == Item.ADULT_YES,
     )
 
+    # Same as as_dict, but for all items in a QuerySet.
+    as_dict_rows = staticmethod(model_values_fn(
+        "code",
+        "name",
+        "state",
+        "abandoned",
+        "hidden",
+        price=("price", lambda value: decimal_to_transport(value)),
+        vendor="vendor_id",
+        state_display=("state", lambda value: force_str(dict(Item.STATE).get(value, value), strings_only=True)),
+        itemtype="itemtype__key",
+        itemtype_display="itemtype__title",
+        adult=("adult", lambda value: value == Item.ADULT_YES),
+    ))
+
     as_public_dict = model_dict_fn(
         "vendor_id",
         "code",
@@ -1011,7 +1033,7 @@ class Item(models.Model):
         obj.full_clean()
         obj.save()
 
-        ItemStateLog.objects.create(item=obj, old_state="", new_state=obj.state)
+        ItemStateLog.objects.create(item=obj, old_state="", new_state=obj.state, event_id=obj.vendor.event_id)
 
         return obj
 
@@ -1145,6 +1167,14 @@ class ReceiptItem(models.Model):
     action = models.CharField(choices=ACTION, max_length=16, default=ADD)
     add_time = models.DateTimeField(auto_now_add=True)
 
+    # Copy of receipt.event, for filtering by Event without joins.
+    event = models.ForeignKey(Event, on_delete=models.CASCADE, null=True)
+
+    def save(self, *args, **kwargs):
+        if self.event_id is None:
+            self.event_id = self.receipt.event_id
+        super(ReceiptItem, self).save(*args, **kwargs)
+
     def as_dict(self):
         ret = {
             "action": self.action,
@@ -1155,6 +1185,66 @@ class ReceiptItem(models.Model):
     def __str__(self):
         return str(self.item)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["event", "action"]),
+            # Covers finding Receipts of an Item.
+            models.Index(fields=["item", "action", "receipt"]),
+        ]
+
+
+def uses_event_columns(database):
+    """
+    :param database: Database alias of an Event.
+    :return: True if the `event` columns of ItemStateLog, Receipt and ReceiptItem can be used in the database.
+        They are filled only in the local database, and other databases may not have them at all.
+    :rtype: bool
+    """
+    return (database or "default") == "default"
+
+
+class ReceiptQuerySet(models.QuerySet):
+    def with_calculated_total(self):
+        """
+        Annotate `calculated_total`, the total re-calculated from receipt rows in the same way
+        `Receipt.calculate_total` does.
+        """
+        field = models.DecimalField(max_digits=8, decimal_places=2)
+        items_total = ReceiptItem.objects \
+            .filter(receipt=OuterRef("pk"), action=ReceiptItem.ADD) \
+            .order_by().values("receipt").annotate(value=Sum("item__price")).values("value")
+        extras_total = ReceiptExtraRow.objects \
+            .filter(receipt=OuterRef("pk")) \
+            .order_by().values("receipt").annotate(value=Sum("value")).values("value")
+
+        return self.annotate(calculated_total=(
+            Coalesce(Subquery(items_total, output_field=field), 0, output_field=field) +
+            Coalesce(Subquery(extras_total, output_field=field), 0, output_field=field)
+        ))
+
+    def with_details(self):
+        """
+        Fetch everything `Receipt.as_dict` needs for the whole result set: clerks with their users
+        and counters are joined, and notes with their clerks are prefetched in one query.
+        """
+        notes = ReceiptNote.objects.select_related("clerk__user").order_by("timestamp")
+        return self \
+            .select_related("clerk__user", "counter") \
+            .prefetch_related(Prefetch("receiptnote_set", queryset=notes, to_attr="prefetched_notes"))
+
+    def with_drifted_total(self):
+        """
+        Get receipts whose stored total differs from the total calculated from the receipt rows.
+
+        :return: Receipts with `calculated_total` attribute.
+        :rtype: list[Receipt]
+        """
+        return [
+            receipt
+            for receipt in self.with_calculated_total().iterator()
+            if receipt.total != receipt.calculated_total
+        ]
+
 
 class Receipt(models.Model):
     PENDING = "PEND"
@@ -1177,6 +1267,8 @@ class Receipt(models.Model):
         (TYPE_COMPENSATION, _(u"Compensation")),
     )
 
+    objects = ReceiptQuerySet.as_manager()
+
     items = models.ManyToManyField(Item, through=ReceiptItem)
     status = models.CharField(choices=STATUS, max_length=16, default=PENDING)
     total = models.DecimalField(max_digits=8, decimal_places=2, default=0)
@@ -1189,6 +1281,17 @@ class Receipt(models.Model):
     # Relevant only for vendor-specific receipts, i.e. TYPE_COMPENSATION.
     vendor = models.ForeignKey(Vendor, on_delete=models.CASCADE, null=True, blank=True)
 
+    # Copy of counter.event, for filtering by Event without joins.
+    event = models.ForeignKey(Event, on_delete=models.CASCADE, null=True)
+
+    def save(self, *args, **kwargs):
+        if self.event_id is None:
+            self.event_id = self.counter.event_id
+        super(Receipt, self).save(*args, **kwargs)
+        update_fields = kwargs.get("update_fields")
+        if self.status == self.FINISHED and (update_fields is None or "status" in update_fields):
+            EventDataVersion.objects.bump([self.event_id])
+
     def items_list(self):
         return [
             self._item_dict(row)
@@ -1229,10 +1332,28 @@ class Receipt(models.Model):
         end_time=lambda self: format_datetime(self.end_time) if self.end_time is not None else None,
         clerk=lambda self: self.clerk.as_dict(),
         counter=lambda self: self.counter.name,
-        notes=lambda self: [note.as_dict() for note in self.receiptnote_set.order_by("timestamp")],
+        notes=lambda self: [note.as_dict() for note in self.notes_list()],
         type_display=lambda self: self.get_type_display(),
     )
 
+    def notes_list(self):
+        notes = getattr(self, "prefetched_notes", None)
+        if notes is None:
+            notes = self.receiptnote_set.order_by("timestamp")
+        return notes
+
+    def add_to_total(self, amount):
+        """
+        Apply a change of receipt rows to the stored total without re-calculating it.
+        The receipt must be locked for update, and the caller is responsible for saving the total.
+
+        :param amount: Price of rows added, or negative price of rows removed.
+        :type amount: Decimal
+        :return: The new total.
+        """
+        self.total += amount
+        return self.total
+
     def calculate_total(self):
         result = ReceiptItem.objects.filter(action=ReceiptItem.ADD, receipt=self)\
             .aggregate(price_total=Sum("item__price"))
@@ -1261,6 +1382,9 @@ class Receipt(models.Model):
                 ~models.Q(type="COMPENSATION") & models.Q(vendor__isnull=True)),
                 name="vendor_id_nullity")
         ]
+        indexes = [
+            models.Index(fields=["event", "status", "type"]),
+        ]
 
 
 class ReceiptExtraRow(models.Model):
@@ -1310,7 +1434,136 @@ class ReceiptNote(models.Model):
         )
 
 
+class _StateLogBuffer(object):
+    """Changes collected by a `ItemStateLogManager.buffered` block."""
+
+    def __init__(self):
+        self.logs = []
+        # Changes of ItemStateCounters, as given to `ItemStateCounterManager.apply`.
+        self.counter_deltas = {}
+        # Changes of VendorBalances, as given to `VendorBalanceManager.apply`.
+        self.balance_changes = {}
+
+    def extend(self, other):
+        self.logs.extend(other.logs)
+        for key, (count, price_sum) in other.counter_deltas.items():
+            _add_delta(self.counter_deltas, key, count, price_sum)
+        _add_balance_changes(self.balance_changes, other.balance_changes)
+
+
 class ItemStateLogManager(models.Manager):
+    # Stack of buffers of `buffered` blocks, per thread.
+    _buffers = threading.local()
+    # Item fields whose values are counted by ItemStateCounters, in addition to the state.
+    COUNTED_FIELDS = ("itemtype_id", "vendor_id", "abandoned", "price")
+
+    def _buffer_stack(self):
+        stack = getattr(self._buffers, "stack", None)
+        if stack is None:
+            stack = self._buffers.stack = []
+        return stack
+
+    def pending(self):
+        """
+        :return: Buffer of the innermost `buffered` block, or None if not in one.
+        :rtype: _StateLogBuffer | None
+        """
+        stack = self._buffer_stack()
+        return stack[-1] if stack else None
+
+    @contextlib.contextmanager
+    def buffered(self):
+        """
+        Collect state log entries written in the block, and insert them with one query when the
+        block exits successfully. Must be used inside the transaction the logged changes are made in,
+        so that the entries are written just before the transaction is committed. Entries of a
+        nested block are passed to the enclosing block, or discarded if the nested block fails,
+        in the same way as a savepoint would discard them.
+
+        Changes of ItemStateCounters and VendorBalances made in the block are collected in the same way,
+        and written with one query per table along with the entries.
+
+        As the entries are inserted at the end of the block, their `time` is the time of the insert.
+        """
+        stack = self._buffer_stack()
+        buffer = _StateLogBuffer()
+        stack.append(buffer)
+        try:
+            yield buffer.logs
+        finally:
+            stack.pop()
+
+        if stack:
+            stack[-1].extend(buffer)
+        else:
+            self._flush(buffer)
+
+    def _flush(self, buffer):
+        if buffer.logs:
+            self._insert(buffer.logs)
+        deltas = dict(buffer.counter_deltas)
+        for key, (count, price_sum) in ItemStateCounter.objects.log_deltas(buffer.logs).items():
+            _add_delta(deltas, key, count, price_sum)
+        ItemStateCounter.objects.write(deltas, buffer.balance_changes)
+
+    def _write(self, objs):
+        buffer = self.pending()
+        if buffer is not None:
+            buffer.logs.extend(objs)
+            return objs
+        objs = self._insert(objs)
+        ItemStateCounter.objects.write(ItemStateCounter.objects.log_deltas(objs))
+        return objs
+
+    def _insert(self, objs):
+        missing = {obj.item_id for obj in objs if obj.event_id is None}
+        if missing:
+            events = dict(Item.objects.filter(pk__in=missing).values_list("pk", "vendor__event_id"))
+            for obj in objs:
+                if obj.event_id is None:
+                    obj.event_id = events[obj.item_id]
+        return self.bulk_create(objs)
+
+    @classmethod
+    def _counted_values(cls, items):
+        """
+        Read the values counted by ItemStateCounters from Items, or from the database for Items
+        that do not have them loaded.
+
+        :param items: Items to be logged.
+        :type items: list[Item]
+        :return: Item id mapped to (event id, item type id, vendor id, abandoned, price).
+        :rtype: dict
+        """
+        result = {}
+        unknown = []
+        for item in items:
+            values = cls._loaded_values(item) if Item.vendor.is_cached(item) else None
+            if values is not None:
+                result[item.pk] = (item.vendor.event_id,) + tuple(values.values())
+            else:
+                unknown.append(item.pk)
+        if unknown:
+            result.update(
+                (row[0], row[1:])
+                for row in Item.objects.filter(pk__in=unknown).values_list(
+                    "pk", "vendor__event_id", *cls.COUNTED_FIELDS)
+            )
+        return result
+
+    @classmethod
+    def _loaded_values(cls, item):
+        """
+        :return: Counted field names of an Item mapped to their values, or None if some are not loaded.
+        :rtype: dict | None
+        """
+        if not item.get_deferred_fields().isdisjoint(cls.COUNTED_FIELDS):
+            return None
+        values = {name: getattr(item, name) for name in cls.COUNTED_FIELDS}
+        # The price may have been assigned as a string.
+        values["price"] = Item._meta.get_field("price").to_python(values["price"])
+        return values
+
     @staticmethod
     def _make_log_state(request, doit):
         from .ajax_util import get_clerk, get_counter, AjaxError
@@ -1329,19 +1582,78 @@ class ItemStateLogManager(models.Manager):
         return doit(counter, clerk)
 
     def log_state(self, item, new_state, request):
+        return self._log(item, item.state, new_state, request)
+
+    def _log(self, item, old_state, new_state, request, values=None):
+        if values is None:
+            values = self._counted_values([item])[item.pk]
+
         def actual(counter, clerk):
-            return self.create(
+            return self._write([_counted_log(
+                values,
                 item=item,
-                old_state=item.state,
+                old_state=old_state,
                 new_state=new_state,
                 clerk=clerk,
-                counter=counter)
+                counter=counter)])[0]
         return self._make_log_state(request, actual)
 
+    def transition(self, item, from_states, new_state, request, **fields):
+        """
+        Change state of an Item, if it is still in one of the expected states, and log the change.
+
+        The expected states are checked by the UPDATE statement itself, so the Item need not be
+        locked beforehand, and the row lock is held only from that statement on. The statement checks
+        also the counted values of the Item, so that they are logged as they were when changed.
+
+        :param item: Item to change. Updated in place on success, and re-read on failure.
+        :type item: Item
+        :param from_states: State, or tuple of states, the Item is expected to be in.
+        :param new_state: State to change the Item to.
+        :param request: Request whose clerk and counter are logged.
+        :param fields: Other Item fields to set in the same statement.
+        :return: True if the Item was changed, False if it was not in any of the expected states.
+        :rtype: bool
+        """
+        if not isinstance(from_states, tuple):
+            from_states = (from_states,)
+
+        values = self._loaded_values(item)
+        if values is None:
+            item.refresh_from_db(fields=("state", "itemtype", "vendor", "abandoned", "price"))
+            values = self._loaded_values(item)
+        for _attempt in range(2):
+            changed = Item.objects \
+                .filter(pk=item.pk, state__in=from_states, **values) \
+                .update(state=new_state, **fields)
+            if changed:
+                break
+            # Either the state or some of the values have been changed after the Item was read.
+            item.refresh_from_db(fields=("state", "itemtype", "vendor", "abandoned", "price"))
+            if item.state not in from_states:
+                return False
+            values = self._loaded_values(item)
+        else:
+            return False
+
+        # The state read earlier is the best knowledge of the previous state, as long as it was expected.
+        old_state = item.state if item.state in from_states else from_states[0]
+        event_id = item.vendor.event_id if Item.vendor.is_cached(item) else None
+        self._log(item, old_state, new_state, request, values=(event_id,) + tuple(values.values()))
+
+        item.state = new_state
+        for name, value in fields.items():
+            setattr(item, name, value)
+        return True
+
     def log_states(self, item_set, new_state, request):
+        item_set = list(item_set)
+        values = self._counted_values(item_set)
+
         def actual(counter, clerk):
             objs = [
-                ItemStateLog(
+                _counted_log(
+                    values[item.pk],
                     item=item,
                     old_state=item.state,
                     new_state=new_state,
@@ -1350,10 +1662,22 @@ class ItemStateLogManager(models.Manager):
                 )
                 for item in item_set
             ]
-            return self.bulk_create(objs)
+            return self._write(objs)
         return self._make_log_state(request, actual)
 
 
+def _counted_log(values, **kwargs):
+    """
+    Create an ItemStateLog entry that carries the counted values of its Item.
+
+    :param values: (event id, item type id, vendor id, abandoned, price) of the Item when logged.
+        Event id may be None, if it is not known.
+    """
+    log = ItemStateLog(event_id=values[0], **kwargs)
+    log.counted_values = values[1:]
+    return log
+
+
 class ItemStateLog(models.Model):
     objects = ItemStateLogManager()
 
@@ -1371,6 +1695,14 @@ class ItemStateLog(models.Model):
     clerk = models.ForeignKey(Clerk, null=True, on_delete=models.CASCADE)
     counter = models.ForeignKey(Counter, null=True, on_delete=models.CASCADE)
 
+    # Copy of item.vendor.event, for filtering by Event without joins.
+    event = models.ForeignKey(Event, null=True, on_delete=models.CASCADE)
+
+    def save(self, *args, **kwargs):
+        if self.event_id is None:
+            self.event_id = Item.objects.filter(pk=self.item_id).values_list("vendor__event_id", flat=True).get()
+        super(ItemStateLog, self).save(*args, **kwargs)
+
     def __repr__(self):
         return "<ItemStateLog item={} time={} old={} new={} clerk={} counter={}>".format(
             self.item.code,
@@ -1385,6 +1717,657 @@ class ItemStateLog(models.Model):
         permissions = (
             ("view_statistics", "Can see statistics"),
         )
+        indexes = [
+            models.Index(fields=["event", "time"]),
+            models.Index(fields=["event", "new_state"]),
+        ]
+
+
+class ItemStateCounterManager(models.Manager):
+    # Item values grouped by the counter key.
+    KEY_VALUES = ("vendor__event_id", "itemtype_id", "vendor_id", "state", "abandoned")
+    KEY_COLUMNS = ("event_id", "itemtype_id", "vendor_id", "state", "abandoned")
+
+    def apply(self, deltas, create=True):
+        """
+        Add changes to the counters. In a `ItemStateLogManager.buffered` block, the changes are written
+        at the end of the block.
+
+        :param deltas: Counter key, a tuple of (event id, item type id, vendor id, state, abandoned),
+            mapped to a tuple of (item count, price sum) to add.
+        :type deltas: dict
+        :param create: Create counters that do not exist. Set to False when only removing items,
+            as the counters may have been deleted along with the Event.
+        """
+        buffer = ItemStateLog.objects.pending()
+        if buffer is not None and create:
+            for key, (count, price_sum) in deltas.items():
+                _add_delta(buffer.counter_deltas, key, count, price_sum)
+            return
+        self.write(deltas, create=create)
+
+    def write(self, deltas, balance_changes=None, create=True):
+        """
+        Write changes to the counters and the VendorBalances, with one query per table.
+
+        :param deltas: Changes of the counters, as given to `apply`.
+        :type deltas: dict
+        :param balance_changes: Other changes of the balances, as given to `VendorBalanceManager.apply`.
+        :type balance_changes: dict | None
+        :param create: Create counters and balances that do not exist.
+        """
+        deltas = {key: delta for key, delta in deltas.items() if delta != (0, 0)}
+        balance_changes = dict(balance_changes or {})
+        _add_balance_changes(balance_changes, VendorBalance.objects.item_changes(deltas))
+
+        _upsert(self, self.KEY_COLUMNS, ("count", "price_sum"), deltas, create)
+        VendorBalance.objects.write(balance_changes, create=create)
+        EventDataVersion.objects.bump(key[0] for key in deltas)
+
+    @staticmethod
+    def log_deltas(logs):
+        """
+        Calculate moves of logged Items between the counters.
+
+        :param logs: ItemStateLog entries, with counted values of their Items given when logged.
+        :type logs: list[ItemStateLog]
+        :return: Changes of the counters, as given to `apply`.
+        :rtype: dict
+        """
+        deltas = {}
+        for log in logs:
+            itemtype_id, vendor_id, abandoned, price = log.counted_values
+            for state, sign in ((log.old_state, -1), (log.new_state, 1)):
+                _add_delta(deltas, (log.event_id, itemtype_id, vendor_id, state, abandoned), sign, sign * price)
+        return deltas
+
+    @staticmethod
+    def counted(items):
+        """
+        Count Items by counter key.
+
+        :param items: Item query.
+        :return: Counter key mapped to (item count, price sum).
+        :rtype: dict
+        """
+        rows = items \
+            .order_by() \
+            .values(*ItemStateCounterManager.KEY_VALUES) \
+            .annotate(count=models.Count("pk"), price_sum=Sum("price"))
+        return {
+            tuple(row[key] for key in ItemStateCounterManager.KEY_VALUES): (row["count"], row["price_sum"])
+            for row in rows
+        }
+
+    @contextlib.contextmanager
+    def tracking(self, items):
+        """
+        Update the counters for changes made to the Items by a query update in the block.
+        State changes that are logged, and changes made by `Item.save`, are counted already,
+        and must not be made to the Items in the block.
+
+        The Items are locked for the block, which is run in a transaction, so that concurrent
+        changes to them are not counted twice.
+
+        :param items: Query of the Items to be changed.
+        :return: Query of the locked Items, to be updated in the block instead of `items`,
+            as other Items may have started to match `items` meanwhile.
+        """
+        with transaction.atomic():
+            pks = list(items.select_for_update().values_list("pk", flat=True))
+            locked = Item.objects.filter(pk__in=pks)
+            before = self.counted(locked)
+            yield locked
+            after = self.counted(locked)
+
+            deltas = {}
+            for key, (count, price_sum) in before.items():
+                _add_delta(deltas, key, -count, -price_sum)
+            for key, (count, price_sum) in after.items():
+                _add_delta(deltas, key, count, price_sum)
+            self.apply(deltas)
+
+    @transaction.atomic
+    def rebuild(self, event):
+        """
+        Re-count the counters of an Event from its Items.
+
+        :return: Number of counters created.
+        :rtype: int
+        """
+        self.filter(event=event).delete()
+        counters = [
+            ItemStateCounter(event_id=event_id, itemtype_id=itemtype_id, vendor_id=vendor_id, state=state,
+                             abandoned=abandoned, count=count, price_sum=price_sum)
+            for (event_id, itemtype_id, vendor_id, state, abandoned), (count, price_sum)
+            in self.counted(Item.objects.filter(vendor__event=event)).items()
+        ]
+        self.bulk_create(counters)
+        return len(counters)
+
+
+def _add_delta(deltas, key, count, price_sum):
+    old_count, old_price_sum = deltas.get(key, (0, 0))
+    deltas[key] = (old_count + count, old_price_sum + price_sum)
+
+
+def _add_balance_changes(changes, other):
+    for vendor_id, fields in other.items():
+        vendor_changes = changes.setdefault(vendor_id, {})
+        for name, value in fields.items():
+            vendor_changes[name] = vendor_changes.get(name, 0) + value
+
+
+def _upsert(manager, key_columns, value_columns, changes, create=True):
+    """
+    Add values to rows of a table, creating the rows that do not exist.
+
+    The rows are changed in the order of their keys, so that concurrent transactions lock them
+    in the same order. Where supported, all rows are changed with one INSERT .. ON CONFLICT statement.
+
+    :param manager: Manager of the model of the table.
+    :param key_columns: Names of the columns of the unique key of the rows.
+    :param value_columns: Names of the columns to add the values to.
+    :param changes: Key, a tuple of key column values, mapped to a tuple of values to add.
+    :type changes: dict
+    :param create: Create rows that do not exist. If False, only existing rows are changed.
+    """
+    if not changes:
+        return
+    keys = sorted(changes)
+    connection = connections[manager.db]
+
+    if not create or connection.vendor not in ("sqlite", "postgresql"):
+        for key in keys:
+            key_values = dict(zip(key_columns, key))
+            query = manager.filter(**key_values)
+            update = {name: F(name) + value for name, value in zip(value_columns, changes[key])}
+            if query.update(**update) or not create:
+                continue
+            try:
+                with transaction.atomic(using=manager.db):
+                    manager.create(**key_values, **dict(zip(value_columns, changes[key])))
+            except IntegrityError:
+                # Created meanwhile by a concurrent transaction.
+                query.update(**update)
+        return
+
+    qn = connection.ops.quote_name
+    table = qn(manager.model._meta.db_table)
+    columns = tuple(key_columns) + tuple(value_columns)
+    sql = "INSERT INTO {table} ({columns}) VALUES {{rows}} ON CONFLICT ({keys}) DO UPDATE SET {updates}".format(
+        table=table,
+        columns=", ".join(qn(column) for column in columns),
+        keys=", ".join(qn(column) for column in key_columns),
+        updates=", ".join("{0} = {1}.{0} + EXCLUDED.{0}".format(qn(column), table) for column in value_columns),
+    )
+    row = "(" + ", ".join(["%s"] * len(columns)) + ")"
+    with connection.cursor() as cursor:
+        for start in range(0, len(keys), _UPSERT_BATCH_SIZE):
+            batch = keys[start:start + _UPSERT_BATCH_SIZE]
+            cursor.execute(
+                sql.format(rows=", ".join([row] * len(batch))),
+                [value for key in batch for value in tuple(key) + tuple(changes[key])],
+            )
+
+
+# Rows per INSERT statement of `_upsert`, keeping the parameter count within limits of SQLite.
+_UPSERT_BATCH_SIZE = 100
+
+
+class ItemStateCounter(models.Model):
+    """
+    Number of Items, and sum of their prices, per Event, item type, vendor, state and abandoned flag.
+
+    The counters are maintained in the transaction that changes the Items: state changes
+    are counted when their ItemStateLog entries are written, `Item.save` and delete are counted
+    by signal handlers, and other query updates must be wrapped in `ItemStateCounter.objects.tracking`.
+    The counters of an Event can be re-counted with `rebuild_item_state_counters` command.
+    """
+    objects = ItemStateCounterManager()
+
+    event = models.ForeignKey(Event, on_delete=models.CASCADE)
+    itemtype = models.ForeignKey(ItemType, on_delete=models.CASCADE)
+    vendor = models.ForeignKey(Vendor, on_delete=models.CASCADE)
+    state = models.CharField(
+        choices=Item.STATE,
+        max_length=8,
+    )
+    abandoned = models.BooleanField()
+    count = models.IntegerField(default=0)
+    price_sum = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+    class Meta:
+        unique_together = (
+            ("event", "itemtype", "vendor", "state", "abandoned"),
+        )
+
+    def __str__(self):
+        return "{} / {} / {}: {}".format(self.vendor_id, self.itemtype_id, self.state, self.count)
+
+
+class VendorBalanceManager(models.Manager):
+    # Item state mapped to the (count, price sum) fields of the balance.
+    STATE_FIELDS = {
+        Item.SOLD: ("sold_count", "sold_sum"),
+        Item.COMPENSATED: ("compensated_count", "compensated_sum"),
+    }
+    PROVISION_TYPES = (ReceiptExtraRow.TYPE_PROVISION, ReceiptExtraRow.TYPE_PROVISION_FIX)
+
+    # Fields of the balance, in the order used by `write`.
+    BALANCE_FIELDS = ("sold_count", "sold_sum", "compensated_count", "compensated_sum", "provision_sum")
+
+    def apply(self, changes, create=True):
+        """
+        Add changes to the balances. In a `ItemStateLogManager.buffered` block, the changes are written
+        at the end of the block.
+
+        :param changes: Vendor id mapped to a dict of balance field name mapped to value to add.
+        :type changes: dict
+        :param create: Create balances that do not exist.
+        """
+        buffer = ItemStateLog.objects.pending()
+        if buffer is not None and create:
+            _add_balance_changes(buffer.balance_changes, changes)
+            return
+        self.write(changes, create=create)
+
+    def write(self, changes, create=True):
+        """
+        Write changes to the balances with one query.
+
+        :param changes: Changes of the balances, as given to `apply`.
+        :type changes: dict
+        :param create: Create balances that do not exist.
+        """
+        rows = {
+            (vendor_id,): tuple(fields.get(name, 0) for name in self.BALANCE_FIELDS)
+            for vendor_id, fields in changes.items()
+            if any(fields.values())
+        }
+        _upsert(self, ("vendor_id",), self.BALANCE_FIELDS, rows, create)
+
+    def item_changes(self, deltas):
+        """
+        Calculate changes of the balances for sold and compensated Items.
+
+        :param deltas: Changes of the item state counters, as given to `ItemStateCounterManager.apply`.
+        :type deltas: dict
+        :return: Changes of the balances, as given to `apply`.
+        :rtype: dict
+        """
+        changes = {}
+        for (_event_id, _itemtype_id, vendor_id, state, _abandoned), (count, price_sum) in deltas.items():
+            fields = self.STATE_FIELDS.get(state)
+            if fields is None:
+                continue
+            vendor_changes = changes.setdefault(vendor_id, {})
+            for name, value in zip(fields, (count, price_sum)):
+                vendor_changes[name] = vendor_changes.get(name, 0) + value
+        return changes
+
+    @staticmethod
+    def is_maintained(database):
+        """
+        :param database: Database alias of an Event.
+        :return: True if the balances are maintained in the database. They are maintained only
+            in the local database, others must be calculated from Items and Receipts.
+        :rtype: bool
+        """
+        return (database or "default") == "default"
+
+    def of(self, vendor_id, using="default"):
+        """
+        Get balance of a Vendor.
+
+        :return: Balance of the Vendor, or a new unsaved zero balance if the Vendor has none.
+        :rtype: VendorBalance
+        """
+        balance = self.using(using).filter(vendor_id=vendor_id).first()
+        return balance if balance is not None else VendorBalance(vendor_id=vendor_id)
+
+    def counted(self, vendors):
+        """
+        Calculate balances from Items and provision rows of compensation Receipts.
+
+        :param vendors: Vendor query.
+        :return: Vendor id mapped to a dict of balance field name mapped to value.
+        :rtype: dict
+        """
+        result = {}
+        items = Item.objects \
+            .filter(vendor__in=vendors, state__in=self.STATE_FIELDS) \
+            .order_by() \
+            .values("vendor_id", "state") \
+            .annotate(count=models.Count("pk"), price_sum=Sum("price"))
+        for row in items:
+            count_field, sum_field = self.STATE_FIELDS[row["state"]]
+            result.setdefault(row["vendor_id"], {}).update({count_field: row["count"], sum_field: row["price_sum"]})
+
+        provisions = ReceiptExtraRow.objects \
+            .filter(type__in=self.PROVISION_TYPES, receipt__type=Receipt.TYPE_COMPENSATION,
+                    receipt__vendor__in=vendors) \
+            .order_by() \
+            .values("receipt__vendor_id") \
+            .annotate(value=Sum("value"))
+        for row in provisions:
+            result.setdefault(row["receipt__vendor_id"], {})["provision_sum"] = row["value"]
+        return result
+
+    @transaction.atomic
+    def rebuild(self, event):
+        """
+        Re-calculate the balances of Vendors of an Event.
+
+        :return: Number of balances created.
+        :rtype: int
+        """
+        self.filter(vendor__event=event).delete()
+        balances = [
+            VendorBalance(vendor_id=vendor_id, **fields)
+            for vendor_id, fields in self.counted(Vendor.objects.filter(event=event)).items()
+        ]
+        self.bulk_create(balances)
+        return len(balances)
+
+
+class VendorBalance(models.Model):
+    """
+    Running sums of sold and compensated Items, and paid provisions, of a Vendor.
+
+    Item sums are maintained with the item state counters, see `ItemStateCounter`. Provisions are
+    maintained by signal handlers of ReceiptExtraRow. The balances of an Event can be re-calculated
+    with `reconcile_vendor_balances` command.
+    """
+    objects = VendorBalanceManager()
+
+    vendor = models.OneToOneField(Vendor, on_delete=models.CASCADE, primary_key=True)
+    sold_count = models.IntegerField(default=0)
+    sold_sum = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    compensated_count = models.IntegerField(default=0)
+    compensated_sum = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    # Sum of provision rows of compensation receipts. Negative, when provision has been paid.
+    provision_sum = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+    def __str__(self):
+        return "{}: {} / {} / {}".format(self.vendor_id, self.sold_sum, self.compensated_sum, self.provision_sum)
+
+
+class GraphCacheManager(models.Manager):
+    def invalidate(self, event_ids, prices_only=False):
+        """
+        Remove cached graphs of Events whose logged Items have changed. The graphs are cached again
+        from the start by the next update.
+
+        :param event_ids: Ids of the Events.
+        :type event_ids: collections.abc.Iterable[int]
+        :param prices_only: Only prices of the Items have changed.
+        """
+        query = self.filter(event_id__in=set(event_ids) - {None})
+        if prices_only:
+            query = query.filter(as_prices=True)
+        query.delete()
+
+
+class GraphCache(models.Model):
+    """
+    Persisted state of a statistics graph of an Event, see `stats.update_cache`.
+
+    `lines` contains the finished buckets of the graph, and `bucket_time` and `balance` the state of
+    the bucket being collected, calculated from ItemStateLog entries up to `last_log_id`.
+    Graphs of an Event are removed when the cached values change, i.e. when prices or item types of
+    its Items are changed, or Items are deleted.
+
+    `pending_log_id` is the last entry seen by the previous update, to be added by a later update
+    once the transactions marked by `pending_transactions` have finished.
+    """
+    objects = GraphCacheManager()
+
+    event = models.ForeignKey(Event, on_delete=models.CASCADE)
+    kind = models.CharField(max_length=16)
+    as_prices = models.BooleanField()
+    itemtype = models.ForeignKey(ItemType, on_delete=models.CASCADE, null=True)
+
+    last_log_id = models.IntegerField(default=0)
+    pending_log_id = models.IntegerField(null=True)
+    pending_transactions = models.BigIntegerField(null=True)
+    bucket_time = models.DateTimeField(null=True)
+    # JSON object of item state mapped to its balance.
+    balance = models.TextField(default="{}")
+    lines = models.TextField(default="")
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["event", "kind", "as_prices", "itemtype"], name="graph_cache_key"),
+            models.UniqueConstraint(fields=["event", "kind", "as_prices"], condition=models.Q(itemtype__isnull=True),
+                                    name="graph_cache_event_key"),
+        ]
+
+    def __str__(self):
+        return "{} / {} / {} / {}: {}".format(self.event_id, self.kind, self.as_prices, self.itemtype_id,
+                                              self.last_log_id)
+
+
+class EventDataVersionManager(models.Manager):
+    def bump(self, event_ids):
+        """
+        Increment data versions of Events once the current transaction has been committed.
+
+        The increment is deferred, so that the version row of an Event is not kept locked
+        for the duration of checkout transactions.
+
+        :param event_ids: Ids of the Events whose statistics data has changed.
+        :type event_ids: collections.abc.Iterable[int]
+        """
+        event_ids = set(event_ids) - {None}
+        if event_ids:
+            transaction.on_commit(lambda: self._increment(event_ids))
+
+    def _increment(self, event_ids):
+        for event_id in event_ids:
+            query = self.filter(event_id=event_id)
+            if query.update(version=F("version") + 1):
+                continue
+            try:
+                with transaction.atomic():
+                    self.create(event_id=event_id, version=1)
+            except IntegrityError:
+                # Created meanwhile by a concurrent transaction, or the Event has been deleted.
+                query.update(version=F("version") + 1)
+
+    def of(self, event):
+        """
+        Get the data version of an Event.
+
+        :param event: Event as given to a view, possibly a view of an Event in another database.
+        :type event: Event
+        :return: The version, or None if the data of the Event is not versioned.
+        :rtype: int|None
+        """
+        if (event.get_real_database_alias() or "default") != "default":
+            # Changes in other databases are not tracked.
+            return None
+        version = self.filter(event_id=event.pk).values_list("version", flat=True).first()
+        return version or 0
+
+
+class EventDataVersion(models.Model):
+    """
+    Version of statistics data of an Event, incremented whenever an Item state or price changes,
+    Items are hidden or printed, or a Receipt is finished. Used as the key of cached statistics,
+    see `stats_cache`.
+    """
+    objects = EventDataVersionManager()
+
+    event = models.OneToOneField(Event, on_delete=models.CASCADE, primary_key=True)
+    version = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return "{}: {}".format(self.event_id, self.version)
+
+
+class CounterJournalEntry(models.Model):
+    """
+    Operation applied from a counter journal (see `checkout_api.counter_sync`).
+    Records the result so that an operation synced again is not applied twice.
+    Entries are kept for `settings.KIRPPU_COUNTER_JOURNAL_TTL` seconds.
+    """
+    OP_RESERVE = "reserve"
+    OP_RELEASE = "release"
+    OP_FINISH = "finish"
+    OP_ABORT = "abort"
+    OPS = (
+        (OP_RESERVE, _("Reserve item")),
+        (OP_RELEASE, _("Release item")),
+        (OP_FINISH, _("Finish receipt")),
+        (OP_ABORT, _("Abort receipt")),
+    )
+
+    KEY_LENGTH = 64
+
+    counter = models.ForeignKey(Counter, on_delete=models.CASCADE)
+    key = models.CharField(max_length=KEY_LENGTH, help_text=_("Client generated operation identifier"))
+    op = models.CharField(choices=OPS, max_length=8)
+    time = models.DateTimeField(auto_now_add=True, db_index=True)
+    status = models.IntegerField()
+    # Json encoded result of the operation, or error message if status is not 200.
+    result = models.TextField()
+
+    as_dict = model_dict_fn(
+        "key",
+        "op",
+        "status",
+        result=lambda self: json.loads(self.result),
+    )
+
+    class Meta:
+        unique_together = (
+            ("counter", "key"),
+        )
+
+    # Average number of synced journals between removing expired entries.
+    PRUNE_INTERVAL = 100
+
+    @classmethod
+    def prune(cls):
+        """
+        Remove expired entries, on average once per `PRUNE_INTERVAL` calls.
+        """
+        if random.randrange(cls.PRUNE_INTERVAL) == 0:
+            limit = timezone.now() - timezone.timedelta(seconds=settings.KIRPPU_COUNTER_JOURNAL_TTL)
+            cls.objects.filter(time__lt=limit).delete()
+
+    def __str__(self):
+        return "{} {} ({}): {}".format(self.counter_id, self.key, self.op, self.status)
+
+
+class IdempotentResponse(models.Model):
+    """
+    Response of an idempotent checkout API call (see `ajax_util.idempotent`), kept for
+    `settings.KIRPPU_IDEMPOTENCY_TTL` seconds.
+    The row is created when the call claims its key, and the response is filled in when the call is done.
+    """
+    KEY_LENGTH = 64
+    # Status of a claimed key whose call has not finished yet.
+    STATUS_PENDING = 0
+
+    session_key = models.CharField(max_length=40)
+    key = models.CharField(max_length=KEY_LENGTH)
+    endpoint = models.CharField(max_length=64)
+    time = models.DateTimeField(auto_now_add=True, db_index=True)
+    status = models.IntegerField()
+    content_type = models.CharField(max_length=128)
+    content = models.BinaryField()
+
+    class Meta:
+        unique_together = (
+            ("session_key", "key"),
+        )
+
+    # Average number of stored responses between removing expired ones.
+    PRUNE_INTERVAL = 100
+
+    @classmethod
+    def _expiry_limit(cls):
+        return timezone.now() - timezone.timedelta(seconds=settings.KIRPPU_IDEMPOTENCY_TTL)
+
+    @classmethod
+    def find(cls, session_key, key):
+        """
+        :return: Stored response, or None if there is no unexpired response for the key.
+        :rtype: IdempotentResponse|None
+        """
+        return cls.objects.filter(session_key=session_key, key=key, time__gte=cls._expiry_limit()).first()
+
+    @classmethod
+    def claim(cls, session_key, key, endpoint):
+        """
+        Claim the key for a call, by creating a pending row for it. Must be called in the transaction
+        of the call, so that a concurrent call with the same key waits on the unique constraint until
+        the transaction has ended, and then gets the stored response. If the transaction is rolled back,
+        the key is free again.
+
+        :return: A tuple of (row, claimed). If the key was claimed, the row is the new pending row,
+            to be finished with `complete` or `release`. Otherwise the row is the one of the earlier call,
+            which may be pending, if the earlier call is still running in the same transaction.
+        :rtype: (IdempotentResponse, bool)
+        """
+        existing = cls.find(session_key, key)
+        if existing is not None:
+            return existing, False
+        if random.randrange(cls.PRUNE_INTERVAL) == 0:
+            cls.objects.filter(time__lt=cls._expiry_limit()).delete()
+        try:
+            with transaction.atomic():
+                cls.objects.filter(session_key=session_key, key=key, time__lt=cls._expiry_limit()).delete()
+                return cls.objects.create(
+                    session_key=session_key,
+                    key=key,
+                    endpoint=endpoint,
+                    status=cls.STATUS_PENDING,
+                    content_type="",
+                    content=b"",
+                ), True
+        except IntegrityError:
+            # Claimed by a concurrent call, which has been committed meanwhile.
+            existing = cls.find(session_key, key)
+            if existing is None:
+                # Expired meanwhile, or not yet visible in this transaction.
+                existing = cls(session_key=session_key, key=key, endpoint=endpoint, status=cls.STATUS_PENDING)
+            return existing, False
+
+    @property
+    def is_pending(self):
+        return self.status == self.STATUS_PENDING
+
+    def complete(self, response):
+        """
+        Store the response of the call that claimed the key.
+
+        :type response: django.http.HttpResponse
+        """
+        self.status = response.status_code
+        self.content_type = response["Content-Type"]
+        self.content = response.content
+        self.save(update_fields=("status", "content_type", "content"))
+
+    def release(self):
+        """
+        Free the key claimed by a call that did not succeed, so that it can be retried.
+        """
+        self.delete()
+
+    def as_response(self):
+        response = django.http.HttpResponse(
+            bytes(self.content),
+            content_type=self.content_type,
+            status=self.status,
+        )
+        response["X-Idempotent-Replay"] = "true"
+        return response
+
+    def __str__(self):
+        return "{} {} ({})".format(self.endpoint, self.key, self.time)
 
 
 def default_temporary_access_permit_expiry():
@@ -6,7 +6,7 @@ from django.conf import settings
 from django.core.exceptions import SuspiciousOperation
 from django.db.models import Sum, Q, QuerySet
 
-from .models import ReceiptExtraRow, Receipt, Item, ReceiptItem
+from .models import Receipt, ReceiptExtraRow, Item, ReceiptItem, VendorBalance
 from .provision_dsl import run
 
 __author__ = 'codez'
@@ -42,7 +42,9 @@ class Provision(object):
         self._total_provision = self._run_function()
 
         if self.has_provision:
-            if receipt is None:
+            if receipt is None and VendorBalance.objects.is_maintained(self._database):
+                self._sum_for_compensation = VendorBalance.objects.of(vendor_id, using=self._database).sold_sum
+            elif receipt is None:
                 self._sum_for_compensation = \
                     vendor_items.filter(state=Item.SOLD).aggregate(sum=Sum("price"))["sum"]
             else:
@@ -68,6 +70,22 @@ class Provision(object):
         assert _r is None or isinstance(_r, Decimal), "Value returned from function must be null or a number"
         return _r
 
+    @staticmethod
+    def paid_provisions(vendor_id: int, database: str) -> Decimal:
+        """
+        :return: Sum of provisions of compensation receipts of a Vendor. Negative, when provision has been paid.
+        """
+        if VendorBalance.objects.is_maintained(database):
+            return VendorBalance.objects.of(vendor_id, using=database).provision_sum
+
+        extras = ReceiptExtraRow.objects.using(database).filter(
+            type__in=(ReceiptExtraRow.TYPE_PROVISION, ReceiptExtraRow.TYPE_PROVISION_FIX),
+            receipt__type=Receipt.TYPE_COMPENSATION,
+            receipt__receiptitem__item__vendor_id=vendor_id,
+        ).distinct()
+        extras = extras.aggregate(extras_value=Sum("value"))
+        return extras["extras_value"] or Decimal(0)
+
     def _run_function(self, items: Optional[QuerySet] = None) -> Optional[Decimal]:
         q = items
         if items is None:
@@ -80,13 +98,7 @@ class Provision(object):
         :return: Provision value for current items and provision fix for total.
         :rtype: (ReceiptExtraRow, ReceiptExtraRow)
         """
-        extras = ReceiptExtraRow.objects.using(self._database).filter(
-            type__in=(ReceiptExtraRow.TYPE_PROVISION, ReceiptExtraRow.TYPE_PROVISION_FIX),
-            receipt__type=Receipt.TYPE_COMPENSATION,
-            receipt__receiptitem__item__vendor_id=self._vendor_id,
-        ).distinct()
-        extras = extras.aggregate(extras_value=Sum("value"))
-        previous_provisions = extras["extras_value"] or Decimal(0)
+        previous_provisions = self.paid_provisions(self._vendor_id, self._database)
 
         # [      Sold      ][ Compensated ]
         # [provision_result]
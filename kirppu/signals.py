@@ -1,10 +1,15 @@
 # -*- coding: utf-8 -*-
+import contextlib
+import threading
 
 from django.db.models.signals import pre_migrate, post_migrate
 from django.dispatch import receiver
 
 ENABLE_CHECK = True
 
+# Whether deleted rows are kept counted in VendorBalances, per thread.
+_keep_balances = threading.local()
+
 
 @receiver(pre_migrate)
 def pre_migrate_handler(*args, **kwargs):
@@ -28,3 +33,115 @@ def delete_handler(sender, instance, using, **kwargs):
     # noinspection PyProtectedMember
     if ENABLE_CHECK and instance._meta.app_label in ("kirppu", "kirppuauth") and using != "default":
         raise ValueError("Deleting objects from non-default database should not happen")
+
+
+def event_changed_handler(sender, instance, **kwargs):
+    from .event_cache import invalidate
+    invalidate(instance)
+
+
+# Item fields that are part of the ItemStateCounter key, or counted by it.
+_COUNTED_FIELDS = {"state", "abandoned", "price", "itemtype", "itemtype_id", "vendor", "vendor_id"}
+# Other Item fields shown in statistics, see `EventDataVersion`.
+_VERSIONED_FIELDS = {"hidden", "printed", "box", "box_id"}
+
+
+def _item_counter_key(instance):
+    return instance.vendor.event_id, instance.itemtype_id, instance.vendor_id, instance.state, instance.abandoned
+
+
+def _item_price(instance):
+    # The price may have been assigned as a string.
+    return instance._meta.get_field("price").to_python(instance.price)
+
+
+def item_pre_save_handler(sender, instance, update_fields=None, **kwargs):
+    from .models import Item, ItemStateCounterManager
+    instance._counted_before = None
+    if instance._state.adding or instance.pk is None:
+        return
+    if update_fields is not None and _COUNTED_FIELDS.isdisjoint(update_fields):
+        instance._counted_before = False
+        return
+    row = Item.objects.filter(pk=instance.pk).values_list(*ItemStateCounterManager.KEY_VALUES, "price").first()
+    if row is not None:
+        instance._counted_before = (row[:-1], row[-1])
+
+
+def item_post_save_handler(sender, instance, update_fields=None, **kwargs):
+    from .models import EventDataVersion, GraphCache, ItemStateCounter
+    before = getattr(instance, "_counted_before", None)
+    if before is not False:
+        after = (_item_counter_key(instance), _item_price(instance))
+        if before is not None and before[0][1] != after[0][1]:
+            # Logs of the item have moved to graphs of another item type.
+            GraphCache.objects.invalidate([before[0][0], after[0][0]])
+        elif before is not None and before[1] != after[1]:
+            GraphCache.objects.invalidate([after[0][0]], prices_only=True)
+        if before != after:
+            deltas = {after[0]: (1, after[1])}
+            if before is not None:
+                count, price_sum = deltas.get(before[0], (0, 0))
+                deltas[before[0]] = (count - 1, price_sum - before[1])
+            # Bumps the data version too.
+            ItemStateCounter.objects.apply(deltas)
+            return
+    if update_fields is None or not _VERSIONED_FIELDS.isdisjoint(update_fields):
+        EventDataVersion.objects.bump([instance.vendor.event_id])
+
+
+def item_pre_delete_handler(sender, instance, **kwargs):
+    from .models import GraphCache, ItemStateCounter
+    # Logs of the item are deleted with it.
+    GraphCache.objects.invalidate([instance.vendor.event_id])
+    ItemStateCounter.objects.apply({_item_counter_key(instance): (-1, -_item_price(instance))}, create=False)
+
+
+def _provision_value(instance):
+    """Value of a ReceiptExtraRow counted to provision of a Vendor, as (vendor id, value)."""
+    from .models import Receipt, VendorBalance
+    if instance.type not in VendorBalance.objects.PROVISION_TYPES or instance.receipt.type != Receipt.TYPE_COMPENSATION:
+        return None
+    return instance.receipt.vendor_id, instance._meta.get_field("value").to_python(instance.value)
+
+
+def extra_row_pre_save_handler(sender, instance, **kwargs):
+    instance._provision_before = None
+    if instance._state.adding or instance.pk is None:
+        return
+    old = sender.objects.filter(pk=instance.pk).select_related("receipt").first()
+    if old is not None:
+        instance._provision_before = _provision_value(old)
+
+
+def extra_row_post_save_handler(sender, instance, **kwargs):
+    from .models import VendorBalance
+    changes = {}
+    for provision, sign in ((getattr(instance, "_provision_before", None), -1), (_provision_value(instance), 1)):
+        if provision is not None:
+            vendor_id, value = provision
+            changes.setdefault(vendor_id, {"provision_sum": 0})["provision_sum"] += sign * value
+    VendorBalance.objects.apply(changes)
+
+
+@contextlib.contextmanager
+def keeping_balances():
+    """
+    Keep provision rows deleted in the block counted in VendorBalances, for removing rows
+    that have been moved to an archive.
+    """
+    _keep_balances.active = True
+    try:
+        yield
+    finally:
+        _keep_balances.active = False
+
+
+def extra_row_pre_delete_handler(sender, instance, **kwargs):
+    from .models import VendorBalance
+    if getattr(_keep_balances, "active", False):
+        return
+    provision = _provision_value(instance)
+    if provision is not None:
+        vendor_id, value = provision
+        VendorBalance.objects.apply({vendor_id: {"provision_sum": -value}}, create=False)
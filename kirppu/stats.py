@@ -1,20 +1,29 @@
 # -*- coding: utf-8 -*-
 from collections import OrderedDict
 from datetime import datetime, timedelta
+from decimal import Decimal
+import json
+from types import SimpleNamespace
 
 import pytz
 from django.conf import settings
-from django.db import models
-from django.db.models import F
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections, models
+from django.db.models import F, Max, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from django.utils.translation import gettext as _
 
-from .models import Event, Item, ItemType, ItemStateLog
+from . import archive
+from .models import Event, GraphCache, Item, ItemType, ItemStateLog, ItemStateCounter, uses_event_columns
 
 __author__ = 'codez'
 
 __all__ = (
     "ItemCountData",
     "ItemEurosData",
+    "ItemStatisticsData",
     "iterate_logs",
     "RegistrationData",
     "SalesData",
@@ -64,22 +73,59 @@ class ItemCollectionData(object):
     GROUP_ITEM_TYPE = "itemtype"
     GROUP_VENDOR = "vendor"
 
-    def __init__(self, group_by, event: Event):
+    def __init__(self, group_by, event: Event, rows=None, item_types=None):
+        """
+        :param rows: Result rows of `query` with `aggregates` of this class. Queried, if not given.
+        :param item_types: Ids of item types of the Event in their order, when grouped by item type.
+            Queried, if not given.
+        """
         self._group_by = group_by
         self._event = event
-        self._raw_data = self._populate(Item.objects
-                                        .using(self._event.get_real_database_alias())
-                                        .filter(vendor__event=self._event)
-                                        .values(group_by))
+        if group_by not in (self.GROUP_ITEM_TYPE, self.GROUP_VENDOR):
+            raise ValueError("Unknown group_by value")
+        if rows is None:
+            rows = self.query(group_by, event, self.aggregates(self.uses_counters(event)))
+        self._raw_data = rows
 
         if group_by == self.GROUP_ITEM_TYPE:
-            self._init_for_item_type()
-        elif group_by == self.GROUP_VENDOR:
+            self._init_for_item_type(item_types)
+        else:
             self._init_for_vendor()
+
+    @staticmethod
+    def uses_counters(event: Event):
+        # ItemStateCounters are maintained only in the local database.
+        return event.get_real_database_alias() == "default"
+
+    @classmethod
+    def query(cls, group_by, event: Event, aggregates):
+        """
+        Run the grouped query of a collection.
+
+        :param aggregates: Aggregates to annotate, made by `aggregates` for `uses_counters` of the Event.
+        :return: List of rows.
+        :rtype: list[dict]
+        """
+        if cls.uses_counters(event):
+            query = ItemStateCounter.objects.filter(event=event, count__gt=0)
         else:
-            raise ValueError("Unknown group_by value")
+            query = Item.objects.using(event.get_real_database_alias()).filter(vendor__event=event)
+        query = query.values(group_by).annotate(**aggregates)
+        if group_by == cls.GROUP_VENDOR:
+            query = query.order_by("vendor_id")
+        return list(query)
+
+    @classmethod
+    def aggregates(cls, counters):
+        """
+        Aggregates of the collection per property.
+
+        :param counters: If True, aggregate ItemStateCounters instead of Items.
+        :rtype: dict
+        """
+        raise NotImplementedError()
 
-    def _init_for_item_type(self):
+    def _init_for_item_type(self, item_types):
         # Make the list data associative by item type.
         # The item type in raw_data is pk of ItemType.
         data = {
@@ -98,23 +144,24 @@ class ItemCollectionData(object):
                     item_data[property_key] = cell_value
                 sums[property_key] += cell_value
 
+        if item_types is None:
+            item_types = ItemType.objects \
+                .using(self._event.get_real_database_alias()) \
+                .filter(event=self._event) \
+                .order_by("order") \
+                .values_list("id", flat=True)
+
         # Fill possible gaps and order correctly.
         self._data = OrderedDict(
             (key, data.get(key, self._DEFAULT_VALUES))
-            for key in ItemType.objects
-                               .using(self._event.get_real_database_alias())
-                               .filter(event=self._event)
-                               .order_by("order")
-                               .values_list("id", flat=True)
+            for key in item_types
         )
 
         # Append calculated sum row.
         self._data["sum"] = sums
 
     def _init_for_vendor(self):
-        # Order vendor data by their id.
-        self._raw_data = self._raw_data.order_by("vendor_id")
-
+        # Vendor data is ordered by their id.
         data = OrderedDict(
             (row["vendor"], row)
             for row in self._raw_data
@@ -135,9 +182,6 @@ class ItemCollectionData(object):
     def keys(self):
         return self._data.keys()
 
-    def _populate(self, query):
-        raise NotImplementedError()
-
     def __repr__(self):
         return "{}({}, {})".format(self.__class__.__name__, self._group_by, self._data)
 
@@ -178,24 +222,44 @@ class ItemCollectionRow(object):
 
 
 class ItemCountData(ItemCollectionData):
-    def _populate(self, query):
-        # Count items per state. query must be already made group_by with query.values.
+    @classmethod
+    def aggregates(cls, counters):
+        if counters:
+            return cls._counter_aggregates()
+        # Count items per state.
         states = {
             key: models.Count(models.Case(models.When(state=p, then=1), output_field=models.IntegerField()))
-            for key, p in self.PROPERTIES.items()
+            for key, p in cls.PROPERTIES.items()
             if p is not None
         }
         abandoned = {
             key: models.Count(models.Case(models.When(
                 models.Q(state=p) & models.Q(abandoned=True), then=1), output_field=models.IntegerField()))
-            for key, p in self.ABANDONED_PROPERTIES.items()
+            for key, p in cls.ABANDONED_PROPERTIES.items()
         }
         states.update(abandoned)
-        # Return a result list that contains counts for all states, sum and the value for group_by per list item.
-        return query.annotate(
-            sum=models.Count("id"),
-            **states
-        )
+        # Counts for all states, and sum.
+        states.update(sum=models.Count("id"))
+        return states
+
+    @classmethod
+    def _counter_aggregates(cls):
+        # Same as aggregates of Items, but summing ItemStateCounter counts.
+        states = {
+            key: Coalesce(models.Sum(models.Case(models.When(state=p, then=F("count")),
+                                                 output_field=models.IntegerField())), 0)
+            for key, p in cls.PROPERTIES.items()
+            if p is not None
+        }
+        abandoned = {
+            key: Coalesce(models.Sum(models.Case(models.When(
+                models.Q(state=p) & models.Q(abandoned=True), then=F("count")),
+                output_field=models.IntegerField())), 0)
+            for key, p in cls.ABANDONED_PROPERTIES.items()
+        }
+        states.update(abandoned)
+        states.update(sum=models.Sum("count"))
+        return states
 
     def data_set(self, key, name):
         return ItemCountRow(key, self._data[key], name)
@@ -211,26 +275,26 @@ class ItemEurosData(ItemCollectionData):
         super(ItemEurosData, self).__init__(*args, **kwargs)
         self.use_cents = False
 
-    def _populate(self, query):
-        # Count item prices per state. query must be already made group_by with query.values.
+    @classmethod
+    def aggregates(cls, counters):
+        # Sum item prices per state, or price sums of ItemStateCounters.
+        price = "price_sum" if counters else "price"
         states = {
-            key: models.Sum(models.Case(models.When(state=p, then=models.F("price")),
+            key: models.Sum(models.Case(models.When(state=p, then=models.F(price)),
                                         output_field=models.DecimalField()))
-            for key, p in self.PROPERTIES.items()
+            for key, p in cls.PROPERTIES.items()
             if p is not None
         }
         abandoned = {
             key: models.Sum(models.Case(models.When(
                 models.Q(state=p) & models.Q(abandoned=True),
-                then=models.F("price")), output_field=models.DecimalField()))
-            for key, p in self.ABANDONED_PROPERTIES.items()
+                then=models.F(price)), output_field=models.DecimalField()))
+            for key, p in cls.ABANDONED_PROPERTIES.items()
         }
         states.update(abandoned)
-        # Return a result list that contains prices for all states, sum and the value for group_by per list item.
-        return query.annotate(
-            sum=models.Sum("price"),
-            **states
-        )
+        # Prices for all states, and sum.
+        states.update(sum=models.Sum(price))
+        return states
 
     def data_set(self, key, name):
         return ItemEurosRow(self.use_cents, key, self._data[key], name)
@@ -254,6 +318,44 @@ class ItemEurosRow(ItemCollectionRow):
         return formatted_value
 
 
+class ItemStatisticsData(object):
+    """
+    Both `ItemCountData` and `ItemEurosData` of an Event, calculated with one query.
+    """
+    _PREFIXES = (
+        ("count_", ItemCountData),
+        ("euros_", ItemEurosData),
+    )
+
+    def __init__(self, group_by, event: Event, item_types=None):
+        """
+        :param item_types: Ids of item types of the Event in their order, when grouped by item type.
+            Queried, if not given.
+        """
+        counters = ItemCollectionData.uses_counters(event)
+        aggregates = {}
+        for prefix, data_class in self._PREFIXES:
+            aggregates.update((prefix + key, value) for key, value in data_class.aggregates(counters).items())
+        rows = ItemCollectionData.query(group_by, event, aggregates)
+
+        if group_by == ItemCollectionData.GROUP_ITEM_TYPE and item_types is None:
+            item_types = list(ItemType.objects
+                              .using(event.get_real_database_alias())
+                              .filter(event=event)
+                              .order_by("order")
+                              .values_list("id", flat=True))
+
+        data = []
+        for prefix, data_class in self._PREFIXES:
+            data_rows = [
+                dict(((key[len(prefix):], value) for key, value in row.items() if key.startswith(prefix)),
+                     **{group_by: row[group_by]})
+                for row in rows
+            ]
+            data.append(data_class(group_by, event, rows=data_rows, item_types=item_types))
+        self.counts, self.euros = data  # type: ItemCountData, ItemEurosData
+
+
 # endregion
 
 
@@ -262,21 +364,166 @@ class ItemEurosRow(ItemCollectionRow):
 
 # region Statistics graphs generators.
 
+_CENT = Decimal("0.01")
+
+
+class _MinuteBucket(models.Func):
+    """Start of the minute of a time. Has an expression of its own for each supported database."""
+    output_field = models.DateTimeField()
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        # Times are stored as ISO format strings in UTC.
+        return self.as_sql(compiler, connection, template="strftime('%%Y-%%m-%%d %%H:%%M:00', %(expressions)s)",
+                           **extra_context)
+
+    def as_postgresql(self, compiler, connection, **extra_context):
+        return self.as_sql(compiler, connection, template="date_trunc('minute', %(expressions)s)", **extra_context)
+
+    @staticmethod
+    def to_datetime(value):
+        """Convert a value of the expression, as returned by the database, to an aware datetime."""
+        if isinstance(value, str):
+            value = datetime.strptime(value, "%Y-%m-%d %H:%M:%S")
+        if timezone.is_naive(value):
+            value = timezone.make_aware(value, pytz.utc)
+        return value
+
+
+def _sum_buckets(entries):
+    """
+    Calculate the result of `GraphLog.bucket_rows` from log entries ordered by time.
+    """
+    totals = {}
+    bucket_time = None
+    changed = set()
+    for entry in entries:
+        entry_bucket = entry.time.replace(second=0, microsecond=0)
+        if bucket_time is not None and entry_bucket != bucket_time:
+            for state in sorted(changed):
+                yield bucket_time, state, totals[state]
+            changed.clear()
+        bucket_time = entry_bucket
+
+        if entry.old_state:
+            totals[entry.old_state] = totals.get(entry.old_state, 0) - entry.value
+            changed.add(entry.old_state)
+        totals[entry.new_state] = totals.get(entry.new_state, 0) + entry.value
+        changed.add(entry.new_state)
+
+    for state in sorted(changed):
+        yield bucket_time, state, totals[state]
+
+
 class GraphLog(object):
     unix_epoch = datetime(1970, 1, 1, tzinfo=pytz.utc)
+    # Name of the graph in GraphCache.
+    kind = None
 
-    def __init__(self, event: Event, as_prices=False, extra_filter=None):
+    def __init__(self, event: Event, as_prices=False, extra_filter=None, item_type=None):
         self._event = event
         self._as_prices = as_prices
-        self._filter = extra_filter or dict()
+        self._cacheable = not extra_filter
+        self._filter = dict(extra_filter or ())
+        self._item_type = item_type
+        if item_type is not None:
+            self._filter["item__itemtype"] = item_type
 
     def query(self, only):
-        query = self._create_query().filter(item__vendor__event=self._event)
+        if uses_event_columns(self._event.get_real_database_alias()):
+            query = self._create_query().filter(event=self._event)
+        else:
+            query = self._create_query().filter(item__vendor__event=self._event)
         query = query.filter(**self._filter)
         if self._as_prices:
             return query.only("item__price", *only).annotate(value=F("item__price"))
         return query.only(*only).annotate(value=models.Value(1, output_field=models.IntegerField()))
 
+    def bucket_rows(self, **filters):
+        """
+        Get running sums of item values per state at the end of each minute that has log entries.
+
+        The sums are calculated by the database on SQLite and PostgreSQL, and from the entries otherwise.
+
+        :param filters: Extra filters of the log entries. Not applicable to archived Events.
+        :return: Tuples of (minute, state, running sum of the state), ordered by minute. Only the states
+            changed within the minute are included. The sums start from zero at the first entry.
+        """
+        if archive.is_archived(self._event):
+            return _sum_buckets(self._archived_entries())
+        query = self.query(("old_state", "new_state", "time")).filter(**filters)
+        connection = connections[query.db]
+        if connection.vendor not in ("sqlite", "postgresql") or not connection.features.supports_over_clause:
+            return _sum_buckets(query.order_by("time"))
+        return self._sql_bucket_rows(query, connection)
+
+    def _sql_bucket_rows(self, query, connection):
+        query = query.order_by()
+        bucket = _MinuteBucket("time")
+        added = query \
+            .values(bucket=bucket, state=F("new_state")) \
+            .annotate(weight=Sum("value"))
+        removed = query \
+            .exclude(old_state="") \
+            .values(bucket=bucket, state=F("old_state")) \
+            .annotate(weight=Sum("value"))
+        added_sql, added_params = added.query.get_compiler(connection=connection).as_sql()
+        removed_sql, removed_params = removed.query.get_compiler(connection=connection).as_sql()
+
+        sql = (
+            "SELECT bucket, state, SUM(SUM(weight)) OVER (PARTITION BY state ORDER BY bucket)"
+            " FROM (SELECT bucket, state, weight FROM ({added}) added"
+            " UNION ALL SELECT bucket, state, -weight FROM ({removed}) removed) deltas"
+            " GROUP BY bucket, state ORDER BY bucket, state"
+        ).format(added=added_sql, removed=removed_sql)
+
+        with connection.cursor() as cursor:
+            cursor.execute(sql, tuple(added_params) + tuple(removed_params))
+            rows = cursor.fetchall()
+        for bucket_time, state, value in rows:
+            # Sum of decimals is a float on SQLite.
+            value = Decimal(value).quantize(_CENT) if self._as_prices else int(value)
+            yield _MinuteBucket.to_datetime(bucket_time), state, value
+
+    def cache(self, create=False):
+        """
+        Get the GraphCache of this graph, or None if the graph is not cached.
+        Graphs of Events in other databases, archived Events, and graphs with extra filters are not cached,
+        nor are graphs in databases whose log entries cannot be settled, see `update_cache`.
+
+        :param create: Create the GraphCache if it does not exist yet.
+        :rtype: GraphCache | None
+        """
+        if not self._cacheable or (self._event.get_real_database_alias() or "default") != "default" \
+                or archive.is_archived(self._event) \
+                or connections["default"].vendor not in ("sqlite", "postgresql"):
+            return None
+        key = dict(event=self._event, kind=self.kind, as_prices=self._as_prices, itemtype=self._item_type)
+        if create:
+            return GraphCache.objects.get_or_create(**key)[0]
+        return GraphCache.objects.filter(**key).first()
+
+    @staticmethod
+    def load_balance(data):
+        return {state: Decimal(value) if isinstance(value, str) else value for state, value in json.loads(data).items()}
+
+    @staticmethod
+    def dump_balance(balance):
+        return json.dumps(balance, cls=DjangoJSONEncoder)
+
+    def _archived_entries(self):
+        # Archived logs are in primary key order, which is the order of writing, i.e. time.
+        for row in archive.read_rows(self._event, "itemstatelog"):
+            if not self._archived_row_matches(row):
+                continue
+            if any(row.get(key) != getattr(value, "pk", value) for key, value in self._filter.items()):
+                continue
+            yield SimpleNamespace(
+                time=parse_datetime(row["time"]),
+                old_state=row["old_state"],
+                new_state=row["new_state"],
+                value=Decimal(row["item__price"]) if self._as_prices else 1,
+            )
+
     @classmethod
     def datetime_to_js_time(cls, dt):
         return int((dt - cls.unix_epoch).total_seconds() * 1000)
@@ -287,13 +534,21 @@ class GraphLog(object):
     def _create_query(self):
         raise NotImplementedError
 
+    def _archived_row_matches(self, row):
+        """Archived counterpart of `_create_query`."""
+        raise NotImplementedError
+
 
 class RegistrationData(GraphLog):
+    kind = "registration"
     advertised_status = (Item.ADVERTISED,)
 
     def _create_query(self):
         return ItemStateLog.objects.using(self._event.get_real_database_alias()).filter(new_state=Item.ADVERTISED)
 
+    def _archived_row_matches(self, row):
+        return row["new_state"] == Item.ADVERTISED
+
     def get_log_str(self, bucket_time, balance):
         entry_time = self.datetime_to_js_time(bucket_time)
         advertised = sum(balance[status] for status in self.advertised_status)
@@ -304,6 +559,7 @@ class RegistrationData(GraphLog):
 
 
 class SalesData(GraphLog):
+    kind = "sales"
     brought_status = (Item.BROUGHT, Item.STAGED, Item.SOLD, Item.MISSING, Item.RETURNED, Item.COMPENSATED)
     unsold_status = (Item.BROUGHT, Item.STAGED)
     money_status = (Item.SOLD,)
@@ -312,6 +568,9 @@ class SalesData(GraphLog):
     def _create_query(self):
         return ItemStateLog.objects.using(self._event.get_real_database_alias()).exclude(new_state=Item.ADVERTISED)
 
+    def _archived_row_matches(self, row):
+        return row["new_state"] != Item.ADVERTISED
+
     def get_log_str(self, bucket_time, balance):
         entry_time = self.datetime_to_js_time(bucket_time)
         brought = sum(balance[status] for status in self.brought_status)
@@ -327,7 +586,46 @@ class SalesData(GraphLog):
         )
 
 
-def iterate_logs(using):
+BUCKET_TIME = timedelta(seconds=60)
+
+
+class _Buckets(object):
+    """
+    Formats running sums of `GraphLog.bucket_rows` into lines of one minute buckets, continuing from
+    the state of a previous bucket.
+    """
+    def __init__(self, using, bucket_time=None, balance=None):
+        self.using = using
+        self.bucket_time = bucket_time
+        self.balance = balance if balance is not None else {item_type: 0 for item_type, _item_desc in Item.STATE}
+
+    def add(self, rows):
+        """
+        Add the rows, calculated from entries after the current state, to the buckets.
+
+        :return: Lines of finished buckets.
+        """
+        base = dict(self.balance)
+        for bucket_time, state, total in rows:
+            if self.bucket_time is None:
+                # Start the graph before the first entry, such that everything starts at zero.
+                yield self.using.get_log_str(bucket_time - BUCKET_TIME, self.balance)
+                self.bucket_time = bucket_time
+            elif bucket_time > self.bucket_time:
+                yield self.using.get_log_str(self.bucket_time, self.balance)
+                self.bucket_time = bucket_time
+            # Entries of an earlier bucket are added to the current bucket.
+            self.balance[state] = base[state] + total
+
+    def last(self):
+        """
+        :return: Line of the bucket being collected, if any.
+        """
+        if self.bucket_time is not None:
+            yield self.using.get_log_str(self.bucket_time, self.balance)
+
+
+def iterate_logs(using, cached=True):
     """ Iterate through ItemStateLog objects returning current sum of each type of object at each timestamp.
 
     Example of returned CVS: js_time, advertized, brought, unsold, money, compensated
@@ -339,39 +637,112 @@ def iterate_logs(using):
     money is the number of sold items not yet redeemed by the seller. Should approach zero by the end of the event.
     compensated is the number of sold and unsold items redeemed by the seller. Should approach brought.
 
+    The entries are collected into one minute buckets by the database, see `GraphLog.bucket_rows`.
+    Buckets stored into GraphCache by `update_cache` are used as they are, so only the entries
+    written after the last update are read from the database. The cache is not modified.
+
     :param using: GraphLog used to create the output.
     :type using: GraphLog
+    :param cached: Use GraphCache of the graph, if it has been cached.
     :return: JSON presentation of the objects, one item at a time.
 
     """
-    # Collect the data into buckets of size bucket_td to reduce the amount of data that has to be sent
-    # and parsed at client side.
-    balance = {item_type: 0 for item_type, _item_desc in Item.STATE}
-    bucket_time = None
-    bucket_td = timedelta(seconds=60)
+    cache = using.cache() if cached else None
+    if cache is None:
+        buckets = _Buckets(using)
+        yield from buckets.add(using.bucket_rows())
+        yield from buckets.last()
+        return
 
-    only = "old_state", "new_state", "time"
-    entries = using.query(only)
+    buckets = _Buckets(using, cache.bucket_time,
+                       using.load_balance(cache.balance) if cache.bucket_time is not None else None)
+    yield cache.lines
+    yield from buckets.add(using.bucket_rows(pk__gt=cache.last_log_id))
+    yield from buckets.last()
 
-    for entry in entries.order_by("time"):
-        if bucket_time is None:
-            bucket_time = entry.time
-            # Start the graph before the first entry, such that everything starts at zero.
-            yield using.get_log_str(bucket_time - bucket_td, balance)
-        if (entry.time - bucket_time) > bucket_td:
-            # Fart out what was in the old bucket and start a new bucket.
-            yield using.get_log_str(bucket_time, balance)
-            bucket_time = entry.time
 
-        item_weight = entry.value
+def _running_transactions(connection):
+    """
+    Get a mark of the transactions running now, to be checked by `_transactions_finished`,
+    or None if no entries can be written before the entries that are visible now.
+    """
+    if connection.vendor != "postgresql":
+        # SQLite has a single writer, whose entries get ids after all committed entries.
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT txid_snapshot_xmax(txid_current_snapshot())")
+        return cursor.fetchone()[0]
 
-        if entry.old_state:
-            balance[entry.old_state] -= item_weight
-        balance[entry.new_state] += item_weight
 
-    # Fart out the last bucket.
-    if bucket_time is not None:
-        yield using.get_log_str(bucket_time, balance)
+def _transactions_finished(connection, mark):
+    """
+    Have all transactions running at the time of the `_running_transactions` mark finished.
+    """
+    if mark is None:
+        return True
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT txid_snapshot_xmin(txid_current_snapshot())")
+        return cursor.fetchone()[0] >= mark
+
+
+def update_cache(using):
+    """
+    Add settled log entries of the graph to its GraphCache.
+
+    Ids of log entries are taken in the order of writing, but the entries become visible in the order
+    their transactions are committed, so an id may become visible after a higher one. Therefore the
+    last entry visible at an update is added only once the transactions running at that time have
+    finished, i.e. by a later update.
+
+    :param using: GraphLog to update.
+    :type using: GraphLog
+    :return: True if entries were added to the cache.
+    """
+    cache = using.cache(create=True)
+    if cache is None:
+        return False
+    connection = connections[cache._state.db]
+
+    settled_log_id = None
+    if cache.pending_log_id is not None and _transactions_finished(connection, cache.pending_transactions):
+        settled_log_id = cache.pending_log_id
+    # The id must be read before the mark, so that the mark covers the transactions writing lower ids.
+    pending_log_id = using.query(()).filter(pk__gt=cache.last_log_id).aggregate(last=Max("pk"))["last"]
+    pending_transactions = _running_transactions(connection)
+    if pending_transactions is None:
+        settled_log_id, pending_log_id = pending_log_id, None
+
+    update = dict(pending_log_id=pending_log_id, pending_transactions=pending_transactions)
+    added = settled_log_id is not None and settled_log_id > cache.last_log_id
+    if added:
+        buckets = _Buckets(using, cache.bucket_time,
+                           using.load_balance(cache.balance) if cache.bucket_time is not None else None)
+        lines = "".join(buckets.add(using.bucket_rows(pk__gt=cache.last_log_id, pk__lte=settled_log_id)))
+        update.update(
+            last_log_id=settled_log_id,
+            bucket_time=buckets.bucket_time,
+            balance=using.dump_balance(buckets.balance),
+            lines=cache.lines + lines,
+        )
+    # Another update may have been run meanwhile, in which case its state is kept.
+    updated = GraphCache.objects.filter(pk=cache.pk, last_log_id=cache.last_log_id).update(**update)
+    return added and updated > 0
+
+
+def cached_graphs(event):
+    """
+    Get the graphs of the Event that are kept in GraphCache.
+
+    :type event: Event
+    :rtype: list[GraphLog]
+    """
+    graphs = []
+    for as_prices in (False, True):
+        graphs.append(SalesData(event=event, as_prices=as_prices))
+        graphs.append(RegistrationData(event=event, as_prices=as_prices))
+        for item_type in ItemType.objects.filter(event=event).order_by("pk"):
+            graphs.append(SalesData(event=event, as_prices=as_prices, item_type=item_type))
+    return graphs
 
 
 # endregion
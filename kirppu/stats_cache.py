@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.cache import get_conditional_response, patch_cache_control
+
+"""
+Cache of computed statistics, keyed by the data version of an Event (see `EventDataVersion`).
+
+Results are kept in the Django cache for `settings.KIRPPU_STATS_CACHE_TTL` seconds, but as the
+version is incremented whenever the underlying data changes, a cached result is never stale.
+Responses carry the version in their ETag, so that a client refreshing an unchanged page
+receives 304 Not Modified without anything being computed.
+"""
+
+__all__ = [
+    "cached_result",
+    "conditional_response",
+]
+
+CACHE_PREFIX = "kirppu:stats:"
+
+
+def cached_result(name, event, version, compute, *key):
+    """
+    Get result of `compute`, preferably from the cache.
+
+    :param name: Name of the cached result.
+    :type name: str
+    :param event: Event whose statistics are computed.
+    :type event: Event
+    :param version: Data version of the Event. If None, the result is not cached.
+    :type version: int|None
+    :param compute: Function computing the result. The result must be picklable.
+    :param key: Other values the result depends on, such as request parameters.
+    """
+    ttl = settings.KIRPPU_STATS_CACHE_TTL
+    if version is None or ttl <= 0:
+        return compute()
+
+    cache_key = "{}{}:{}:{}".format(CACHE_PREFIX, name, event.pk, ":".join(str(k) for k in (version,) + key))
+    result = cache.get(cache_key)
+    if result is None:
+        result = compute()
+        cache.set(cache_key, result, timeout=ttl)
+    return result
+
+
+def conditional_response(request, version, render, *key):
+    """
+    Respond with 304 Not Modified if the client has the version already, otherwise with `render()`.
+
+    :param request: The request.
+    :param version: Data version of the Event. If None, the response is always rendered.
+    :type version: int|None
+    :param render: Function returning the response.
+    :param key: Other values the response depends on, such as the user.
+    :rtype: django.http.HttpResponse
+    """
+    if version is None:
+        return render()
+
+    etag = '"{}"'.format("-".join(str(k) for k in (version,) + key))
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = render()
+        if response.status_code != 200:
+            return response
+        response["ETag"] = etag
+    # Revalidate on every use, as the version may have changed.
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
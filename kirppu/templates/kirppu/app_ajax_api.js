@@ -1,6 +1,47 @@
 (function() {
     const api = {};
+
+    // Key identifying a request and its retries, for functions replaying the original response.
+    const newIdempotencyKey = function() {
+        if (window.crypto && window.crypto.randomUUID) {
+            return window.crypto.randomUUID();
+        }
+        return Date.now().toString(36) + "-" + Math.random().toString(36).substring(2);
+    };
+
+    // Send the request again with the same key if the connection failed, as the server
+    // may have completed the original request.
+    const sendWithRetry = function(send, retries) {
+        const result = $.Deferred();
+        const attempt = function() {
+            send().then(
+                function(data, textStatus, jqXHR) { result.resolve(data, textStatus, jqXHR); },
+                function(jqXHR, textStatus, errorThrown) {
+                    if (jqXHR.status === 0 && retries-- > 0) {
+                        attempt();
+                    } else {
+                        result.reject(jqXHR, textStatus, errorThrown);
+                    }
+                }
+            );
+        };
+        attempt();
+        return result.promise();
+    };
 {% for name, f in funcs %}
+{% if f.idempotent %}
+api['{{ name }}'] = function(params, idempotencyKey) {
+    const key = idempotencyKey || newIdempotencyKey();
+    return sendWithRetry(function() {
+        return $.ajax({
+            type: '{{ f.method }}',
+            url:  '{% url f.view event.slug %}',
+            data: params,
+            headers: {'X-Idempotency-Key': key}
+        });
+    }, 2);
+};
+{% else %}
 api['{{ name }}'] = function(params) {
     return $.ajax({
         type: '{{ f.method }}',
@@ -8,6 +49,7 @@ api['{{ name }}'] = function(params) {
         data: params
     });
 };
+{% endif %}
 {% endfor %}
     window.{{ api_name }} = api;
 }).call(this);
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+from io import StringIO
+import shutil
+import tempfile
+from unittest import mock
+
+from django.core.management import call_command, CommandError
+from django.test import Client, TestCase, override_settings
+from django.utils import timezone
+
+from .factories import *
+from .api_access import Api
+from . import ResultMixin
+from .. import archive
+from ..models import Item, ItemStateLog, Receipt, ReceiptItem, VendorBalance
+from ..views.accounting import accounting_receipt
+
+
+@override_settings(KIRPPU_STATS_CACHE_TTL=0)
+class ArchiveTest(TestCase, ResultMixin):
+    def setUp(self):
+        self.archive_dir = tempfile.mkdtemp()
+        override = override_settings(KIRPPU_ARCHIVE_DIR=self.archive_dir)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.addCleanup(shutil.rmtree, self.archive_dir)
+
+        self.client = Client()
+        self.event = EventFactory()
+        self.vendor = VendorFactory(event=self.event)
+        self.items = ItemFactory.create_batch(4, vendor=self.vendor, itemtype=ItemTypeFactory(event=self.event))
+
+        self.counter = CounterFactory(event=self.event)
+        self.clerk = ClerkFactory(event=self.event)
+        self.api = Api(client=self.client, event=self.event)
+        self.assertSuccess(self.api.clerk_login(code=self.clerk.get_code(), counter=self.counter.identifier))
+
+        for item in self.items:
+            self.assertSuccess(self.api.item_checkin(code=item.code))
+        receipt = self.assertSuccess(self.api.receipt_start()).json()
+        for item in self.items[:3]:
+            self.assertSuccess(self.api.item_reserve(code=item.code))
+        self.assertSuccess(self.api.item_release(code=self.items[2].code))
+        self.assertSuccess(self.api.receipt_finish(id=receipt["id"]))
+
+        # Another event, not to be archived.
+        self.other_item = ItemFactory()
+        ItemStateLog.objects.create(item=self.other_item, old_state="", new_state=Item.ADVERTISED)
+        self.other_receipt = ReceiptItemFactory(item=self.other_item).receipt
+
+    def _stats(self):
+        return [
+            b"".join(fn(prices=prices).streaming_content)
+            for fn in (self.api.stats_sales_data, self.api.stats_registration_data)
+            for prices in ("false", "true")
+        ] + [
+            b"".join(self.api.stats_group_sales_data(type_id=self.items[0].itemtype_id).streaming_content),
+        ]
+
+    def test_archive(self):
+        stats = self._stats()
+        self.assertRaises(CommandError, call_command, "archive_event", self.event.slug, stdout=StringIO())
+
+        out = StringIO()
+        call_command("archive_event", self.event.slug, force=True, batch_size=2, stdout=out)
+        self.assertIn("Deleted: ", out.getvalue())
+
+        self.assertTrue(archive.is_archived(self.event))
+        self.assertFalse(ItemStateLog.objects.filter(item__vendor__event=self.event).exists())
+        self.assertFalse(Receipt.objects.filter(counter__event=self.event).exists())
+        self.assertFalse(ReceiptItem.objects.filter(receipt__counter__event=self.event).exists())
+        self.assertEqual(Item.SOLD, Item.objects.get(pk=self.items[0].pk).state)
+
+        self.assertTrue(ItemStateLog.objects.filter(item=self.other_item).exists())
+        self.assertTrue(Receipt.objects.filter(pk=self.other_receipt.pk).exists())
+
+        self.assertEqual(stats, self._stats())
+        receipts = list(archive.read_rows(self.event, "receipt"))
+        self.assertEqual([Receipt.FINISHED], [row["status"] for row in receipts])
+        self.assertEqual(4, len(list(archive.read_rows(self.event, "receiptitem"))))
+
+    def test_changed_after_archive(self):
+        archive.export(self.event)
+        self.assertSuccess(self.api.item_checkout(code=self.items[3].code))
+
+        self.assertRaises(CommandError, call_command, "archive_event", self.event.slug, force=True,
+                          stdout=StringIO())
+        self.assertEqual({"itemstatelog": 1}, archive.verify(self.event))
+        self.assertTrue(ItemStateLog.objects.filter(item__vendor__event=self.event).exists())
+
+    def _accounting(self):
+        output = StringIO()
+        with mock.patch("django.utils.timezone.now", return_value=timezone.now().replace(microsecond=0)):
+            accounting_receipt(output, self.event)
+        return output.getvalue()
+
+    @override_settings(KIRPPU_ALLOW_PROVISION_FUNCTIONS=True)
+    def test_accounting(self):
+        self.event.provision_function = "(* -0.5 (.count sold_and_compensated))"
+        self.event.save(update_fields=("provision_function",))
+        self.assertSuccess(self.api.item_compensate_start(vendor=self.vendor.id))
+        self.assertSuccess(self.api.item_compensate(code=self.items[0].code))
+        self.assertSuccess(self.api.item_compensate_end())
+
+        balance = VendorBalance.objects.get(vendor=self.vendor)
+        self.assertNotEqual(0, balance.provision_sum)
+        accounting = self._accounting()
+        self.assertIn("COMMISSION", accounting)
+
+        call_command("archive_event", self.event.slug, force=True, stdout=StringIO())
+        self.assertTrue(archive.is_archived(self.event))
+        self.assertEqual(accounting, self._accounting())
+        self.assertEqual(balance.provision_sum, VendorBalance.objects.get(vendor=self.vendor).provision_sum)
+
+    def test_archive_dir_required(self):
+        with override_settings(KIRPPU_ARCHIVE_DIR=None):
+            self.assertRaises(CommandError, call_command, "archive_event", self.event.slug, force=True,
+                              stdout=StringIO())
+            self.assertFalse(archive.is_archived(self.event))
+        self.assertTrue(Receipt.objects.filter(counter__event=self.event).exists())
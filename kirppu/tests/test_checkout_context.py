@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+from django.contrib.auth.models import AnonymousUser
+from django.test import RequestFactory, TestCase
+
+from .factories import ClerkFactory, CounterFactory, EventFactory, EventPermissionFactory
+from ..ajax_util import AjaxError, CheckoutContext, get_clerk, get_counter, require_user_features
+from ..models import ItemStateLog
+
+
+class CheckoutContextTest(TestCase):
+    def setUp(self):
+        self.event = EventFactory()
+        self.counter = CounterFactory(event=self.event)
+        self.clerk = ClerkFactory(event=self.event)
+
+        self.request = RequestFactory().post("/")
+        self.request.user = AnonymousUser()
+        self.request.session = {
+            "clerk": self.clerk.pk,
+            "clerk_token": self.clerk.access_key,
+            "counter": self.counter.pk,
+        }
+
+    def test_resolved_once(self):
+        with self.assertNumQueries(2):
+            self.assertEqual(self.clerk, get_clerk(self.request))
+            self.assertEqual(self.counter, get_counter(self.request))
+            self.assertEqual(self.clerk, get_clerk(self.request))
+            self.assertEqual(self.counter, get_counter(self.request))
+
+    def test_overseer_permission_resolved_once(self):
+        EventPermissionFactory(event=self.event, user=self.clerk.user, can_perform_overseer_actions=True)
+        view = require_user_features(overseer=True)(lambda request: get_clerk(request))
+
+        # Counter, Clerk with User and Event, EventPermission.
+        with self.assertNumQueries(3):
+            self.assertEqual(self.clerk, view(self.request))
+            self.assertTrue(CheckoutContext.of(self.request).permission.can_perform_overseer_actions)
+
+    def test_state_log_reuses_context(self):
+        get_clerk(self.request)
+        get_counter(self.request)
+
+        with self.assertNumQueries(0):
+            log = ItemStateLog.objects._make_log_state(self.request, lambda counter, clerk: (counter, clerk))
+        self.assertEqual((self.counter, self.clerk), log)
+
+    def test_clerk_token_checked(self):
+        get_clerk(self.request)
+        self.request.session["clerk_token"] = "0" * 14
+        self.assertRaises(AjaxError, get_clerk, self.request)
+
+    def test_counter_changed(self):
+        get_counter(self.request)
+        other = CounterFactory(event=self.event)
+        self.request.session["counter"] = other.pk
+        self.assertEqual(other, get_counter(self.request))
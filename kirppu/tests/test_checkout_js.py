@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+from django.test import Client, TestCase
+from django.urls import reverse
+
+from .factories import EventFactory
+from .. import checkout_api, event_cache
+
+
+class CheckoutJsTest(TestCase):
+    def setUp(self):
+        event_cache.invalidate()
+        checkout_api._checkout_js_cache.clear()
+        self.client = Client()
+        self.event = EventFactory()
+        self.url = reverse("kirppu:checkout_js", kwargs={"event_slug": self.event.slug})
+
+    def tearDown(self):
+        event_cache.invalidate()
+
+    def test_cached(self):
+        first = self.client.get(self.url)
+        self.assertEqual(200, first.status_code)
+        self.assertIn(b"api['item_reserve']", first.content)
+
+        with self.assertNumQueries(0):
+            second = self.client.get(self.url)
+        self.assertEqual(first.content, second.content)
+        self.assertEqual(first["ETag"], second["ETag"])
+
+    def test_not_modified(self):
+        etag = self.client.get(self.url)["ETag"]
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(304, response.status_code)
+
+    def test_cache_control(self):
+        version = checkout_api.ajax_api_version()
+        self.assertIn("no-cache", self.client.get(self.url)["Cache-Control"])
+        self.assertIn("no-cache", self.client.get(self.url, {"v": "old"})["Cache-Control"])
+        self.assertIn("max-age={}".format(checkout_api.CHECKOUT_JS_MAX_AGE),
+                      self.client.get(self.url, {"v": version})["Cache-Control"])
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+from http import HTTPStatus
+import json
+from unittest import mock
+
+from django.db import IntegrityError
+from django.test import Client, TestCase, override_settings
+from django.utils import timezone
+
+from .factories import *
+from .api_access import Api
+from . import ResultMixin
+from .. import checkout_api
+from ..models import CounterJournalEntry, Item, Receipt
+
+
+class CounterSyncTest(TestCase, ResultMixin):
+    def setUp(self):
+        self.client = Client()
+
+        self.event = EventFactory()
+        self.vendor = VendorFactory(event=self.event)
+        self.items = ItemFactory.create_batch(4, vendor=self.vendor, state=Item.BROUGHT)
+
+        self.counter = CounterFactory(event=self.event)
+        self.clerk = ClerkFactory(event=self.event)
+
+        self.api = Api(client=self.client, event=self.event)
+        self.api.clerk_login(code=self.clerk.get_code(), counter=self.counter.identifier)
+
+    def _sync(self, *journal):
+        return self.assertSuccess(self.api.counter_sync(journal=json.dumps(journal))).json()
+
+    def test_sync(self):
+        result = self._sync(
+            {"key": "a1", "op": "reserve", "code": self.items[0].code},
+            {"key": "a2", "op": "reserve", "code": self.items[1].code},
+            {"key": "a3", "op": "reserve", "code": self.items[2].code},
+            {"key": "a4", "op": "release", "code": self.items[1].code},
+        )
+        self.assertEqual([200] * 4, [r["status"] for r in result["results"]])
+        self.assertEqual([False] * 4, [r["replayed"] for r in result["results"]])
+
+        receipt = result["receipt"]
+        self.assertEqual(Receipt.PENDING, receipt["status"])
+        self.assertEqual(self.items[0].price_cents + self.items[2].price_cents, receipt["total"])
+        self.assertEqual(4, len(receipt["items"]))
+
+        result = self._sync({"key": "a5", "op": "finish"})
+        self.assertEqual(Receipt.FINISHED, result["results"][0]["result"]["status"])
+        self.assertIsNone(result["receipt"])
+        self.assertEqual(2, Item.objects.filter(state=Item.SOLD).count())
+
+    def test_replay(self):
+        entry = {"key": "b1", "op": "reserve", "code": self.items[0].code}
+        first = self._sync(entry)
+        second = self._sync(entry, {"key": "b2", "op": "reserve", "code": self.items[1].code})
+
+        self.assertEqual(first["results"][0]["result"], second["results"][0]["result"])
+        self.assertEqual([True, False], [r["replayed"] for r in second["results"]])
+        self.assertEqual(2, Item.objects.filter(state=Item.STAGED).count())
+        self.assertEqual(2, CounterJournalEntry.objects.filter(counter=self.counter).count())
+
+    def test_operation_integrity_error(self):
+        def fail(request, event, entry):
+            raise IntegrityError("other constraint")
+
+        # Not mistaken for an entry recorded by a concurrent sync.
+        with mock.patch.dict(checkout_api.JOURNAL_OPERATIONS, {CounterJournalEntry.OP_RESERVE: fail}):
+            with self.assertRaises(IntegrityError):
+                self.api.counter_sync(journal=json.dumps([{"key": "i1", "op": "reserve", "code": "X"}]))
+        self.assertEqual(0, CounterJournalEntry.objects.count())
+
+    @override_settings(KIRPPU_COUNTER_JOURNAL_TTL=60)
+    def test_prune(self):
+        self._sync({"key": "p1", "op": "reserve", "code": self.items[0].code})
+        CounterJournalEntry.objects.update(time=timezone.now() - timezone.timedelta(seconds=120))
+
+        with mock.patch.object(CounterJournalEntry, "PRUNE_INTERVAL", 1):
+            self._sync({"key": "p2", "op": "reserve", "code": self.items[1].code})
+        self.assertEqual(["p2"], list(CounterJournalEntry.objects.values_list("key", flat=True)))
+
+    def test_failed_entry(self):
+        self.items[1].state = Item.SOLD
+        self.items[1].save(update_fields=("state",))
+
+        result = self._sync(
+            {"key": "c1", "op": "reserve", "code": self.items[1].code},
+            {"key": "c2", "op": "reserve", "code": "NOTHING"},
+            {"key": "c3", "op": "reserve", "code": self.items[0].code},
+        )
+        self.assertEqual([HTTPStatus.CONFLICT, HTTPStatus.NOT_FOUND, 200],
+                         [r["status"] for r in result["results"]])
+        # Only the successful reserve started a receipt.
+        self.assertEqual(1, Receipt.objects.count())
+        self.assertEqual(1, len(result["receipt"]["items"]))
+
+        # Failures are recorded too.
+        result = self._sync({"key": "c1", "op": "reserve", "code": self.items[1].code})
+        self.assertEqual(HTTPStatus.CONFLICT, result["results"][0]["status"])
+        self.assertTrue(result["results"][0]["replayed"])
+
+    def test_abort(self):
+        self._sync(
+            {"key": "d1", "op": "reserve", "code": self.items[0].code},
+            {"key": "d2", "op": "reserve", "code": self.items[1].code},
+        )
+        result = self._sync({"key": "d3", "op": "abort"})
+        self.assertEqual(Receipt.ABORTED, result["results"][0]["result"]["status"])
+        self.assertIsNone(result["receipt"])
+        self.assertEqual(4, Item.objects.filter(state=Item.BROUGHT).count())
+
+    def test_invalid_journal(self):
+        self.assertResult(self.api.counter_sync(journal="nope"), expect=HTTPStatus.BAD_REQUEST)
+        self.assertResult(self.api.counter_sync(journal=json.dumps([{"key": "e1", "op": "sell"}])),
+                          expect=HTTPStatus.BAD_REQUEST)
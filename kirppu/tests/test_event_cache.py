@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+from django.http import Http404
+from django.test import TestCase, override_settings
+
+from .factories import EventFactory
+from .. import event_cache
+
+
+class EventCacheTest(TestCase):
+    def setUp(self):
+        event_cache.invalidate()
+        self.event = EventFactory()
+
+    def tearDown(self):
+        event_cache.invalidate()
+
+    def test_cached(self):
+        first = event_cache.get_event_or_404(self.event.slug)
+        with self.assertNumQueries(0):
+            second = event_cache.get_event_or_404(self.event.slug)
+        self.assertIs(first, second)
+
+    def test_save_invalidates(self):
+        event_cache.get_event_or_404(self.event.slug)
+        self.event.checkout_active = False
+        self.event.save(update_fields=("checkout_active",))
+
+        with self.assertNumQueries(1):
+            event = event_cache.get_event_or_404(self.event.slug)
+        self.assertFalse(event.checkout_active)
+
+    def test_delete_invalidates(self):
+        event_cache.get_event_or_404(self.event.slug)
+        self.event.delete()
+        self.assertRaises(Http404, event_cache.get_event_or_404, self.event.slug)
+
+    @override_settings(KIRPPU_EVENT_CACHE_TTL=0)
+    def test_disabled(self):
+        event_cache.get_event_or_404(self.event.slug)
+        with self.assertNumQueries(1):
+            event_cache.get_event_or_404(self.event.slug)
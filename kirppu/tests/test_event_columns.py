@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+from django.test import Client, TestCase
+
+from .factories import *
+from .api_access import Api
+from . import ResultMixin
+from ..models import Item, ItemStateLog, Receipt, ReceiptItem
+
+
+class EventColumnTest(TestCase, ResultMixin):
+    def setUp(self):
+        self.client = Client()
+        self.event = EventFactory()
+        self.vendor = VendorFactory(event=self.event)
+        self.items = ItemFactory.create_batch(3, vendor=self.vendor, itemtype=ItemTypeFactory(event=self.event))
+
+        self.counter = CounterFactory(event=self.event)
+        self.clerk = ClerkFactory(event=self.event)
+        self.api = Api(client=self.client, event=self.event)
+        self.assertSuccess(self.api.clerk_login(code=self.clerk.get_code(), counter=self.counter.identifier))
+
+    def _assert_event(self, query):
+        self.assertTrue(query.exists())
+        self.assertEqual([self.event.pk], list(query.values_list("event_id", flat=True).distinct()))
+
+    def test_checkout(self):
+        for item in self.items:
+            self.assertSuccess(self.api.item_checkin(code=item.code))
+        receipt = self.assertSuccess(self.api.receipt_start()).json()
+        for item in self.items:
+            self.assertSuccess(self.api.item_reserve(code=item.code))
+        self.assertSuccess(self.api.item_release(code=self.items[0].code))
+        self.assertSuccess(self.api.receipt_abort(id=receipt["id"]))
+
+        self._assert_event(ItemStateLog.objects.filter(item__in=self.items))
+        self._assert_event(Receipt.objects.filter(pk=receipt["id"]))
+        self._assert_event(ReceiptItem.objects.filter(receipt_id=receipt["id"]))
+        self.assertEqual(
+            ItemStateLog.objects.filter(item__vendor__event=self.event).count(),
+            ItemStateLog.objects.filter(event=self.event).count())
+
+    def test_filled_on_save(self):
+        item = ItemFactory()
+        log = ItemStateLog.objects.create(item=item, old_state=Item.ADVERTISED, new_state=Item.BROUGHT)
+        self.assertEqual(item.vendor.event_id, log.event_id)
+
+        row = ReceiptItemFactory(item=item)
+        self.assertEqual(row.receipt.counter.event_id, row.receipt.event_id)
+        self.assertEqual(row.receipt.event_id, row.event_id)
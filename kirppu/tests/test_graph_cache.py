@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+from django.test import Client, TestCase, override_settings
+from django.utils import timezone
+
+from .factories import *
+from .api_access import Api
+from . import ResultMixin
+from .. import stats
+from ..models import GraphCache, Item, ItemStateLog
+
+
+# Graph output is compared uncached, see test_stats_cache for the cached results.
+@override_settings(KIRPPU_STATS_CACHE_TTL=0)
+class GraphCacheTest(TestCase, ResultMixin):
+    def setUp(self):
+        self.client = Client()
+        self.event = EventFactory()
+        self.vendor = VendorFactory(event=self.event)
+        self.itemtype = ItemTypeFactory(event=self.event)
+        self.items = ItemFactory.create_batch(6, vendor=self.vendor, itemtype=self.itemtype, price="1.50")
+        for item in self.items:
+            ItemStateLog.objects.create(item=item, old_state="", new_state=Item.ADVERTISED)
+
+        self.counter = CounterFactory(event=self.event)
+        self.clerk = ClerkFactory(event=self.event)
+        self.api = Api(client=self.client, event=self.event)
+        self.assertSuccess(self.api.clerk_login(code=self.clerk.get_code(), counter=self.counter.identifier))
+
+    def _sell(self, items):
+        for item in items:
+            self.assertSuccess(self.api.item_checkin(code=item.code))
+        receipt = self.assertSuccess(self.api.receipt_start()).json()
+        for item in items:
+            self.assertSuccess(self.api.item_reserve(code=item.code))
+        self.assertSuccess(self.api.receipt_finish(id=receipt["id"]))
+
+    def _age_logs(self, minutes):
+        # Spread the logs not yet aged into buckets of their own, ending `minutes` ago.
+        now = timezone.now()
+        logs = list(ItemStateLog.objects.filter(time__gt=now - timedelta(minutes=1)).order_by("-pk"))
+        for i, log in enumerate(logs):
+            ItemStateLog.objects.filter(pk=log.pk).update(time=now - timedelta(minutes=minutes + i * 2))
+
+    @staticmethod
+    def _update():
+        call_command("update_graph_caches", stdout=StringIO())
+
+    @staticmethod
+    def _sales_log_ids():
+        return set(GraphCache.objects.filter(kind="sales").values_list("last_log_id", flat=True))
+
+    def _graphs(self):
+        return [
+            graph(event=self.event, as_prices=as_prices, **kwargs)
+            for graph, kwargs in (
+                (stats.SalesData, {}),
+                (stats.RegistrationData, {}),
+                (stats.SalesData, dict(item_type=self.itemtype)),
+            )
+            for as_prices in (False, True)
+        ]
+
+    def _assert_same(self):
+        for graph in self._graphs():
+            self.assertEqual("".join(stats.iterate_logs(graph, cached=False)), "".join(stats.iterate_logs(graph)))
+
+    def test_cached(self):
+        self._sell(self.items[:2])
+        self._age_logs(100)
+        self._assert_same()
+        # Reading does not write the cache.
+        self.assertFalse(GraphCache.objects.exists())
+
+        self._update()
+        self.assertEqual(6, GraphCache.objects.filter(event=self.event).count())
+        last_log_id = ItemStateLog.objects.order_by("pk").last().pk
+        self.assertEqual({last_log_id}, self._sales_log_ids())
+        self._assert_same()
+
+        # Entries after the update are read, but not cached.
+        self._sell(self.items[2:4])
+        self._age_logs(10)
+        self._assert_same()
+        self.assertEqual({last_log_id}, self._sales_log_ids())
+
+        self._update()
+        self._assert_same()
+        self.assertLess(last_log_id, min(self._sales_log_ids()))
+
+        self.assertSuccess(self.api.item_checkout(code=self.items[5].code))
+        self._assert_same()
+
+    def test_pending_transactions(self):
+        self._sell(self.items[:1])
+        graph = stats.SalesData(event=self.event)
+        last_log_id = ItemStateLog.objects.order_by("pk").last().pk
+
+        with mock.patch.object(stats, "_running_transactions", return_value=10), \
+                mock.patch.object(stats, "_transactions_finished", return_value=False) as finished:
+            self.assertFalse(stats.update_cache(graph))
+            self.assertFalse(stats.update_cache(graph))
+            finished.assert_called_with(mock.ANY, 10)
+            self.assertEqual(0, graph.cache().last_log_id)
+            self.assertEqual(last_log_id, graph.cache().pending_log_id)
+
+            # Entries seen by the previous update are added once its transactions have finished.
+            finished.return_value = True
+            self.assertTrue(stats.update_cache(graph))
+        self.assertEqual(last_log_id, graph.cache().last_log_id)
+        self.assertEqual("".join(stats.iterate_logs(graph, cached=False)), "".join(stats.iterate_logs(graph)))
+
+    def test_item_changes(self):
+        self._sell(self.items[:2])
+        self._update()
+        self.assertEqual(6, GraphCache.objects.count())
+
+        item = Item.objects.get(pk=self.items[0].pk)
+        item.price = "3.00"
+        item.save()
+        self.assertFalse(GraphCache.objects.filter(as_prices=True).exists())
+        self.assertEqual(3, GraphCache.objects.count())
+        self._assert_same()
+        self._update()
+        self._assert_same()
+
+        item.itemtype = ItemTypeFactory(event=self.event)
+        item.save()
+        self.assertFalse(GraphCache.objects.exists())
+        self._update()
+        self._assert_same()
+
+        self.items[5].delete()
+        self.assertFalse(GraphCache.objects.exists())
+        self._update()
+        self._assert_same()
+
+    def test_minute_buckets(self):
+        self._sell(self.items[:3])
+        start = timezone.now().replace(second=0, microsecond=0) - timedelta(minutes=30)
+        logs = ItemStateLog.objects.exclude(new_state=Item.ADVERTISED).order_by("pk")
+        # Check-ins at :10, :50 and :05 of the next minute, sales in the minute after that.
+        for log, offset in zip(logs, (10, 50, 65, 125, 130, 140, 150, 150, 150)):
+            ItemStateLog.objects.filter(pk=log.pk).update(time=start + timedelta(seconds=offset))
+
+        graph = stats.SalesData(event=self.event)
+        rows = list(graph.bucket_rows())
+        self.assertEqual(list(stats._sum_buckets(graph.query(("old_state", "new_state", "time")).order_by("time"))),
+                         rows)
+        self.assertEqual([
+            (start, Item.ADVERTISED, -2),
+            (start, Item.BROUGHT, 2),
+            (start + timedelta(minutes=1), Item.ADVERTISED, -3),
+            (start + timedelta(minutes=1), Item.BROUGHT, 3),
+            (start + timedelta(minutes=2), Item.BROUGHT, 0),
+            (start + timedelta(minutes=2), Item.SOLD, 3),
+            (start + timedelta(minutes=2), Item.STAGED, 0),
+        ], rows)
+
+        prices = stats.SalesData(event=self.event, as_prices=True)
+        self.assertEqual((start + timedelta(minutes=2), Item.SOLD, Decimal("4.50")), list(prices.bucket_rows())[-2])
+
+        lines = list(stats.iterate_logs(graph, cached=False))
+        self.assertEqual(4, len(lines))
+        self.assertTrue(lines[0].endswith(",0,0,0,0\n"))
+        self.assertTrue(lines[-1].endswith(",3,0,3,0\n"))
+
+    def test_not_cached_with_extra_filter(self):
+        self._sell(self.items[:1])
+        graph = stats.SalesData(event=self.event, extra_filter=dict(new_state=Item.SOLD))
+        self.assertFalse(stats.update_cache(graph))
+        self.assertEqual("".join(stats.iterate_logs(graph, cached=False)), "".join(stats.iterate_logs(graph)))
+        self.assertFalse(GraphCache.objects.exists())
+
+    def test_api(self):
+        self._sell(self.items[:2])
+        self._age_logs(10)
+        first = b"".join(self.api.stats_sales_data(prices="true").streaming_content)
+        self.assertFalse(GraphCache.objects.exists())
+        self._update()
+        self.assertTrue(GraphCache.objects.filter(kind="sales", as_prices=True).exists())
+        self.assertEqual(first, b"".join(self.api.stats_sales_data(prices="true").streaming_content))
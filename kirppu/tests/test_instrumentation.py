@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+from io import StringIO
+
+from django.core.management import call_command
+from django.db import connection
+from django.core.cache import cache
+from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from .factories import *
+from .api_access import Api
+from . import ResultMixin
+from .. import instrumentation
+from ..instrumentation import Histogram
+
+
+class HistogramTest(TestCase):
+    def test_exact_small_values(self):
+        h = Histogram()
+        for value in range(1, 11):
+            h.record(value)
+        self.assertEqual(5, h.percentile(50))
+        self.assertEqual(10, h.percentile(100))
+        self.assertEqual(5.5, h.summary()["mean"])
+
+    def test_relative_error(self):
+        h = Histogram()
+        for value in range(1, 100001):
+            h.record(value)
+        for percent in (50, 90, 99):
+            exact = 100000 * percent / 100
+            self.assertLessEqual(exact, h.percentile(percent))
+            self.assertLessEqual(h.percentile(percent), exact * (1 + 1 / 16))
+        self.assertEqual(100000, h.percentile(100))
+
+    def test_merge(self):
+        a, b = Histogram(), Histogram()
+        for value in range(100):
+            a.record(value)
+            b.record(value + 1000)
+        a.merge(Histogram.from_state(b.as_state()))
+        self.assertEqual(200, a.count)
+        self.assertEqual(1099, a.max)
+        self.assertEqual(99, a.percentile(50))
+
+
+@override_settings(KIRPPU_INSTRUMENTATION=True)
+class InstrumentationTest(TestCase, ResultMixin):
+    def setUp(self):
+        instrumentation.reset()
+        self.client = Client()
+        self.event = EventFactory()
+        self.vendor = VendorFactory(event=self.event)
+        self.item = ItemFactory(vendor=self.vendor)
+        self.counter = CounterFactory(event=self.event)
+        self.clerk = ClerkFactory(event=self.event)
+
+        self.api = Api(client=self.client, event=self.event)
+        self.assertSuccess(self.api.clerk_login(code=self.clerk.get_code(), counter=self.counter.identifier))
+
+    def tearDown(self):
+        instrumentation.reset()
+
+    def test_recorded(self):
+        response = self.assertSuccess(self.api.item_find(code=self.item.code))
+        self.api.item_find(code="NOTHING")
+
+        data = instrumentation.snapshot()
+        self.assertEqual(2, data["item_find"]["time_us"]["count"])
+        self.assertLessEqual(len(response.content), data["item_find"]["response_bytes"]["max"])
+        self.assertLessEqual(1, data["item_find"]["queries"]["p50"])
+        self.assertEqual(1, data["clerk_login"]["time_us"]["count"])
+
+        out = StringIO()
+        call_command("checkout_api_stats", stdout=out)
+        self.assertIn("item_find", out.getvalue())
+
+    def test_commit_included(self):
+        item = ItemFactory(vendor=self.vendor)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertSuccess(self.api.item_checkin(code=item.code))
+
+        # State log entry and counters are written at the end of the transaction.
+        data = instrumentation.snapshot()
+        self.assertEqual(len(queries), data["item_checkin"]["queries"]["max"])
+
+    def test_view_staff_only(self):
+        url = reverse("kirppu:instrumentation")
+        self.assertEqual(302, self.client.get(url).status_code)
+
+        user = UserFactory(is_staff=True)
+        self.client.force_login(user)
+        self.assertSuccess(self.api.item_find(code=self.item.code))
+        data = self.assertSuccess(self.client.get(url)).json()
+        self.assertEqual(1, data["item_find"]["queries"]["count"])
+
+        self.client.force_login(UserFactory())
+        self.assertEqual(403, self.client.get(url).status_code)
+
+    def test_published_processes(self):
+        self.assertSuccess(self.api.item_find(code=self.item.code))
+        self.assertEqual(1, instrumentation.collect()["item_find"]["time_us"]["count"])
+
+        # Slot of this process has expired, and been taken by another process.
+        other = {"process": "other:1", "histograms": instrumentation._snapshot_state()}
+        cache.set(instrumentation._slot_key(instrumentation._slot), other)
+        data = instrumentation.collect()
+        self.assertEqual(2, data["item_find"]["time_us"]["count"])
+        self.assertEqual(2, len(cache.get_many(instrumentation._slot_keys())))
+
+    @override_settings(KIRPPU_INSTRUMENTATION=False)
+    def test_disabled(self):
+        instrumentation.reset()
+        self.assertSuccess(self.api.item_find(code=self.item.code))
+        self.assertEqual({}, instrumentation.snapshot())
@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+from decimal import Decimal
+from io import StringIO
+
+from django.contrib.auth.models import AnonymousUser
+from django.core.management import call_command, CommandError
+from django.db import transaction
+from django.test import Client, RequestFactory, TestCase
+
+from .factories import *
+from .api_access import Api
+from . import ResultMixin
+from ..models import Item, ItemStateCounter, ItemStateLog, VendorBalance
+from ..stats import ItemCollectionData, ItemCountData, ItemEurosData, ItemStatisticsData
+
+
+class ItemStateCounterTest(TestCase, ResultMixin):
+    def setUp(self):
+        self.client = Client()
+
+        self.event = EventFactory()
+        self.vendor = VendorFactory(event=self.event)
+        self.itemtype = ItemTypeFactory(event=self.event)
+        self.items = ItemFactory.create_batch(6, vendor=self.vendor, itemtype=self.itemtype, price="2.50")
+
+        self.counter = CounterFactory(event=self.event)
+        self.clerk = ClerkFactory(event=self.event)
+        EventPermissionFactory(event=self.event, user=self.clerk.user, can_perform_overseer_actions=True)
+
+        self.api = Api(client=self.client, event=self.event)
+        self.api.clerk_login(code=self.clerk.get_code(), counter=self.counter.identifier)
+
+    def _assert_counted(self):
+        # Raises CommandError if the counters differ from the items.
+        call_command("rebuild_item_state_counters", check=True, stdout=StringIO())
+
+    def _counters(self):
+        # Summed over item types and vendors.
+        counters = {}
+        for c in ItemStateCounter.objects.filter(event=self.event).exclude(count=0):
+            count, price_sum = counters.get((c.state, c.abandoned), (0, 0))
+            counters[(c.state, c.abandoned)] = (count + c.count, price_sum + c.price_sum)
+        return counters
+
+    def test_checkout(self):
+        self.assertEqual({(Item.ADVERTISED, False): (6, Decimal("15.00"))}, self._counters())
+
+        for item in self.items:
+            self.assertSuccess(self.api.item_checkin(code=item.code))
+        receipt = self.assertSuccess(self.api.receipt_start()).json()
+        for item in self.items[:3]:
+            self.assertSuccess(self.api.item_reserve(code=item.code))
+        self.assertSuccess(self.api.item_release(code=self.items[2].code))
+        self.assertSuccess(self.api.receipt_finish(id=receipt["id"]))
+        self.assertSuccess(self.api.item_checkout(code=self.items[3].code))
+
+        self.assertEqual({
+            (Item.BROUGHT, False): (3, Decimal("7.50")),
+            (Item.SOLD, False): (2, Decimal("5.00")),
+            (Item.RETURNED, False): (1, Decimal("2.50")),
+        }, self._counters())
+        self._assert_counted()
+
+    def test_edits(self):
+        for item in self.items[:2]:
+            self.assertSuccess(self.api.item_checkin(code=item.code))
+        self.assertSuccess(self.api.items_abandon(vendor=self.vendor.pk))
+        self.assertSuccess(self.api.item_edit(code=self.items[2].code, price="4", state=Item.ADVERTISED))
+
+        item = Item.objects.get(pk=self.items[3].pk)
+        item.itemtype = ItemTypeFactory(event=self.event)
+        item.save()
+        self.items[4].delete()
+
+        self.assertEqual({
+            (Item.BROUGHT, True): (2, Decimal("5.00")),
+            (Item.ADVERTISED, False): (3, Decimal("9.00")),
+        }, self._counters())
+        self._assert_counted()
+
+    def test_state_and_price_edit(self):
+        item = self.items[0]
+        self.assertSuccess(self.api.item_checkin(code=item.code))
+        receipt = self.assertSuccess(self.api.receipt_start()).json()
+        self.assertSuccess(self.api.item_reserve(code=item.code))
+        self.assertSuccess(self.api.receipt_finish(id=receipt["id"]))
+
+        # Item is removed from the receipt, and its price changed, in the same request.
+        self.assertSuccess(self.api.item_edit(code=item.code, price="4", state=Item.BROUGHT))
+
+        self.assertEqual({
+            (Item.ADVERTISED, False): (5, Decimal("12.50")),
+            (Item.BROUGHT, False): (1, Decimal("4.00")),
+        }, self._counters())
+        self.assertEqual(Decimal("0"), VendorBalance.objects.of(self.vendor.pk).sold_sum)
+        self._assert_counted()
+
+    def test_transition_of_stale_item(self):
+        item = Item.objects.get(pk=self.items[0].pk)
+        # Changed after the item was read.
+        changed = Item.objects.get(pk=item.pk)
+        changed.price = "4"
+        changed.save()
+
+        request = RequestFactory().post("/")
+        request.user = AnonymousUser()
+        request.session = {}
+        with transaction.atomic(), ItemStateLog.objects.buffered():
+            self.assertTrue(ItemStateLog.objects.transition(item, Item.ADVERTISED, Item.BROUGHT, request=request))
+
+        self.assertEqual(Decimal("4"), item.price)
+        self.assertEqual({
+            (Item.ADVERTISED, False): (5, Decimal("12.50")),
+            (Item.BROUGHT, False): (1, Decimal("4.00")),
+        }, self._counters())
+        self._assert_counted()
+
+    def test_transition_during_tracking(self):
+        for item in self.items[:2]:
+            self.assertSuccess(self.api.item_checkin(code=item.code))
+
+        request = RequestFactory().post("/")
+        request.user = AnonymousUser()
+        request.session = {}
+        items = Item.objects.filter(vendor=self.vendor, state__in=(Item.BROUGHT, Item.MISSING))
+        with transaction.atomic(), ItemStateLog.objects.buffered():
+            with ItemStateCounter.objects.tracking(items) as locked_items:
+                # Checked in meanwhile, e.g. by another counter.
+                self.assertTrue(ItemStateLog.objects.transition(
+                    self.items[2], Item.ADVERTISED, Item.BROUGHT, request=request))
+                locked_items.update(abandoned=True)
+
+        self.assertFalse(Item.objects.get(pk=self.items[2].pk).abandoned)
+        self.assertEqual({
+            (Item.ADVERTISED, False): (3, Decimal("7.50")),
+            (Item.BROUGHT, False): (1, Decimal("2.50")),
+            (Item.BROUGHT, True): (2, Decimal("5.00")),
+        }, self._counters())
+        self._assert_counted()
+
+    def test_box_price_edit(self):
+        box = BoxFactory(vendor=self.vendor, item_count=3)
+        self.assertSuccess(self.api.item_edit(code=box.representative_item.code, price="1", state=Item.ADVERTISED))
+        self._assert_counted()
+
+    def test_stats_from_counters(self):
+        for item in self.items[:2]:
+            self.assertSuccess(self.api.item_checkin(code=item.code))
+        other_vendor = VendorFactory(event=self.event)
+        ItemFactory(vendor=other_vendor, itemtype=self.itemtype, price="1", state=Item.SOLD)
+
+        with self.assertNumQueries(2):
+            counts = ItemCountData(ItemCollectionData.GROUP_ITEM_TYPE, event=self.event)
+        row = list(counts.data_set(self.itemtype.pk, "").property_values)
+        # Advertised, brought, staged, sold, returned, compensated, sum.
+        self.assertEqual([4, 2, 0, 1, 0, 0, 7], row)
+        self.assertEqual([0, 0, 0], list(counts.data_set(self.itemtype.pk, "").abandoned))
+
+        euros = ItemEurosData(ItemCollectionData.GROUP_VENDOR, event=self.event)
+        euros.use_cents = True
+        self.assertEqual([self.vendor.pk, other_vendor.pk], list(euros.keys()))
+        self.assertEqual([0, 0, 0, 100, 0, 0, 100], list(euros.data_set(other_vendor.pk, "").property_values))
+
+    def test_combined_stats(self):
+        self.assertSuccess(self.api.item_checkin(code=self.items[0].code))
+        other_vendor = VendorFactory(event=self.event)
+        ItemFactory(vendor=other_vendor, itemtype=self.itemtype, price="1", state=Item.SOLD, abandoned=True)
+        other_type = ItemTypeFactory(event=self.event)
+
+        for group_by in (ItemCollectionData.GROUP_ITEM_TYPE, ItemCollectionData.GROUP_VENDOR):
+            with self.assertNumQueries(1):
+                combined = ItemStatisticsData(group_by, event=self.event, item_types=[self.itemtype.pk, other_type.pk])
+            counts = ItemCountData(group_by, event=self.event)
+            euros = ItemEurosData(group_by, event=self.event)
+            combined.euros.use_cents = euros.use_cents = True
+
+            self.assertEqual(list(counts.keys()), list(combined.counts.keys()))
+            for key in counts.keys():
+                for expected, actual in ((counts, combined.counts), (euros, combined.euros)):
+                    expected_row, actual_row = expected.data_set(key, ""), actual.data_set(key, "")
+                    self.assertEqual(list(expected_row.property_values), list(actual_row.property_values))
+        self.assertEqual([0, 0, 100], list(combined.euros.data_set(other_vendor.pk, "").abandoned))
+
+    def test_rebuild(self):
+        ItemStateCounter.objects.filter(event=self.event).update(count=1)
+        self.assertRaises(CommandError, self._assert_counted)
+
+        out = StringIO()
+        call_command("rebuild_item_state_counters", event=self.event.slug, stdout=out)
+        self.assertIn("{}: 1 counters".format(self.event.slug), out.getvalue())
+        self._assert_counted()
@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+from django.core.cache import cache
+from django.test import Client, TestCase
+from django.urls import reverse
+
+from .factories import *
+from .api_access import Api
+from . import ResultMixin
+from .. import event_cache
+from ..models import Item, Receipt, ReceiptNote
+
+"""
+Query budgets of the item scanning endpoints.
+
+Every request has a fixed overhead: loading the session, and for endpoints that change it,
+saving it. Counter and Clerk are read once per request. The Event is normally served
+from the process-local cache, which is warmed up in setUp. Atomic endpoints add a savepoint
+and its release, as the tests are run inside a transaction.
+"""
+
+
+class ScanQueryBudgetTest(TestCase, ResultMixin):
+    def setUp(self):
+        self.client = Client()
+
+        self.event = EventFactory()
+        self.vendor = VendorFactory(event=self.event)
+        self.items = ItemFactory.create_batch(3, vendor=self.vendor, state=Item.BROUGHT)
+        self.box = BoxFactory(vendor=self.vendor, item_count=2)
+
+        self.counter = CounterFactory(event=self.event)
+        self.clerk = ClerkFactory(event=self.event)
+
+        event_cache.invalidate()
+        self.api = Api(client=self.client, event=self.event)
+        self.assertSuccess(self.api.clerk_login(code=self.clerk.get_code(), counter=self.counter.identifier))
+
+    def tearDown(self):
+        event_cache.invalidate()
+
+    def test_item_find(self):
+        # Session, counter, clerk, item.
+        with self.assertNumQueries(4):
+            self.assertSuccess(self.api.item_find(code=self.items[0].code, available=""))
+
+    def test_item_checkin(self):
+        item = ItemFactory(vendor=self.vendor)
+        # Savepoints (4), session, counter, clerk, item, item update, state log, counters.
+        with self.assertNumQueries(11):
+            self.assertSuccess(self.api.item_checkin(code=item.code))
+
+    def test_box_checkin(self):
+        # Savepoints (2), session, counter, clerk, item, box item count.
+        with self.assertNumQueries(7):
+            self.assertResult(self.api.item_checkin(code=self.box.representative_item.code), expect=202)
+
+    def test_item_reserve(self):
+        self.assertSuccess(self.api.receipt_start())
+        # Savepoints (2), session, counter, clerk, item, receipt, item update, receipt row,
+        # receipt total, state log, counters.
+        with self.assertNumQueries(12):
+            self.assertSuccess(self.api.item_reserve(code=self.items[0].code))
+
+    def test_item_release(self):
+        self.assertSuccess(self.api.receipt_start())
+        self.assertSuccess(self.api.item_reserve(code=self.items[0].code))
+        # Savepoints (4), session, counter, clerk, item, receipt, receipt row, receipt row update,
+        # removal row, receipt total, item update, state log, counters.
+        with self.assertNumQueries(16):
+            self.assertSuccess(self.api.item_release(code=self.items[0].code))
+
+    def test_receipt_start_with_item(self):
+        # Savepoints (6), session, counter, clerk, item, pending receipt check, receipt, item update,
+        # receipt row, receipt total, receipt notes, state log, counters, session save.
+        with self.assertNumQueries(19):
+            self.assertSuccess(self.api.receipt_start_with_item(code=self.items[0].code))
+
+    def test_receipt_abort(self):
+        receipt = self.assertSuccess(self.api.receipt_start()).json()
+        for item in self.items:
+            self.assertSuccess(self.api.item_reserve(code=item.code))
+        # Savepoints (4), session, counter, clerk, receipt, items, removal rows, items for counters,
+        # item update, receipt row update, receipt update, receipt clerk, user, counter and notes,
+        # state logs, counters, session save. Independent of the number of items.
+        with self.assertNumQueries(21):
+            self.assertSuccess(self.api.receipt_abort(id=receipt["id"]))
+
+
+class ReceiptListQueryBudgetTest(TestCase, ResultMixin):
+    def setUp(self):
+        self.client = Client()
+
+        self.event = EventFactory()
+        self.vendor = VendorFactory(event=self.event)
+        self.counter = CounterFactory(event=self.event)
+        self.clerk = ClerkFactory(event=self.event)
+        EventPermissionFactory(event=self.event, user=self.clerk.user, can_perform_overseer_actions=True)
+
+        event_cache.invalidate()
+        self.api = Api(client=self.client, event=self.event)
+        self.assertSuccess(self.api.clerk_login(code=self.clerk.get_code(), counter=self.counter.identifier))
+
+    def tearDown(self):
+        event_cache.invalidate()
+
+    def _create_receipts(self, count, **kwargs):
+        for _ in range(count):
+            receipt = ReceiptFactory(
+                counter=CounterFactory(event=self.event), clerk=ClerkFactory(event=self.event), **kwargs)
+            for _ in range(2):
+                ReceiptNote.objects.create(receipt=receipt, clerk=ClerkFactory(event=self.event), text="Note")
+
+    def _assert_constant(self, fn, expected, **receipt_kwargs):
+        self._create_receipts(1, **receipt_kwargs)
+        with self.assertNumQueries(expected):
+            result = self.assertSuccess(fn()).json()
+        self.assertEqual(1, len(result))
+
+        self._create_receipts(4, **receipt_kwargs)
+        with self.assertNumQueries(expected):
+            result = self.assertSuccess(fn()).json()
+        self.assertEqual(5, len(result))
+        self.assertEqual(2, len(result[0]["notes"]))
+        return result
+
+    def test_receipt_pending(self):
+        # Session, counter, clerk, permission, receipts with clerks and counters, notes with clerks.
+        result = self._assert_constant(self.api.receipt_pending, 6)
+        self.assertTrue(all(receipt["status"] == Receipt.PENDING for receipt in result))
+
+    def test_receipt_compensated(self):
+        # Session, counter, clerk, receipts with clerks and counters, notes with clerks.
+        self._assert_constant(
+            lambda: self.api.receipt_compensated(vendor=self.vendor.pk), 5,
+            type=Receipt.TYPE_COMPENSATION, vendor=self.vendor, status=Receipt.FINISHED)
+
+
+class StatisticalStatsQueryBudgetTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+
+        self.event = EventFactory()
+        vendors = VendorFactory.create_batch(3, event=self.event)
+        VendorFactory(event=self.event, mobile_view_visited=True)
+        ItemFactory.create_batch(3, vendor=vendors[0], printed=True)
+        ItemFactory(vendor=vendors[0], hidden=True, printed=True)
+        ItemFactory(vendor=vendors[1], state=Item.BROUGHT)
+        ItemFactory(vendor=vendors[1], state=Item.SOLD, hidden=True)
+        ItemFactory(vendor=vendors[2], state=Item.COMPENSATED, price="3")
+        BoxFactory(vendor=vendors[0], item_count=2)
+        box = BoxFactory(vendor=vendors[2], item_count=3)
+        box.representative_item.hidden = True
+        box.representative_item.save(update_fields=("hidden",))
+        ReceiptFactory(counter=CounterFactory(event=self.event), type=Receipt.TYPE_PURCHASE,
+                       status=Receipt.FINISHED, total="3")
+
+        user = UserFactory()
+        EventPermissionFactory(event=self.event, user=user, can_see_statistics=True)
+        event_cache.invalidate()
+        cache.clear()
+        self.client.force_login(user)
+
+    def tearDown(self):
+        event_cache.invalidate()
+        cache.clear()
+
+    def test_statistical_stats(self):
+        url = reverse("kirppu:statistical_stats_view", kwargs={"event_slug": self.event.slug})
+        # Event, session, user, permission, data version, item aggregate, box aggregate,
+        # vendors in mobile view, compensations, purchases.
+        with self.assertNumQueries(10):
+            response = self.client.get(url)
+        self.assertEqual(200, response.status_code)
+        # Served from the stats cache.
+        with self.assertNumQueries(5):
+            self.assertEqual(200, self.client.get(url).status_code)
+
+        general = response.context["general"]
+        self.assertEqual(dict(
+            registered=12, deleted=3, brought=3, sold=2, printedDeleted=1, broughtDeleted=1, printedNotBrought=4,
+            vendors=2, vendorsTotal=3, vendorsInMobileView=1, itemsInBox=5, itemsNotInBox=7,
+            registeredBoxes=2, deletedBoxes=1, itemsInDeletedBoxes=3, purchases=1,
+        ), {key: general[key] for key in (
+            "registered", "deleted", "brought", "sold", "printedDeleted", "broughtDeleted", "printedNotBrought",
+            "vendors", "vendorsTotal", "vendorsInMobileView", "itemsInBox", "itemsNotInBox",
+            "registeredBoxes", "deletedBoxes", "itemsInDeletedBoxes", "purchases")})
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+from decimal import Decimal
+from io import StringIO
+
+from django.core.management import call_command, CommandError
+from django.test import Client, TestCase
+
+from .factories import *
+from .api_access import Api
+from . import ResultMixin
+from ..models import Item, Receipt
+
+
+class ReceiptTotalTest(TestCase, ResultMixin):
+    def setUp(self):
+        self.client = Client()
+
+        self.event = EventFactory()
+        self.vendor = VendorFactory(event=self.event)
+        self.items = ItemFactory.create_batch(6, vendor=self.vendor, state=Item.BROUGHT)
+
+        self.counter = CounterFactory(event=self.event)
+        self.clerk = ClerkFactory(event=self.event)
+
+        self.api = Api(client=self.client, event=self.event)
+        self.api.clerk_login(code=self.clerk.get_code(), counter=self.counter.identifier)
+
+    def _assert_total(self, receipt_id, expected_items):
+        receipt = Receipt.objects.get(pk=receipt_id)
+        self.assertEqual(sum((i.price for i in expected_items), Decimal(0)), receipt.total)
+        self.assertEqual([], Receipt.objects.with_drifted_total())
+
+    def test_delta_total(self):
+        receipt = self.assertSuccess(self.api.receipt_start()).json()
+        for item in self.items[:3]:
+            self.assertSuccess(self.api.item_reserve(code=item.code))
+        self._assert_total(receipt["id"], self.items[:3])
+
+        self.assertSuccess(self.api.item_release(code=self.items[1].code))
+        self._assert_total(receipt["id"], [self.items[0], self.items[2]])
+
+        self.assertSuccess(self.api.receipt_abort(id=receipt["id"]))
+        self._assert_total(receipt["id"], [])
+
+    def test_delta_total_box(self):
+        box = BoxFactory(adopt=True, items=self.items, box_number=1)
+        Item.objects.all().update(state=Item.BROUGHT)
+
+        receipt = self.assertSuccess(self.api.receipt_start()).json()
+        self.assertSuccess(self.api.box_item_reserve(box_number=box.box_number, box_item_count=4))
+        self.assertSuccess(self.api.box_item_release(box_number=box.box_number, box_item_count=1))
+        self.assertEqual(3 * self.items[0].price, Receipt.objects.get(pk=receipt["id"]).total)
+        self.assertEqual([], Receipt.objects.with_drifted_total())
+
+    def test_verify_command(self):
+        receipt = self.assertSuccess(self.api.receipt_start()).json()
+        self.assertSuccess(self.api.item_reserve(code=self.items[0].code))
+        Receipt.objects.filter(pk=receipt["id"]).update(total=Decimal("123.45"))
+
+        drifted = Receipt.objects.with_drifted_total()
+        self.assertEqual([receipt["id"]], [r.pk for r in drifted])
+        self.assertEqual(self.items[0].price, drifted[0].calculated_total)
+
+        self.assertRaises(CommandError, call_command, "verify_receipt_totals", stdout=StringIO())
+        call_command("verify_receipt_totals", "--fix", stdout=StringIO())
+        self._assert_total(receipt["id"], self.items[:1])
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+from django.test import TestCase
+
+from .factories import *
+from ..models import Box, Item, Receipt
+from ..utils import model_dict_fn
+
+
+def _reference(fn):
+    """Serializer reading every field dynamically, as model_dict_fn did before compiling the fields."""
+    return model_dict_fn(__extend=fn, __access_fn=lambda self, value: getattr(self, value))
+
+
+class SerializerTest(TestCase):
+    def setUp(self):
+        self.event = EventFactory()
+        self.vendor = VendorFactory(event=self.event)
+        self.items = ItemFactory.create_batch(3, vendor=self.vendor, state=Item.BROUGHT, adult=Item.ADULT_YES)
+
+    def test_item_as_dict(self):
+        reference = _reference(Item.as_dict)
+        for item in Item.objects.all():
+            self.assertEqual(reference(item), item.as_dict())
+
+    def test_item_as_dict_rows(self):
+        expected = [item.as_dict() for item in Item.objects.order_by("pk")]
+        self.assertEqual(expected, Item.as_dict_rows(Item.objects.order_by("pk")))
+
+        rows = Item.as_dict_rows(Item.objects.order_by("pk"), "pk")
+        self.assertEqual([item.pk for item in self.items], [row.pop("pk") for row in rows])
+        self.assertEqual(expected, rows)
+
+    def test_box_exclude(self):
+        box = BoxFactory(vendor=self.vendor, item_count=2)
+        box = Box.objects.get(pk=box.pk)
+        reference = _reference(Box.as_dict)
+        self.assertEqual(reference(box), box.as_dict())
+        self.assertEqual(reference(box, exclude=("item_price",)), box.as_dict(exclude=("item_price",)))
+        self.assertNotIn("item_price", box.as_dict(exclude=("item_price",)))
+
+    def test_receipt_as_dict(self):
+        receipt = ReceiptFactory(counter=CounterFactory(event=self.event), clerk=ClerkFactory(event=self.event))
+        receipt = Receipt.objects.get(pk=receipt.pk)
+        self.assertEqual(_reference(Receipt.as_dict)(receipt), receipt.as_dict())
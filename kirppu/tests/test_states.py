@@ -1,14 +1,21 @@
 # -*- coding: utf-8 -*-
 
 from http import HTTPStatus
+import json
+from unittest import mock
 
-from django.test import Client, TestCase
+from django.contrib.auth.models import AnonymousUser
+from django.db import connection
+from django.test import Client, RequestFactory, TestCase
+from django.test.utils import CaptureQueriesContext
 import factory
 
 from .factories import *
 from .api_access import Api
 from . import ResultMixin
-from ..models import Item, Receipt, ReceiptItem
+from .. import checkout_api
+from ..ajax_util import AjaxError
+from ..models import Item, ItemStateLog, ItemStateLogManager, Receipt, ReceiptItem
 
 __author__ = 'codez'
 
@@ -192,3 +199,283 @@ class StatesTest(TestCase, ResultMixin):
         self.assertSuccess(self.api.box_item_release(box_number=1, box_item_count=2))
         check_count(8)
         self.assertEqual(Item.BROUGHT, Item.objects.get(pk=representative_item_id).state)
+
+    def test_abort_receipt(self):
+        box = BoxFactory(adopt=True, items=self.items[:5], box_number=1)
+        Item.objects.all().update(state=Item.BROUGHT)
+        single_item = self.items[5]
+
+        receipt = self.assertSuccess(self.api.receipt_start()).json()
+        self.assertSuccess(self.api.item_reserve(code=single_item.code))
+        self.assertSuccess(self.api.box_item_reserve(box_number=box.box_number, box_item_count=3))
+        self.assertSuccess(self.api.box_item_release(box_number=box.box_number, box_item_count=1))
+        staged = list(Item.objects.filter(state=Item.STAGED).values_list("pk", flat=True))
+        self.assertEqual(3, len(staged))
+        log_count = ItemStateLog.objects.count()
+
+        aborted = self.assertSuccess(self.api.receipt_abort(id=receipt["id"])).json()
+        self.assertEqual(Receipt.ABORTED, aborted["status"])
+        self.assertEqual(0, Item.objects.filter(state=Item.STAGED).count())
+
+        rows = ReceiptItem.objects.filter(receipt_id=receipt["id"])
+        self.assertEqual(0, rows.filter(action=ReceiptItem.ADD).count())
+        self.assertEqual(4, rows.filter(action=ReceiptItem.REMOVED_LATER).count())
+        # Every ADD, including the one released before the abort, has a matching REMOVE.
+        self.assertCountEqual(
+            rows.filter(action=ReceiptItem.REMOVED_LATER).values_list("item_id", flat=True),
+            rows.filter(action=ReceiptItem.REMOVE).values_list("item_id", flat=True),
+        )
+
+        logs = ItemStateLog.objects.order_by("pk")[log_count:]
+        self.assertCountEqual(staged, [log.item_id for log in logs])
+        for log in logs:
+            self.assertEqual((Item.STAGED, Item.BROUGHT), (log.old_state, log.new_state))
+            self.assertEqual(self.counter.pk, log.counter_id)
+            self.assertEqual(self.clerk.pk, log.clerk_id)
+
+    def test_start_with_item(self):
+        item = self.items[0]
+        item.state = Item.BROUGHT
+        item.save(update_fields=("state",))
+
+        result = self.assertSuccess(self.api.receipt_start_with_item(code=item.code)).json()
+        self.assertEqual(item.code, result["item"]["code"])
+        self.assertNotIn("_message", result["item"])
+        self.assertEqual(result["item"]["price"], result["item"]["total"])
+        self.assertEqual(result["item"]["total"], result["receipt"]["total"])
+
+        self.assertEqual(Item.STAGED, Item.objects.get(pk=item.pk).state)
+        receipt = Receipt.objects.get(pk=result["receipt"]["id"])
+        self.assertEqual(Receipt.PENDING, receipt.status)
+        self.assertEqual(1, receipt.items.count())
+
+        # Receipt is the active one in session.
+        self.assertSuccess(self.api.item_reserve(code=self.items[1].code))
+        self.assertEqual(2, receipt.items.count())
+
+    def test_start_with_item_not_available(self):
+        item = self.items[0]
+        item.state = Item.SOLD
+        item.save(update_fields=("state",))
+
+        self.assertResult(self.api.receipt_start_with_item(code=item.code), expect=HTTPStatus.CONFLICT)
+        self.assertEqual(0, Receipt.objects.count())
+
+        # Session is left without active receipt.
+        self.assertSuccess(self.api.receipt_start())
+
+    def test_start_with_item_reservation_failed(self):
+        item = self.items[0]
+        # As if another counter reserved the item after it was checked.
+        with mock.patch.object(ItemStateLogManager, "transition", return_value=False):
+            self.assertResult(self.api.receipt_start_with_item(code=item.code), expect=HTTPStatus.CONFLICT)
+        self.assertEqual(0, Receipt.objects.count())
+        self.assertEqual(Item.ADVERTISED, Item.objects.get(pk=item.pk).state)
+
+        # Session is left without active receipt.
+        self.assertSuccess(self.api.receipt_start_with_item(code=item.code))
+
+    def test_start_with_item_suspended(self):
+        item_code = self.items[0].code
+        receipt = self.assertSuccess(self.api.receipt_start_with_item(code=item_code)).json()["receipt"]
+        self.assertSuccess(self.api.receipt_suspend(note="Wait"))
+
+        result = self.assertResult(self.api.receipt_start_with_item(code=item_code),
+                                   expect=HTTPStatus.LOCKED).json()
+        self.assertEqual(receipt["id"], result["receipt"]["id"])
+        self.assertEqual(1, Receipt.objects.count())
+
+    def test_continue_suspended_by_item(self):
+        receipt = self.assertSuccess(self.api.receipt_start_with_item(code=self.items[0].code)).json()["receipt"]
+        self.assertSuccess(self.api.item_reserve(code=self.items[1].code))
+        self.assertSuccess(self.api.item_release(code=self.items[1].code))
+        self.assertSuccess(self.api.receipt_suspend(note="Wait"))
+
+        self.assertResult(self.api.receipt_continue(code=self.items[1].code), expect=HTTPStatus.NOT_FOUND)
+        result = self.assertSuccess(self.api.receipt_continue(code=self.items[0].code)).json()
+        self.assertEqual(receipt["id"], result["id"])
+        self.assertEqual(Receipt.PENDING, result["status"])
+
+    def test_get_by_item(self):
+        receipt = self.assertSuccess(self.api.receipt_start_with_item(code=self.items[0].code)).json()["receipt"]
+        self.assertSuccess(self.api.item_reserve(code=self.items[1].code))
+        self.assertSuccess(self.api.item_release(code=self.items[1].code))
+        self.assertResult(self.api.receipt_get(item=self.items[0].code), expect=HTTPStatus.NOT_FOUND)
+        self.assertSuccess(self.api.receipt_finish(id=receipt["id"]))
+
+        result = self.assertSuccess(self.api.receipt_get(item=self.items[0].code)).json()
+        self.assertEqual(receipt["id"], result["id"])
+        self.assertEqual(self.items[0].code, result["items"][0]["code"])
+        self.assertResult(self.api.receipt_get(item=self.items[1].code), expect=HTTPStatus.NOT_FOUND)
+        self.assertResult(self.api.receipt_get(item="NOTHING"), expect=HTTPStatus.NOT_FOUND)
+
+    def test_reserve_many(self):
+        sold = self.items[2]
+        sold.state = Item.SOLD
+        sold.save(update_fields=("state",))
+        codes = [self.items[0].code, self.items[1].code, sold.code, "NOTHING", self.items[0].code]
+
+        receipt = self.assertSuccess(self.api.receipt_start()).json()
+        result = self.assertSuccess(self.api.item_reserve_many(codes=json.dumps(codes))).json()
+
+        self.assertEqual(codes, [r["code"] for r in result["items"]])
+        self.assertEqual([200, 200, HTTPStatus.CONFLICT, HTTPStatus.NOT_FOUND, HTTPStatus.LOCKED],
+                         [r["status"] for r in result["items"]])
+        self.assertEqual(Item.STAGED, result["items"][0]["item"]["state"])
+        self.assertEqual(result["items"][0]["item"]["price"] + result["items"][1]["item"]["price"], result["total"])
+
+        self.assertEqual(2, Item.objects.filter(state=Item.STAGED).count())
+        self.assertEqual(2, ReceiptItem.objects.filter(receipt__pk=receipt["id"], action=ReceiptItem.ADD).count())
+        self.assertEqual(2, ItemStateLog.objects.filter(new_state=Item.STAGED).count())
+        self.assertEqual(result["total"], Receipt.objects.get(pk=receipt["id"]).total_cents)
+
+    def test_reserve_many_without_receipt(self):
+        self.assertResult(self.api.item_reserve_many(codes=json.dumps([self.items[0].code])),
+                          expect=HTTPStatus.BAD_REQUEST)
+        self.assertResult(self.api.item_reserve_many(codes="nope"), expect=HTTPStatus.BAD_REQUEST)
+
+    def test_idempotent_retry(self):
+        item_code = self.items[0].code
+        self.assertSuccess(self.api.receipt_start())
+
+        def reserve(key):
+            return self.client.post(self.api.item_reserve.url, data={"code": item_code},
+                                    HTTP_X_IDEMPOTENCY_KEY=key)
+
+        first = self.assertSuccess(reserve("k1"))
+        retry = self.assertSuccess(reserve("k1"))
+        self.assertEqual(first.json(), retry.json())
+        self.assertEqual("true", retry["X-Idempotent-Replay"])
+        self.assertEqual(1, ReceiptItem.objects.filter(item__code=item_code).count())
+        self.assertEqual(1, ItemStateLog.objects.filter(item__code=item_code).count())
+
+        # New key is a new request.
+        self.assertResult(reserve("k2"), expect=HTTPStatus.LOCKED)
+
+        # Key cannot be reused for another function.
+        self.assertResult(self.client.post(self.api.item_release.url, data={"code": item_code},
+                                           HTTP_X_IDEMPOTENCY_KEY="k1"), expect=HTTPStatus.CONFLICT)
+
+    def test_idempotent_retry_while_running(self):
+        def start():
+            return self.client.post(self.api.receipt_start.url, HTTP_X_IDEMPOTENCY_KEY="k1")
+
+        # The retry arrives while the first call is still creating its receipt.
+        retries = []
+        create_receipt = checkout_api._create_receipt
+
+        def create_with_retry(request):
+            retries.append(start())
+            return create_receipt(request)
+
+        with mock.patch.object(checkout_api, "_create_receipt", side_effect=create_with_retry):
+            first = self.assertSuccess(start())
+        self.assertResult(retries[0], expect=HTTPStatus.CONFLICT)
+        self.assertEqual(1, Receipt.objects.filter(clerk=self.clerk, status=Receipt.PENDING).count())
+
+        # Once the first call is done, the retry gets its response.
+        retry = self.assertSuccess(start())
+        self.assertEqual(first.json(), retry.json())
+
+    def test_idempotent_key_released_on_error(self):
+        item_code = self.items[0].code
+        self.assertSuccess(self.api.receipt_start())
+
+        def reserve(key):
+            return self.client.post(self.api.item_reserve.url, data={"code": item_code},
+                                    HTTP_X_IDEMPOTENCY_KEY=key)
+
+        with mock.patch.object(checkout_api, "_reserve_item", side_effect=AjaxError(HTTPStatus.CONFLICT)):
+            self.assertResult(reserve("k1"), expect=HTTPStatus.CONFLICT)
+        self.assertSuccess(reserve("k1"))
+        self.assertEqual(1, ReceiptItem.objects.filter(item__code=item_code).count())
+
+
+class TransitionTest(TestCase):
+    def setUp(self):
+        self.event = EventFactory()
+        self.item = ItemFactory(vendor=VendorFactory(event=self.event), state=Item.BROUGHT, hidden=True)
+        self.counter = CounterFactory(event=self.event)
+        self.clerk = ClerkFactory(event=self.event)
+
+        self.request = RequestFactory().post("/")
+        self.request.user = AnonymousUser()
+        self.request.session = {
+            "clerk": self.clerk.pk,
+            "clerk_token": self.clerk.access_key,
+            "counter": self.counter.pk,
+        }
+
+    def test_transition(self):
+        self.assertTrue(ItemStateLog.objects.transition(
+            self.item, (Item.ADVERTISED, Item.BROUGHT), Item.STAGED, request=self.request, hidden=False))
+        self.assertEqual((Item.STAGED, False), (self.item.state, self.item.hidden))
+
+        db_item = Item.objects.get(pk=self.item.pk)
+        self.assertEqual((Item.STAGED, False), (db_item.state, db_item.hidden))
+        log = ItemStateLog.objects.get(item=self.item)
+        self.assertEqual((Item.BROUGHT, Item.STAGED), (log.old_state, log.new_state))
+        self.assertEqual((self.clerk.pk, self.counter.pk), (log.clerk_id, log.counter_id))
+
+    def test_stale_item(self):
+        # Another counter changes the item after it has been read.
+        Item.objects.filter(pk=self.item.pk).update(state=Item.STAGED)
+
+        self.assertFalse(ItemStateLog.objects.transition(self.item, Item.BROUGHT, Item.STAGED, request=self.request))
+        self.assertEqual(Item.STAGED, self.item.state)
+        self.assertFalse(ItemStateLog.objects.filter(item=self.item).exists())
+
+
+class BufferedLogTest(TestCase, ResultMixin):
+    def setUp(self):
+        self.client = Client()
+        self.event = EventFactory()
+        self.vendor = VendorFactory(event=self.event)
+        self.items = ItemFactory.create_batch(5, vendor=self.vendor, state=Item.BROUGHT)
+        self.box = BoxFactory(adopt=True, items=self.items, box_number=1)
+
+        self.counter = CounterFactory(event=self.event)
+        self.clerk = ClerkFactory(event=self.event)
+
+        self.api = Api(client=self.client, event=self.event)
+        self.api.clerk_login(code=self.clerk.get_code(), counter=self.counter.identifier)
+
+    @staticmethod
+    def _log_inserts(queries):
+        return [q for q in queries if q["sql"].startswith('INSERT INTO "kirppu_itemstatelog"')]
+
+    def test_single_insert(self):
+        self.assertSuccess(self.api.receipt_start())
+        self.assertSuccess(self.api.box_item_reserve(box_number=1, box_item_count=4))
+        log_count = ItemStateLog.objects.count()
+
+        # Releasing box items removes them from the receipt one by one.
+        with CaptureQueriesContext(connection) as queries:
+            self.assertSuccess(self.api.box_item_release(box_number=1, box_item_count=3))
+        self.assertEqual(1, len(self._log_inserts(queries)))
+        self.assertEqual(log_count + 3, ItemStateLog.objects.count())
+
+    def test_failed_nested_block_discarded(self):
+        item, other = self.items[:2]
+        request = RequestFactory().post("/")
+        request.user = AnonymousUser()
+        request.session = {}
+
+        with ItemStateLog.objects.buffered() as buffer:
+            ItemStateLog.objects.log_state(item, Item.STAGED, request=request)
+            try:
+                with ItemStateLog.objects.buffered():
+                    ItemStateLog.objects.log_state(other, Item.STAGED, request=request)
+                    raise ValueError()
+            except ValueError:
+                pass
+            with ItemStateLog.objects.buffered():
+                ItemStateLog.objects.log_state(other, Item.SOLD, request=request)
+
+            self.assertEqual(0, ItemStateLog.objects.count())
+            self.assertEqual(2, len(buffer))
+
+        self.assertEqual(
+            [(item.pk, Item.STAGED), (other.pk, Item.SOLD)],
+            list(ItemStateLog.objects.order_by("pk").values_list("item_id", "new_state")),
+        )
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+from django.core.cache import cache
+from django.test import Client, TransactionTestCase
+from django.urls import reverse
+
+from .factories import *
+from .api_access import Api
+from . import ResultMixin
+from .. import event_cache
+from ..models import EventDataVersion, Item
+
+"""
+Data versions are incremented after commit, so these tests are run outside a test transaction.
+"""
+
+
+class StatsCacheTest(TransactionTestCase, ResultMixin):
+    def setUp(self):
+        event_cache.invalidate()
+        cache.clear()
+
+        self.event = EventFactory()
+        self.vendor = VendorFactory(event=self.event)
+        self.items = ItemFactory.create_batch(3, vendor=self.vendor, itemtype=ItemTypeFactory(event=self.event))
+
+        self.counter = CounterFactory(event=self.event)
+        self.clerk = ClerkFactory(event=self.event)
+        self.clerk_client = Client()
+        self.api = Api(client=self.clerk_client, event=self.event)
+        self.assertSuccess(self.api.clerk_login(code=self.clerk.get_code(), counter=self.counter.identifier))
+
+        user = UserFactory()
+        EventPermissionFactory(event=self.event, user=user, can_see_statistics=True)
+        self.client = Client()
+        self.client.force_login(user)
+
+    def tearDown(self):
+        event_cache.invalidate()
+        cache.clear()
+
+    def _version(self):
+        return EventDataVersion.objects.of(self.event)
+
+    def test_version(self):
+        version = self._version()
+        self.assertSuccess(self.api.item_checkin(code=self.items[0].code))
+        self.assertLess(version, self._version())
+
+        version = self._version()
+        item = Item.objects.get(pk=self.items[1].pk)
+        item.lost_property = True
+        item.save(update_fields=("lost_property",))
+        self.assertEqual(version, self._version())
+
+        item.hidden = True
+        item.save(update_fields=("hidden",))
+        self.assertLess(version, self._version())
+
+        version = self._version()
+        receipt = self.assertSuccess(self.api.receipt_start()).json()
+        self.assertEqual(version, self._version())
+        self.assertSuccess(self.api.receipt_finish(id=receipt["id"]))
+        self.assertLess(version, self._version())
+
+    def test_not_modified(self):
+        for name in ("kirppu:stats_view", "kirppu:statistical_stats_view"):
+            url = reverse(name, kwargs={"event_slug": self.event.slug})
+            response = self.client.get(url)
+            self.assertEqual(200, response.status_code)
+            etag = response["ETag"]
+
+            self.assertEqual(304, self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code)
+            ItemFactory(vendor=self.vendor, itemtype=self.items[0].itemtype)
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(200, response.status_code)
+            self.assertNotEqual(etag, response["ETag"])
+
+    def test_cached_csv(self):
+        self.assertSuccess(self.api.item_checkin(code=self.items[0].code))
+        first = self.api.stats_sales_data(prices="true")
+        data = b"".join(first.streaming_content)
+
+        # Session, counter, clerk and the data version, but not the logs.
+        with self.assertNumQueries(4):
+            response = self.api.stats_sales_data(prices="true")
+        self.assertEqual(data, b"".join(response.streaming_content))
+        self.assertEqual(
+            304, self.clerk_client.get(self.api.stats_sales_data.url, data=dict(prices="true"),
+                                       HTTP_IF_NONE_MATCH=first["ETag"]).status_code)
+
+        self.assertSuccess(self.api.item_checkin(code=self.items[1].code))
+        response = self.api.stats_sales_data(prices="true")
+        self.assertNotEqual(data, b"".join(response.streaming_content))
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+from decimal import Decimal
+from io import StringIO
+
+from django.core.management import call_command, CommandError
+from django.test import Client, TestCase, override_settings
+
+from .factories import *
+from .api_access import Api
+from . import ResultMixin
+from ..models import Item, ReceiptExtraRow, VendorBalance
+
+
+@override_settings(KIRPPU_ALLOW_PROVISION_FUNCTIONS=True)
+class VendorBalanceTest(TestCase, ResultMixin):
+    def setUp(self):
+        self.client = Client()
+
+        self.event = EventFactory(provision_function="(* 0.50 (.count sold_and_compensated))")
+        self.vendor = VendorFactory(event=self.event)
+        self.items = ItemFactory.create_batch(
+            4, vendor=self.vendor, itemtype=ItemTypeFactory(event=self.event), price="2.50")
+
+        self.counter = CounterFactory(event=self.event)
+        self.clerk = ClerkFactory(event=self.event)
+        self.api = Api(client=self.client, event=self.event)
+        self.assertSuccess(self.api.clerk_login(code=self.clerk.get_code(), counter=self.counter.identifier))
+
+    def _assert_reconciled(self):
+        # Raises CommandError if the balances differ from the items and receipts.
+        call_command("reconcile_vendor_balances", check=True, stdout=StringIO())
+
+    def _balance(self):
+        balance = VendorBalance.objects.of(self.vendor.pk)
+        return (balance.sold_count, balance.sold_sum, balance.compensated_count, balance.compensated_sum,
+                balance.provision_sum)
+
+    def _sell(self, items):
+        for item in items:
+            self.assertSuccess(self.api.item_checkin(code=item.code))
+        receipt = self.assertSuccess(self.api.receipt_start()).json()
+        for item in items:
+            self.assertSuccess(self.api.item_reserve(code=item.code))
+        return receipt
+
+    def test_sale_and_compensation(self):
+        receipt = self._sell(self.items[:3])
+        self.assertEqual((0, 0, 0, 0, 0), self._balance())
+        self.assertSuccess(self.api.receipt_finish(id=receipt["id"]))
+        self.assertEqual((3, Decimal("7.50"), 0, 0, 0), self._balance())
+
+        compensable = self.assertSuccess(self.api.compensable_items(vendor=self.vendor.pk)).json()
+        self.assertEqual(3, len(compensable["items"]))
+        self.assertEqual(-150, compensable["extras"][0]["value"])
+
+        self.assertSuccess(self.api.item_compensate_start(vendor=self.vendor.pk))
+        for item in self.items[:2]:
+            self.assertSuccess(self.api.item_compensate(code=item.code))
+        self.assertSuccess(self.api.item_compensate_end())
+        self.assertEqual((1, Decimal("2.50"), 2, Decimal("5.00"), Decimal("-1.00")), self._balance())
+        self._assert_reconciled()
+
+        ReceiptExtraRow.objects.filter(receipt__vendor=self.vendor).delete()
+        self.assertEqual((1, Decimal("2.50"), 2, Decimal("5.00"), 0), self._balance())
+        self._assert_reconciled()
+
+    def test_abort(self):
+        receipt = self._sell(self.items)
+        self.assertSuccess(self.api.receipt_abort(id=receipt["id"]))
+        self.assertEqual((0, 0, 0, 0, 0), self._balance())
+        self._assert_reconciled()
+
+    def test_reconcile(self):
+        self.assertSuccess(self.api.receipt_finish(id=self._sell(self.items[:1])["id"]))
+        VendorBalance.objects.filter(vendor=self.vendor).update(sold_count=5)
+        self.assertRaises(CommandError, self._assert_reconciled)
+
+        out = StringIO()
+        call_command("reconcile_vendor_balances", event=self.event.slug, stdout=out)
+        self.assertIn("1 balances", out.getvalue())
+        self.assertEqual((1, Decimal("2.50"), 0, 0, 0), self._balance())
+        self._assert_reconciled()
+        self.assertEqual(Item.SOLD, Item.objects.get(pk=self.items[0].pk).state)
@@ -34,6 +34,7 @@ from .views.mobile import index as mobile_index, logout as mobile_logout
 from .views.vendors import change_vendor, create_vendor
 from .views.accounting import accounting_receipt_view
 from .views.item_dump import dump_items_view
+from .views.instrumentation import instrumentation_view
 
 __author__ = 'jyrkila'
 
@@ -81,6 +82,7 @@ event_urls = [
 
 common_urls = [
     path(r'', front_page, name="front_page"),
+    path(r'instrumentation/checkout_api/', instrumentation_view, name="instrumentation"),
 ]
 
 event_urls.extend([
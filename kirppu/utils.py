@@ -1,6 +1,11 @@
 import datetime
+import functools
 from functools import wraps
+import inspect
+import operator
+import types
 from django.core.exceptions import PermissionDenied
+from django.db.models.query_utils import DeferredAttribute
 import django.forms
 from django.http.response import HttpResponseForbidden, HttpResponseBadRequest
 from django.utils.translation import gettext as _
@@ -28,11 +33,14 @@ def model_dict_fn(*args, **kwargs):
         >>> C().as_dict(), C().as_renamed(), C().as_called()
         ({'a': 3}, {'renamed': 3}, {'multi': 6})
 
+    The way each field is read is resolved once per class on first call, into a list of
+    (key, getter) pairs, so that the per-instance work is only calling the getters.
+
     :param args: List of fields.
     :param kwargs: Fields to be renamed or overridden with another function call.
     :return: Function.
     """
-    access = kwargs.pop("__access_fn", lambda self, value: getattr(self, value))
+    access = kwargs.pop("__access_fn", None)
     extend = kwargs.pop("__extend", None)
     fields = {}
     if extend:
@@ -41,31 +49,108 @@ def model_dict_fn(*args, **kwargs):
         fields[plain_key] = plain_key
     fields.update(kwargs)
 
+    plans = {}
+
     def model_dict(self, exclude=None):
         """
         Get model fields as dictionary (for JSON/AJAX usage). Fields returned:
         {0}
         """
-        exclude = exclude or ()
-        ret = {}
-        for key, value in fields.items():
-            if key in exclude:
-                continue
-            if callable(value):
-                ret[key] = value(self)
-            elif value is None:
-                if value in ret:
-                    del ret[value]
-            else:
-                ret[key] = access(self, value)
-                if callable(ret[key]):
-                    ret[key] = ret[key]()
-        return ret
+        cls = type(self)
+        plan = plans.get(cls)
+        if plan is None:
+            plan = plans[cls] = _compile_plan(cls, fields, access)
+        if exclude:
+            return {key: getter(self) for key, getter in plan if key not in exclude}
+        return {key: getter(self) for key, getter in plan}
     model_dict.__doc__ = model_dict.__doc__.format(", ".join(fields.keys()))
     model_dict.fields = fields  # "Base" field dictionary for extend.
     return model_dict
 
 
+def _compile_plan(cls, fields, access):
+    """
+    Resolve how `model_dict_fn` reads the fields from instances of `cls`.
+
+    :return: List of (key, getter) pairs.
+    """
+    plan = []
+    for key, value in fields.items():
+        if value is None:
+            continue
+        if callable(value):
+            plan.append((key, value))
+        elif access is not None:
+            plan.append((key, _custom_getter(access, value)))
+        else:
+            plan.append((key, _attribute_getter(cls, value)))
+    return plan
+
+
+def _call_if_callable(value):
+    return value() if callable(value) else value
+
+
+def _custom_getter(access, name):
+    return lambda self: _call_if_callable(access(self, name))
+
+
+def _attribute_getter(cls, name):
+    """
+    Get a function reading attribute `name` from instances of `cls`, calling it if it is a method.
+    Attributes that cannot be resolved from the class are read and checked on every call.
+    """
+    attr = inspect.getattr_static(cls, name, None)
+    if isinstance(attr, property):
+        return lambda self: _call_if_callable(attr.fget(self))
+    if isinstance(attr, types.FunctionType):
+        return attr
+    if isinstance(attr, functools.partialmethod) and not attr.args:
+        # E.g. get_FOO_display of model fields with choices.
+        return functools.partial(attr.func, **attr.keywords)
+    if isinstance(attr, DeferredAttribute):
+        # Model field. Values of these are never callable.
+        return operator.attrgetter(name)
+    return lambda self: _call_if_callable(getattr(self, name))
+
+
+def model_values_fn(*args, **kwargs):
+    """
+    Return a function that will create dictionaries from rows of a QuerySet, read with `values()`
+    without instantiating model objects. Bulk counterpart of `model_dict_fn`.
+
+    :param args: List of fields.
+    :param kwargs: Fields to be renamed. Value is either a field lookup, or a tuple of field lookup
+        and a function converting the read value.
+    :return: Function taking a QuerySet and optional extra field lookups, which are included as is.
+    """
+    plan = [(key, key, None) for key in args]
+    for key, value in kwargs.items():
+        if isinstance(value, tuple):
+            plan.append((key, value[0], value[1]))
+        else:
+            plan.append((key, value, None))
+    lookups = tuple(dict.fromkeys(lookup for _key, lookup, _convert in plan))
+
+    def model_values(query, *extra):
+        """
+        Get rows of the query as dictionaries. Fields returned:
+        {0}
+        """
+        result = []
+        for row in query.values(*lookups, *extra):
+            value = {
+                key: row[lookup] if convert is None else convert(row[lookup])
+                for key, lookup, convert in plan
+            }
+            for lookup in extra:
+                value[lookup] = row[lookup]
+            result.append(value)
+        return result
+    model_values.__doc__ = model_values.__doc__.format(", ".join(key for key, _lookup, _convert in plan))
+    return model_values
+
+
 def format_datetime(dt):
     """
     Format given datetime in RFC8601 format, that is used with moment.js.
@@ -5,12 +5,13 @@ import typing
 
 from django.contrib.auth.decorators import login_required
 from django.core.exceptions import PermissionDenied
-from django.db.models import Sum
+from django.db.models import Prefetch, Sum
 from django.shortcuts import get_object_or_404
 from django.utils.translation import gettext_lazy as _, pgettext_lazy, gettext
 from django.utils import timezone
 
 from .csv_utils import csv_streamer_view, strip_generator
+from .. import archive
 from ..models import (
     Event,
     EventPermission,
@@ -19,7 +20,9 @@ from ..models import (
     ReceiptExtraRow,
     ReceiptItem,
     RemoteEvent,
+    VendorBalance,
     decimal_to_transport,
+    uses_event_columns,
 )
 
 __all__ = [
@@ -73,31 +76,37 @@ def accounting_receipt(output, event: typing.Union[Event, RemoteEvent]):
     # Used here and later for buffer streaming and clearing in case of StringIO.
     yield
 
-    receipts = (Receipt.objects
-                .using(event.get_real_database_alias())
-                .filter(clerk__event=event, status=Receipt.FINISHED)
-                .prefetch_related("receiptitem_set", "receiptitem_set__item", "extra_rows")
-                .order_by("end_time")
-                )
+    database = event.get_real_database_alias()
+    if archive.is_archived(event):
+        receipts = _archived_receipts(event)
+    else:
+        receipts = _receipts(event, database)
 
     impl = AccountingWriter(writer)
-    for receipt in receipts:
-        impl.write_receipt(receipt)
+    for receipt, rows, extra_rows in receipts:
+        impl.write_receipt(receipt, rows, extra_rows)
         yield
     impl.finish()
     yield
 
-    items_paid_out = (Item.objects
-                      .using(event.get_real_database_alias())
-                      .filter(vendor__event=event, state=Item.COMPENSATED)
-                      .aggregate(sum=Sum("price"))
-                      )
-    items_paid_out = decimal_to_transport(items_paid_out["sum"] or 0)
-    items_forfeited = (Item.objects
-                       .using(event.get_real_database_alias())
-                       .filter(vendor__event=event, state=Item.SOLD)
-                       .aggregate(sum=Sum("price")))
-    items_forfeited = decimal_to_transport(items_forfeited["sum"] or 0)
+    if VendorBalance.objects.is_maintained(database):
+        balances = (VendorBalance.objects
+                    .filter(vendor__event=event)
+                    .aggregate(paid_out=Sum("compensated_sum"), forfeited=Sum("sold_sum"))
+                    )
+    else:
+        balances = {
+            "paid_out": (Item.objects
+                         .using(database)
+                         .filter(vendor__event=event, state=Item.COMPENSATED)
+                         .aggregate(sum=Sum("price"))["sum"]),
+            "forfeited": (Item.objects
+                          .using(database)
+                          .filter(vendor__event=event, state=Item.SOLD)
+                          .aggregate(sum=Sum("price"))["sum"]),
+        }
+    items_paid_out = decimal_to_transport(balances["paid_out"] or 0)
+    items_forfeited = decimal_to_transport(balances["forfeited"] or 0)
 
     # Basic sanity checking. Does not really give a straight explanation of why something is amiss.
     writer.writerow(())
@@ -114,6 +123,52 @@ def accounting_receipt(output, event: typing.Union[Event, RemoteEvent]):
     yield
 
 
+def _receipts(event: typing.Union[Event, RemoteEvent], database: str):
+    """Finished receipts of the Event with their item rows and extra rows, ordered by end time."""
+    receipts = (Receipt.objects
+                .using(database)
+                .filter(status=Receipt.FINISHED)
+                .order_by("end_time")
+                )
+    if uses_event_columns(database):
+        receipts = receipts \
+            .filter(event=event) \
+            .prefetch_related("receiptitem_set", "receiptitem_set__item", "extra_rows")
+    else:
+        # The event columns may be missing in other databases.
+        receipts = receipts \
+            .filter(clerk__event=event) \
+            .defer("event") \
+            .prefetch_related(
+                Prefetch("receiptitem_set", queryset=ReceiptItem.objects.using(database).defer("event")),
+                "receiptitem_set__item",
+                "extra_rows",
+            )
+    for receipt in receipts:
+        yield receipt, receipt.receiptitem_set.all(), receipt.extra_rows.all()
+
+
+def _archived_receipts(event: Event):
+    """Finished receipts of an archived Event with their rows, in the same order as `_receipts`."""
+    rows = defaultdict(list)
+    for row in archive.read_objects(event, "receiptitem"):
+        rows[row.receipt_id].append(row)
+    extra_rows = defaultdict(list)
+    for row in archive.read_objects(event, "receiptextrarow"):
+        extra_rows[row.receipt_id].append(row)
+
+    # Items stay in the database.
+    items = Item.objects.in_bulk({row.item_id for receipt_rows in rows.values() for row in receipt_rows})
+    for receipt_rows in rows.values():
+        for row in receipt_rows:
+            row.item = items[row.item_id]
+
+    receipts = [r for r in archive.read_objects(event, "receipt") if r.status == Receipt.FINISHED]
+    receipts.sort(key=lambda r: r.end_time)
+    for receipt in receipts:
+        yield receipt, rows[receipt.pk], extra_rows[receipt.pk]
+
+
 class AccountingWriter(object):
     def __init__(self, writer):
         self.i = 1
@@ -125,16 +180,16 @@ class AccountingWriter(object):
         self.total_payout = 0
         self.total_forfeit = 0
 
-    def write_receipt(self, receipt):
+    def write_receipt(self, receipt: Receipt, rows, extra_rows):
         if receipt.type == Receipt.TYPE_PURCHASE:
-            self._write_purchase(receipt)
+            self._write_purchase(receipt, rows)
         elif receipt.type == Receipt.TYPE_COMPENSATION:
-            self._write_compensation(receipt)
+            self._write_compensation(receipt, rows, extra_rows)
 
-    def _write_purchase(self, receipt: Receipt):
+    def _write_purchase(self, receipt: Receipt, rows):
         # Group receipt data by vendor.
         receipt_vendors = defaultdict(_zero_fn)
-        for row in receipt.receiptitem_set.all():
+        for row in rows:
             if row.action == ReceiptItem.ADD:
                 item = row.item
                 vid = item.vendor_id
@@ -156,8 +211,7 @@ class AccountingWriter(object):
             ))
             self.i += 1
 
-    def _write_compensation(self, receipt: Receipt):
-        rows = receipt.receiptitem_set.all()
+    def _write_compensation(self, receipt: Receipt, rows, extra_rows):
         common_vendor = receipt.vendor_id
         if any(common_vendor != r.item.vendor_id for r in rows):
             raise ValueError("Invalid receipt configuration")
@@ -171,10 +225,10 @@ class AccountingWriter(object):
         self.total_balance -= compensation_sum
         self.total_payout += compensation_sum
 
-        if receipt.extra_rows.count() > 0:
+        if extra_rows:
             provision = 0
             provision_fix = 0
-            for r in receipt.extra_rows.all():
+            for r in extra_rows:
                 if r.type == ReceiptExtraRow.TYPE_PROVISION:
                     provision += r.value_cents
                 elif r.type == ReceiptExtraRow.TYPE_PROVISION_FIX:
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+from django.contrib.auth.decorators import login_required
+from django.core.exceptions import PermissionDenied
+from django.http.response import JsonResponse
+
+from .. import instrumentation
+
+__all__ = [
+    "instrumentation_view",
+]
+
+
+@login_required
+def instrumentation_view(request):
+    """
+    Percentiles of checkout API call metrics, by function name.
+    Data published by all processes is returned, unless `local` parameter is given.
+    """
+    if not request.user.is_staff:
+        raise PermissionDenied
+
+    if request.GET.get("local") is not None:
+        data = instrumentation.snapshot()
+    else:
+        data = instrumentation.collect()
+    return JsonResponse(data, json_dumps_params={"indent": 2})
@@ -16,7 +16,7 @@ from django.utils.translation import gettext_lazy as _
 from ipware.ip import get_ip
 from ratelimit.utils import is_ratelimited
 
-from ..models import Box, Event, Item, Receipt, ReceiptExtraRow, TemporaryAccessPermit, TemporaryAccessPermitLog, Vendor
+from ..models import Box, Event, Item, TemporaryAccessPermit, TemporaryAccessPermitLog, Vendor
 from ..provision import Provision
 from ..templatetags.kirppu_login import login_url, logout_url
 from ..templatetags.kirppu_tags import format_price
@@ -252,12 +252,7 @@ def _data_view(request, event: Event, permit):
 
         compensated = tables["compensated"]
         if compensated.items:
-            current_provision = ReceiptExtraRow.objects.using(database).filter(
-                type__in=(ReceiptExtraRow.TYPE_PROVISION, ReceiptExtraRow.TYPE_PROVISION_FIX),
-                receipt__type=Receipt.TYPE_COMPENSATION,
-                receipt__items__vendor=vendor,
-            ).distinct().aggregate(sum=models.Sum("value"))["sum"] or Decimal(0)
-
+            current_provision = Provision.paid_provisions(vendor.id, database)
             current_provision = Item.price_fmt_for(current_provision)
             compensated.pre_sum_line = (_("provision:"), current_provision)
             compensated.sum += current_provision
@@ -1,4 +1,5 @@
 from collections import namedtuple
+from decimal import Decimal
 from functools import wraps
 import json
 import typing
@@ -27,20 +28,21 @@ from django.shortcuts import (
 )
 from django.utils import timezone
 from django.utils.formats import localize
-from django.utils.translation import gettext as _
+from django.utils.translation import gettext as _, get_language
 from django.views.csrf import csrf_failure as django_csrf_failure
 from django.views.decorators.csrf import ensure_csrf_cookie
 from django.views.decorators.http import require_http_methods
 from django.views.generic import RedirectView
 
-from ..checkout_api import clerk_logout_fn
-from .. import ajax_util
+from ..checkout_api import ajax_api_version, clerk_logout_fn
+from .. import ajax_util, archive, stats_cache
 from ..forms import ItemRemoveForm, VendorItemForm, VendorBoxForm, remove_item_from_receipt as _remove_item_from_receipt
 from ..fields import ItemPriceField
 from ..models import (
     Box,
     Clerk,
     Event,
+    EventDataVersion,
     EventPermission,
     Item,
     ItemType,
@@ -48,8 +50,9 @@ from ..models import (
     UserAdapter,
     UIText,
     Receipt,
+    uses_event_columns,
 )
-from ..stats import ItemCountData, ItemEurosData
+from ..stats import ItemCollectionData, ItemStatisticsData
 from ..util import get_form
 from ..utils import (
     barcode_view,
@@ -281,6 +284,7 @@ def all_to_print(request, event_slug):
     items = Item.objects.filter(vendor=vendor).filter(printed=False).filter(box__isnull=True)
 
     items.update(printed=True)
+    EventDataVersion.objects.bump([event.pk])
 
     return HttpResponse()
 
@@ -708,6 +712,7 @@ def checkout_view(request, event_slug):
         'CURRENCY': settings.KIRPPU_CURRENCY,
         'PURCHASE_MAX': settings.KIRPPU_MAX_PURCHASE,
         'event': event,
+        'checkout_js_version': ajax_api_version(),
     }
     if settings.KIRPPU_AUTO_CLERK and settings.DEBUG:
         if settings.KIRPPU_AUTO_CLERK != "*":
@@ -739,6 +744,7 @@ def overseer_view(request, event_slug):
             'itemtypes': ItemType.as_tuple(event),
             'itemstates': Item.STATE,
             'CURRENCY': settings.KIRPPU_CURRENCY,
+            'checkout_js_version': ajax_api_version(),
         }
         return render(request, 'kirppu/app_overseer.html', context)
 
@@ -760,20 +766,47 @@ def _statistics_access(fn):
     return inner
 
 
+def _versioned_stats(fn):
+    """
+    Serve statistics views conditionally by the data version of the Event, see `stats_cache`.
+    The view receives the version as its third argument.
+    """
+    @wraps(fn)
+    def inner(request, event, *args, **kwargs):
+        version = EventDataVersion.objects.of(event)
+        return stats_cache.conditional_response(
+            request, version, lambda: fn(request, event, version, *args, **kwargs),
+            request.user.pk, get_language())
+    return inner
+
+
 @ensure_csrf_cookie
 @_statistics_access
-def stats_view(request, event: Event):
+@_versioned_stats
+def stats_view(request, event: Event, version):
     """Stats view."""
-    original_event = event
-    event = event.get_real_event()
-    ic = ItemCountData(ItemCountData.GROUP_ITEM_TYPE, event=event)
-    ie = ItemEurosData(ItemEurosData.GROUP_ITEM_TYPE, event=event)
+    context = stats_cache.cached_result(
+        "stats_view", event, version, lambda: _stats_context(event.get_real_event()), get_language())
+    context.update(
+        event=event.get_real_event(),
+        event_slug=event.slug,
+        CURRENCY=settings.KIRPPU_CURRENCY["raw"],
+    )
+
+    return render(request, 'kirppu/app_stats.html', context)
+
+
+def _stats_context(event: Event):
     sum_name = _("Sum")
-    item_types = (ItemType.objects
-                  .using(event.get_real_database_alias())
-                  .filter(event=event)
-                  .order_by("order")
-                  .values_list("id", "title"))
+    item_types = list(ItemType.objects
+                      .using(event.get_real_database_alias())
+                      .filter(event=event)
+                      .order_by("order")
+                      .values_list("id", "title"))
+    item_type_data = ItemStatisticsData(ItemCollectionData.GROUP_ITEM_TYPE, event=event,
+                                        item_types=[item_type for item_type, _type_name in item_types])
+    ic = item_type_data.counts
+    ie = item_type_data.euros
 
     number_of_items = [
         ic.data_set(item_type, type_name)
@@ -789,8 +822,9 @@ def stats_view(request, event: Event):
 
     vendor_item_data_counts = []
     vendor_item_data_euros = []
-    vic = ItemCountData(ItemCountData.GROUP_VENDOR, event=event)
-    vie = ItemEurosData(ItemEurosData.GROUP_VENDOR, event=event)
+    vendor_data = ItemStatisticsData(ItemCollectionData.GROUP_VENDOR, event=event)
+    vic = vendor_data.counts
+    vie = vendor_data.euros
     vie.use_cents = True
     vendor_item_data_row_size = 0
 
@@ -804,19 +838,14 @@ def stats_view(request, event: Event):
         vendor_item_data_counts.append(counts)
         vendor_item_data_euros.append(euros)
 
-    context = {
-        'event': event,
-        'event_slug': original_event.slug,
+    return {
         'number_of_items': number_of_items,
         'number_of_euros': number_of_euros,
         'vendor_item_data_counts': vendor_item_data_counts,
         'vendor_item_data_euros': vendor_item_data_euros,
         'vendor_item_data_row_size': vendor_item_data_row_size,
-        'CURRENCY': settings.KIRPPU_CURRENCY["raw"],
     }
 
-    return render(request, 'kirppu/app_stats.html', context)
-
 
 @ensure_csrf_cookie
 @_statistics_access
@@ -857,8 +886,24 @@ def _float_array(array):
 
 @ensure_csrf_cookie
 @_statistics_access
-def statistical_stats_view(request, event: Event):
-    original_event = event
+@_versioned_stats
+def statistical_stats_view(request, event: Event, version):
+    """
+    General statistics view.
+
+    Query budget: the data version, and unless cached, one aggregate over items, one over boxes,
+    one count of vendors, and the compensation and purchase lists, independent of the event size.
+    """
+    context = stats_cache.cached_result(
+        "statistical_stats_view", event, version, lambda: _statistical_stats_context(event))
+    context.update(
+        event=event,
+        CURRENCY=settings.KIRPPU_CURRENCY["raw"],
+    )
+    return render(request, "kirppu/general_stats.html", context)
+
+
+def _statistical_stats_context(event: Event):
     event = event.get_real_event()
     database = event.get_real_database_alias()
     brought_states = (Item.BROUGHT, Item.STAGED, Item.SOLD, Item.COMPENSATED, Item.RETURNED)
@@ -867,19 +912,35 @@ def statistical_stats_view(request, event: Event):
     _vendors = Vendor.objects.using(database).filter(event=event)
     _boxes = Box.objects.using(database).filter(representative_item__vendor__event=event)
 
-    registered = _items.count()
-    deleted = _items.filter(hidden=True).count()
-    brought = _items.filter(state__in=brought_states).count()
-    sold = _items.filter(state__in=(Item.STAGED, Item.SOLD, Item.COMPENSATED)).count()
-    printed_deleted = _items.filter(hidden=True, printed=True).count()
-    deleted_brought = _items.filter(hidden=True, state__in=brought_states).count()
-    printed_not_brought = _items.filter(printed=True, state=Item.ADVERTISED).count()
+    def count(**kwargs):
+        return models.Count("pk", filter=models.Q(**kwargs))
+
+    items = _items.aggregate(
+        registered=models.Count("pk"),
+        deleted=count(hidden=True),
+        brought=count(state__in=brought_states),
+        sold=count(state__in=(Item.STAGED, Item.SOLD, Item.COMPENSATED)),
+        printed_deleted=count(hidden=True, printed=True),
+        deleted_brought=count(hidden=True, state__in=brought_states),
+        printed_not_brought=count(printed=True, state=Item.ADVERTISED),
+        in_box=count(box__isnull=False),
+        not_in_box=count(box__isnull=True),
+        in_deleted_boxes=count(box__representative_item__hidden=True),
+        vendors=models.Count("vendor", distinct=True, filter=models.Q(state__in=brought_states)),
+        vendors_total=models.Count("vendor", distinct=True),
+    )
+    boxes = _boxes.aggregate(
+        registered=models.Count("pk"),
+        deleted=count(representative_item__hidden=True),
+    )
 
-    items_in_box = _items.filter(box__isnull=False).count()
-    items_not_in_box = _items.filter(box__isnull=True).count()
-    registered_boxes = _boxes.count()
-    deleted_boxes = _boxes.filter(representative_item__hidden=True).count()
-    items_in_deleted_boxes = _items.filter(box__representative_item__hidden=True).count()
+    registered = items["registered"]
+    deleted = items["deleted"]
+    brought = items["brought"]
+    sold = items["sold"]
+    registered_boxes = boxes["registered"]
+    deleted_boxes = boxes["deleted"]
+    items_in_deleted_boxes = items["in_deleted_boxes"]
 
     general = {
         "registered": registered,
@@ -887,17 +948,17 @@ def statistical_stats_view(request, event: Event):
         "deletedOfRegistered": (deleted * 100.0 / registered) if registered > 0 else 0,
         "brought": brought,
         "broughtOfRegistered": (brought * 100.0 / registered) if registered > 0 else 0,
-        "broughtDeleted": deleted_brought,
-        "printedDeleted": printed_deleted,
-        "printedNotBrought": printed_not_brought,
+        "broughtDeleted": items["deleted_brought"],
+        "printedDeleted": items["printed_deleted"],
+        "printedNotBrought": items["printed_not_brought"],
         "sold": sold,
         "soldOfBrought": (sold * 100.0 / brought) if brought > 0 else 0,
-        "vendors": _vendors.filter(item__state__in=brought_states).distinct().count(),
-        "vendorsTotal": _vendors.annotate(items=models.Count("item__id")).filter(items__gt=0).count(),
+        "vendors": items["vendors"],
+        "vendorsTotal": items["vendors_total"],
         "vendorsInMobileView": _vendors.filter(mobile_view_visited=True).count(),
 
-        "itemsInBox": items_in_box,
-        "itemsNotInBox": items_not_in_box,
+        "itemsInBox": items["in_box"],
+        "itemsNotInBox": items["not_in_box"],
         "registeredBoxes": registered_boxes,
         "deletedBoxes": deleted_boxes,
         "deletedOfRegisteredBoxes": (deleted_boxes * 100.0 / registered_boxes) if registered_boxes > 0 else 0,
@@ -909,21 +970,27 @@ def statistical_stats_view(request, event: Event):
         .annotate(v_sum=models.Sum("item__price")).order_by("v_sum").values_list("v_sum", flat=True)
     compensations = [float(e) for e in compensations]
 
-    purchases = list(
-        Receipt.objects.using(database).filter(counter__event=event, status=Receipt.FINISHED, type=Receipt.TYPE_PURCHASE)
-        .order_by("total")
-        .values_list("total", flat=True)
-    )
+    if archive.is_archived(event):
+        purchases = sorted(
+            Decimal(row["total"])
+            for row in archive.read_rows(event, "receipt")
+            if row["status"] == Receipt.FINISHED and row["type"] == Receipt.TYPE_PURCHASE
+        )
+    else:
+        purchases = Receipt.objects.using(database).filter(status=Receipt.FINISHED, type=Receipt.TYPE_PURCHASE)
+        if uses_event_columns(database):
+            purchases = purchases.filter(event=event)
+        else:
+            purchases = purchases.filter(counter__event=event)
+        purchases = list(purchases.order_by("total").values_list("total", flat=True))
     purchases = [float(e) for e in purchases]
     general["purchases"] = len(purchases)
 
-    return render(request, "kirppu/general_stats.html", {
-        "event": original_event,
+    return {
         "compensations": _float_array(compensations),
         "purchases": _float_array(purchases),
         "general": general,
-        "CURRENCY": settings.KIRPPU_CURRENCY["raw"],
-    })
+    }
 
 
 def vendor_view(request, event_slug):
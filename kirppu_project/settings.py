@@ -357,6 +357,31 @@ KIRPPU_EXHAUST_SHORT_CODE_ON_LOGOUT = env.bool("KIRPPU_EXHAUST_SHORT_CODE_ON_LOG
 KIRPPU_SHORT_CODE_LENGTH = 5
 KIRPPU_MOBILE_LOGIN_RATE_LIMIT = "5/m"
 
+# Seconds an Event looked up by checkout API calls is kept in process-local cache. Zero disables the cache.
+KIRPPU_EVENT_CACHE_TTL = env.int("KIRPPU_EVENT_CACHE_TTL", default=30)
+
+# Seconds computed statistics are kept in the cache for the data version of an Event. Zero disables the cache.
+KIRPPU_STATS_CACHE_TTL = env.int("KIRPPU_STATS_CACHE_TTL", default=15 * 60)
+
+# Seconds a response of an idempotent checkout API call is kept for replaying to a retried request.
+KIRPPU_IDEMPOTENCY_TTL = env.int("KIRPPU_IDEMPOTENCY_TTL", default=15 * 60)
+
+# Seconds an operation applied from a counter journal is remembered, so that it is not applied again
+# when the journal is synced again. Should cover the time a counter may be offline.
+KIRPPU_COUNTER_JOURNAL_TTL = env.int("KIRPPU_COUNTER_JOURNAL_TTL", default=7 * 24 * 60 * 60)
+
+# Record latency, query count and response size histograms of checkout API calls.
+KIRPPU_INSTRUMENTATION = env.bool("KIRPPU_INSTRUMENTATION", default=False)
+# Seconds between publishing the histograms of a process to the cache, for reading them from other processes.
+KIRPPU_INSTRUMENTATION_PUBLISH_INTERVAL = env.int("KIRPPU_INSTRUMENTATION_PUBLISH_INTERVAL", default=10)
+# Seconds the published histograms of a process are kept after its last publish.
+KIRPPU_INSTRUMENTATION_TTL = env.int("KIRPPU_INSTRUMENTATION_TTL", default=60 * 60)
+
+# Directory for archives of finished events, see `archive_event` management command.
+# Archived rows are deleted from the database, so this must be persistent storage. Archiving is not
+# possible until this is set.
+KIRPPU_ARCHIVE_DIR = env.str("KIRPPU_ARCHIVE_DIR", default=None)
+
 CSRF_FAILURE_VIEW = "kirppu.views.kirppu_csrf_failure"
 
 